@@ -1,15 +1,21 @@
 """Top-level package for BABS."""
 
+import importlib
+
 try:
     from ._version import __version__
 except ImportError:
     __version__ = '0+unknown'
 
-from .bootstrap import BABSBootstrap
-from .check_setup import BABSCheckSetup
-from .interaction import BABSInteraction
-from .merge import BABSMerge
-from .update import BABSUpdate
+# The BABS classes are imported on first use, as they import heavy dependencies
+# (e.g. `datalad.api`) that not every `babs` command needs:
+_CLASS_MODULES = {
+    'BABSBootstrap': '.bootstrap',
+    'BABSCheckSetup': '.check_setup',
+    'BABSInteraction': '.interaction',
+    'BABSMerge': '.merge',
+    'BABSUpdate': '.update',
+}
 
 __all__ = [
     'BABSBootstrap',
@@ -18,3 +24,9 @@ __all__ = [
     'BABSMerge',
     'BABSUpdate',
 ]
+
+
+def __getattr__(name):
+    if name in _CLASS_MODULES:
+        return getattr(importlib.import_module(_CLASS_MODULES[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,16 +1,19 @@
 """This is the main module."""
 
 import configparser
+import json
 import os
 import os.path as op
 import subprocess
+import tempfile
 from dataclasses import replace
 from pathlib import Path
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse
 
-import datalad.api as dlapi
 import pandas as pd
 import yaml
+from filelock import FileLock
 
 from babs.input_datasets import InputDatasets, OutputDatasets
 from babs.scheduler import (
@@ -29,6 +32,7 @@ from babs.utils import (
     get_latest_submitted_jobs_columns,
     get_results_branches,
     identify_running_jobs,
+    read_datalad_dataset_id,
     read_yaml,
     results_status_columns,
     scheduler_status_columns,
@@ -36,12 +40,29 @@ from babs.utils import (
     validate_processing_level,
 )
 
+if TYPE_CHECKING:
+    import datalad.api as dlapi
+
 CONFIG_SECTIONS = ['processing_level', 'queue', 'input_datasets', 'container']
 EMPTY_JOB_STATUS_DF = pd.DataFrame(
     columns=['sub_id', 'ses_id', 'task_id', 'job_id', 'has_results']
 )
 EMPTY_JOB_SUBMIT_DF = pd.DataFrame(columns=['sub_id', 'ses_id', 'task_id', 'job_id', 'state'])
 
+# Where key information of a project that needs `git` to get is cached,
+# in the git directory of `analysis` (see `BABS.output_ria_data_dir`):
+PROJECT_CACHE_FILENAME = 'babs_project_cache.json'
+
+# Per-user git config file with the `safe.directory` entries of shared-group BABS projects,
+# included by the user's global git config (see `BABS.ensure_shared_group_git_safe_directories`):
+GIT_SAFE_DIRECTORIES_PATH = op.join(
+    os.environ.get('XDG_CONFIG_HOME', op.expanduser('~/.config')),
+    'babs',
+    'safe_directories.gitconfig',
+)
+# Each project's entries in that file start with this line, followed by its `analysis` path:
+SAFE_DIRECTORIES_PROJECT_MARKER = '# BABS project: '
+
 
 def _resolve_subpath(project_root: str, value: str, key: str) -> str:
     """Resolve a config-supplied relative path under project_root, rejecting traversal."""
@@ -56,6 +77,55 @@ def _resolve_subpath(project_root: str, value: str, key: str) -> str:
     return str(resolved)
 
 
+def _read_git_safe_directories(path: str) -> dict[str, list[str]]:
+    """Read the `safe.directory` entries of each project from `GIT_SAFE_DIRECTORIES_PATH`."""
+    projects = {}
+    if not op.exists(path):
+        return projects
+    safe_dirs = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(SAFE_DIRECTORIES_PROJECT_MARKER):
+                safe_dirs = projects.setdefault(
+                    line.removeprefix(SAFE_DIRECTORIES_PROJECT_MARKER), []
+                )
+            elif safe_dirs is not None and line.startswith('directory = '):
+                safe_dirs.append(line.removeprefix('directory = '))
+    return projects
+
+
+def _write_git_safe_directories(path: str, projects: dict[str, list[str]]) -> None:
+    """Write the `safe.directory` entries of each project to `GIT_SAFE_DIRECTORIES_PATH`."""
+    lines = ['# Written by BABS for its shared-group projects; included by ~/.gitconfig.']
+    for analysis_path, safe_dirs in projects.items():
+        lines += [SAFE_DIRECTORIES_PROJECT_MARKER + analysis_path, '[safe]']
+        lines += [f'\tdirectory = {safe_dir}' for safe_dir in safe_dirs]
+    # Write to a temporary file first, so that git never reads a partial file:
+    fd, temp_path = tempfile.mkstemp(dir=op.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
+
+
+def _include_in_global_git_config(path: str) -> None:
+    """Add `path` to the `include.path` of the global git config, if not there yet."""
+    proc_included = subprocess.run(
+        ['git', 'config', '--global', '--get-all', 'include.path'],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if path in proc_included.stdout.splitlines():
+        return
+    subprocess.run(
+        ['git', 'config', '--global', '--add', 'include.path', path],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
 class BABS:
     """The BABS base class holds common attributes and methods for all BABS classes."""
 
@@ -95,6 +165,7 @@ class BABS:
             URL of output RIA store, starting with "ria+file://".
         output_ria_data_dir: str
             Path to the output RIA's data directory.
+            Got on first use, see `wtf_key_info()`.
             Example: /full/path/to/project_root/output_ria/238/da2f2-2fc4-4b88-a2c5-aa6e754b5d0b
         analysis_dataset_id: str
             The ID of DataLad dataset `analysis`.
@@ -155,8 +226,12 @@ class BABS:
         self.input_ria_url = 'ria+file://' + self.input_ria_path
         self.output_ria_url = 'ria+file://' + self.output_ria_path
 
-        self.output_ria_data_dir = None  # not known yet before output_ria is created
+        self._output_ria_data_dir = None  # not known yet before output_ria is created
         self.analysis_dataset_id = None  # to update later
+        # set by `_apply_config()`; got on first use:
+        self._input_datasets = None
+        self._input_datasets_config = None
+        self._project_cache_enabled = False
 
         self.list_sub_path_rel = 'code/processing_inclusion.csv'
         self.list_sub_path_abs = op.join(self.analysis_path, self.list_sub_path_rel)
@@ -165,6 +240,7 @@ class BABS:
         self.job_status_path_abs = op.join(self.analysis_path, self.job_status_path_rel)
         self.job_submit_path_abs = op.join(self.analysis_path, 'code/job_submit.csv')
         self._shared_group_enabled_cache = None
+        self._save_batch = None  # see `start_save_batch()`
         self._apply_config()
 
     def _apply_config(self) -> None:
@@ -175,8 +251,9 @@ class BABS:
           - processing_level
           - queue
           - container
-          - input_datasets
 
+        `input_datasets` and `output_ria_data_dir` are only got on first use,
+        so that commands not using them (e.g. `babs status`) start faster.
         """
         # Sanity check: the path `project_root` exists:
         if not op.exists(self.project_root):
@@ -204,6 +281,8 @@ class BABS:
         self.processing_level = validate_processing_level(config_yaml['processing_level'])
         self.queue = validate_queue(config_yaml['queue'])
         self.container = config_yaml['container']
+        # cached by `babs init`; projects created before are read by `wtf_key_info()`:
+        self.analysis_dataset_id = config_yaml.get('analysis_dataset_id')
 
         # Check for pipeline configuration (optional)
         self.pipeline = config_yaml.get('pipeline', None)
@@ -211,12 +290,87 @@ class BABS:
             self._validate_pipeline_config()
         self.container_images = self.get_container_image_paths(config_yaml)
 
-        # Check the output RIA:
-        self.wtf_key_info(flag_output_ria_only=True)
+        self._input_datasets_config = config_yaml['input_datasets']
+        # `output_ria_data_dir` is read from the project cache when used:
+        self._project_cache_enabled = True
 
-        self.input_datasets = InputDatasets(self.processing_level, config_yaml['input_datasets'])
-        self.input_datasets.update_abs_paths(Path(self.analysis_path))
-        self.ensure_shared_group_git_safe_directories()
+    @property
+    def input_datasets(self) -> InputDatasets | None:
+        """The input datasets of the project, got from `babs_proj_config.yaml` on first use."""
+        if self._input_datasets is None and self._input_datasets_config is not None:
+            self._input_datasets = InputDatasets(
+                self.processing_level, self._input_datasets_config
+            )
+            self._input_datasets.update_abs_paths(Path(self.analysis_path))
+        return self._input_datasets
+
+    @input_datasets.setter
+    def input_datasets(self, value: InputDatasets | None) -> None:
+        self._input_datasets = value
+
+    @property
+    def output_ria_data_dir(self) -> str | None:
+        """
+        Path to the output RIA's data directory.
+        For an existing project, it is got on first use: from the project cache if that is
+        not older than `babs_proj_config.yaml` and the git config of `analysis`,
+        otherwise by `wtf_key_info()`, whose result is then cached.
+        """
+        if self._output_ria_data_dir is None and self._project_cache_enabled:
+            cached_dir = self._read_project_cache().get('output_ria_data_dir')
+            if cached_dir is not None and op.exists(cached_dir):
+                self._output_ria_data_dir = cached_dir
+            else:
+                self.wtf_key_info(flag_output_ria_only=True)
+                self._write_project_cache(output_ria_data_dir=self._output_ria_data_dir)
+        return self._output_ria_data_dir
+
+    @output_ria_data_dir.setter
+    def output_ria_data_dir(self, value: str | None) -> None:
+        self._output_ria_data_dir = value
+
+    def _project_cache_paths(self) -> tuple[str, list[str]] | tuple[None, None]:
+        """Return the path to the project cache, and the paths it depends on."""
+        git_config_path = self.analysis_git_config_path()
+        if git_config_path is None:
+            return None, None
+        cache_path = op.join(op.dirname(git_config_path), PROJECT_CACHE_FILENAME)
+        # the remotes of `analysis` are in its git config:
+        return cache_path, [self.config_path, git_config_path]
+
+    def _read_project_cache(self) -> dict:
+        """Read the project cache; empty if missing, unreadable or stale."""
+        cache_path, source_paths = self._project_cache_paths()
+        if cache_path is None:
+            return {}
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+            source_mtimes = [os.stat(path).st_mtime_ns for path in source_paths]
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cache, dict) or cache.get('source_mtimes') != source_mtimes:
+            return {}
+        return cache
+
+    def _write_project_cache(self, **values) -> None:
+        """Update the project cache with `values`. Failing to write it is not an error."""
+        cache_path, source_paths = self._project_cache_paths()
+        if cache_path is None:
+            return
+        try:
+            cache = self._read_project_cache()
+            cache.update(values)
+            cache['source_mtimes'] = [os.stat(path).st_mtime_ns for path in source_paths]
+            # Write to a temporary file first, so concurrent readers never see a partial cache:
+            fd, temp_path = tempfile.mkstemp(dir=op.dirname(cache_path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            # readable by the other members of a shared group:
+            os.chmod(temp_path, 0o664)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
 
     def _validate_pipeline_config(self) -> None:
         """Validate the pipeline configuration if present.
@@ -333,15 +487,16 @@ class BABS:
         """
         This is to get some key information on DataLad dataset `analysis`,
         and assign to `output_ria_data_dir` and `analysis_dataset_id`.
-        This function relies on `git` and `datalad wtf`
+        This function relies on `git`; `analysis_dataset_id` is read from
+        `analysis/.datalad/config` if it is not known from `babs_proj_config.yaml` yet,
+        and only falls back to `datalad wtf` (which takes several seconds)
+        if it is not found there either.
         This needs to be done after the output RIA is created.
 
         Parameters
         ----------
         flag_output_ria_only: bool
             if only to get information on output RIA.
-            This may expedite the process as other information requires
-            calling `datalad` in terminal, which would takes several seconds.
         """
 
         # Get the `self.output_ria_data_dir`:
@@ -371,8 +526,12 @@ class BABS:
             if op.exists(alias_link) and os.path.islink(alias_link):
                 self.output_ria_data_dir = op.realpath(alias_link)
 
-        if not flag_output_ria_only:  # also want other information:
-            # Get the dataset ID of `analysis`, i.e., `analysis_dataset_id`:
+        if not flag_output_ria_only and self.analysis_dataset_id is None:
+            # Get the dataset ID of `analysis`, i.e., `analysis_dataset_id`.
+            # It is usually cached in `babs_proj_config.yaml` (see `_apply_config()`);
+            # way #1: from the committed configuration of `analysis`:
+            self.analysis_dataset_id = read_datalad_dataset_id(self.analysis_path)
+        if not flag_output_ria_only and self.analysis_dataset_id is None:
             # way #2: command line of datalad:
             proc_analysis_dataset_id = subprocess.run(
                 ['datalad', '-f', "'{infos[dataset][id]}'", 'wtf', '-S', 'dataset'],
@@ -445,10 +604,27 @@ class BABS:
         self._shared_group_enabled_cache = shared_mode in {'group', '1', 'true', 'yes'}
         return self._shared_group_enabled_cache
 
-    def ensure_shared_group_git_safe_directories(self) -> None:
-        """Register project repositories in git safe.directory for shared mode."""
+    def ensure_shared_group_git_safe_directories(self, force: bool = False) -> None:
+        """
+        Register project repositories in git safe.directory for shared mode.
+
+        They are written in one go to `GIT_SAFE_DIRECTORIES_PATH`, a per-user git config file
+        that is added to the global git config once. As the project is marked as registered
+        in that file, later calls return right away, without looking for the repositories.
+
+        Parameters
+        ----------
+        force: bool
+            whether to register the repositories again even if the project is marked
+            as registered (e.g., by `babs init`, which may reuse the path of a removed project)
+        """
         if not self.is_shared_group_project():
             return
+        analysis_realpath = op.realpath(self.analysis_path)
+        if not force and analysis_realpath in _read_git_safe_directories(
+            GIT_SAFE_DIRECTORIES_PATH
+        ):
+            return
 
         safe_dirs = set()
         if op.exists(self.analysis_path):
@@ -466,43 +642,34 @@ class BABS:
         if op.exists(alias_data):
             safe_dirs.add(op.realpath(alias_data))
 
-        if hasattr(self, 'input_datasets'):
+        if self.input_datasets is not None:
             for in_ds in self.input_datasets:
                 local_path = self.source_to_local_path(getattr(in_ds, 'origin_url', ''))
                 if local_path is not None:
                     safe_dirs.add(op.realpath(local_path))
 
-        proc_existing = subprocess.run(
-            ['git', 'config', '--global', '--get-all', 'safe.directory'],
-            capture_output=True,
-            text=True,
-            check=False,
-        )
-        existing = (
-            {line.strip() for line in proc_existing.stdout.splitlines() if line.strip()}
-            if proc_existing.returncode == 0
-            else set()
-        )
-
-        for repo_path in sorted(safe_dirs):
-            if not op.exists(repo_path) or repo_path in existing:
-                continue
-            subprocess.run(
-                ['git', 'config', '--global', '--add', 'safe.directory', repo_path],
-                capture_output=True,
-                text=True,
-                check=True,
+        os.makedirs(op.dirname(GIT_SAFE_DIRECTORIES_PATH), exist_ok=True)
+        # other BABS commands of the user may update the file at the same time:
+        with FileLock(GIT_SAFE_DIRECTORIES_PATH + '.lock'):
+            projects = _read_git_safe_directories(GIT_SAFE_DIRECTORIES_PATH)
+            projects[analysis_realpath] = sorted(
+                repo_path for repo_path in safe_dirs if op.exists(repo_path)
             )
-            existing.add(repo_path)
+            # Include the file first (git ignores a missing one), so that the project
+            # is only marked as registered once git reads its entries:
+            _include_in_global_git_config(GIT_SAFE_DIRECTORIES_PATH)
+            _write_git_safe_directories(GIT_SAFE_DIRECTORIES_PATH, projects)
 
     def ensure_shared_group_runtime_ready(self) -> None:
         """Apply git-safe-directory safeguards for shared projects."""
         self.ensure_shared_group_git_safe_directories()
 
     @property
-    def analysis_datalad_handle(self) -> dlapi.Dataset:
+    def analysis_datalad_handle(self) -> 'dlapi.Dataset':
         """Cached property of `analysis_datalad_handle`."""
         if self._analysis_datalad_handle is None:
+            import datalad.api as dlapi
+
             self._analysis_datalad_handle = dlapi.Dataset(self.analysis_path)
         return self._analysis_datalad_handle
 
@@ -532,7 +699,18 @@ class BABS:
         -----
         If the path does not exist, the status will be "notneeded", and won't be error message
             And there won't be a commit with that message
+        Between `start_save_batch()` and `finish_save_batch()`, the path(s) are only collected,
+            unless `filter_files` is given.
         """
+        if self._save_batch is not None and filter_files is None:
+            self._save_batch.append((path, message))
+            return
+        self._datalad_save_now(path, message, filter_files)
+
+    def _datalad_save_now(
+        self, path: str, message: str | None = None, filter_files: list[str] | None = None
+    ) -> None:
+        """Save right away, even between `start_save_batch()` and `finish_save_batch()`."""
         if filter_files is not None:
             # Create a temporary .gitignore file to exclude specified files
             gitignore_path = op.join(self.analysis_path, '.gitignore')
@@ -557,6 +735,36 @@ class BABS:
             # ^^ "notneeded": nothing to save
             raise RuntimeError('`datalad save` failed!')
 
+    def start_save_batch(self) -> None:
+        """
+        Start a batch of `datalad_save()` calls: they only collect their path(s),
+        which are saved in one commit by `finish_save_batch()`.
+        Each `datalad save` takes a few seconds on some filesystems, see `babs init`.
+        """
+        self._save_batch = []
+
+    def finish_save_batch(self, message: str) -> None:
+        """
+        Save the path(s) collected since `start_save_batch()` in one `datalad save`.
+
+        Parameters
+        ----------
+        message: str
+            first line of the commit message, followed by the messages of
+            the collected `datalad_save()` calls
+        """
+        save_batch, self._save_batch = self._save_batch, None
+        if not save_batch:
+            return
+        paths = []
+        for path, _ in save_batch:
+            paths += [path] if isinstance(path, str) else list(path)
+        messages = [f'- {batch_message}' for _, batch_message in save_batch if batch_message]
+        self._datalad_save_now(
+            path=list(dict.fromkeys(paths)),
+            message='\n\n'.join([message, '\n'.join(messages)]) if messages else message,
+        )
+
     def _get_results_branches(self) -> list[str]:
         """Get the results branch names from the output RIA in a list."""
         return get_results_branches(self.output_ria_data_dir)
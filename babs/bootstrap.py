@@ -22,6 +22,51 @@ from babs.utils import (
     validate_processing_level,
 )
 
+# How many input datasets `babs init` clones at the same time:
+MAX_CONCURRENT_CLONES = 4
+
+
+def _run_datalad_commands(cmds, cwd, max_processes=None, description='run datalad'):
+    """
+    Run `datalad` commands in separate processes, at the same time.
+
+    Parameters
+    ----------
+    cmds: list of list of str
+        the commands to run
+    cwd: str
+        the directory to run them in
+    max_processes: int or None
+        how many of them run at the same time (default: all of them)
+    description: str
+        what the commands do, for the error message
+
+    Raises
+    ------
+    RuntimeError
+        if any of the commands failed, with the output of those that failed
+    """
+    max_processes = max_processes or len(cmds)
+    running = []
+    failed = []
+
+    def wait(cmd, process):
+        output, _ = process.communicate()
+        if process.returncode != 0:
+            failed.append(f'{" ".join(cmd)}:\n{output}')
+
+    for cmd in cmds:
+        if len(running) == max_processes:
+            wait(*running.pop(0))
+        process = subprocess.Popen(
+            cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        running.append((cmd, process))
+    for cmd, process in running:
+        wait(cmd, process)
+    if failed:
+        raise RuntimeError(f'Failed to {description}:\n' + '\n'.join(failed))
+
 
 class BABSBootstrap(BABS):
     """A BABS subclass that implements the bootstrap process."""
@@ -117,6 +162,7 @@ class BABSBootstrap(BABS):
         self.pipeline = babs_config.get('pipeline')
         # Store top-level zip_foldernames for pipeline use
         self.zip_foldernames = babs_config.get('zip_foldernames', {})
+        self.zip_options = babs_config.get('zip_options')
         datasets = babs_config.get('input_datasets')
         if not datasets:
             raise ValueError('No input datasets found in the container config file.')
@@ -131,7 +177,11 @@ class BABSBootstrap(BABS):
         if self.shared_group is not None:
             create_kwargs['initopts'] = ['--shared=group']
         self._analysis_datalad_handle = dlapi.create(self.analysis_path, **create_kwargs)
+        self.analysis_dataset_id = self._analysis_datalad_handle.id
         self.input_datasets.update_abs_paths(Path(self.analysis_path))
+        # The files generated below are saved in one commit once they are all written,
+        # instead of one `datalad save` (of a few seconds) each:
+        self.start_save_batch()
 
         # Persist original config so other BABS commands can find it:
         babs_dir = op.join(self.project_root, '.babs')
@@ -166,6 +216,8 @@ class BABSBootstrap(BABS):
             gitignore_file.write('\n' + 'code/job_status.csv.lock')
             gitignore_file.write('\n' + 'code/job_submit.csv')
             gitignore_file.write('\n' + 'code/job_submit.csv.lock')
+            # task manifests of further arrays when a submission is split:
+            gitignore_file.write('\n' + 'code/job_submit_*.csv')
             # not to track files generated by `babs check-setup`:
             gitignore_file.write('\n' + 'code/check_setup/test_job_info.yaml')
             gitignore_file.write('\n' + 'code/check_setup/check_env.yaml')
@@ -194,6 +246,7 @@ class BABSBootstrap(BABS):
                     container_name=container_name,
                     container_ds=container_ds,
                     container_images=container_images,
+                    analysis_dataset_id=self.analysis_dataset_id,
                 )
             )
         self.datalad_save(
@@ -224,27 +277,44 @@ class BABSBootstrap(BABS):
         )
 
         # Register the input dataset(s): -----------------------------
+        # The input datasets are cloned concurrently, as cloning is mostly waiting
+        # on their sources, each in its own `datalad clone` process (DataLad's Python API
+        # is not thread-safe). Registering them as subdatasets of `analysis` commits to it,
+        # so that is done afterwards, one dataset (and commit) at a time,
+        # right away as the commit is amended.
         print('\nRegistering the input dataset(s)...')
+        clone_cmds = []
         for idx, in_ds in enumerate(self.input_datasets):
-            # path to cloned dataset:
-            dataset_name = in_ds.name
-            dataset_source = in_ds.origin_url
-
-            print(f'Cloning input dataset #{idx + 1}: {dataset_name}')
-
-            # clone input dataset(s) as sub-dataset into `analysis` dataset:
-            dlapi.clone(
-                dataset=self.analysis_path,
-                source=dataset_source,
-                path=in_ds.babs_project_analysis_path,
+            print(f'Cloning input dataset #{idx + 1}: {in_ds.name}')
+            clone_cmds.append(
+                ['datalad', 'clone', in_ds.origin_url, str(in_ds.babs_project_analysis_path)]
             )
+        _run_datalad_commands(
+            clone_cmds,
+            cwd=self.analysis_path,
+            max_processes=MAX_CONCURRENT_CLONES,
+            description='clone the input dataset(s)',
+        )
 
-            # amend the previous commit with a nicer commit message:
-            commit_message = f"Register input data dataset '{dataset_name}' as a subdataset"
-            git_cmd = ['git', 'commit', '--amend', '-m', commit_message]
-
+        for in_ds in self.input_datasets:
+            commit_message = f"Register input data dataset '{in_ds.name}' as a subdataset"
+            self._datalad_save_now(path=in_ds.babs_project_analysis_path, message=commit_message)
+            # record the source in `.gitmodules` as `datalad clone --dataset` does,
+            # and amend the commit with it:
             subprocess.run(
-                git_cmd,
+                [
+                    'git',
+                    'config',
+                    '--file',
+                    '.gitmodules',
+                    f'submodule.{in_ds.path_in_babs}.datalad-url',
+                    in_ds.origin_url,
+                ],
+                cwd=self.analysis_path,
+                check=True,
+            )
+            subprocess.run(
+                ['git', 'commit', '--amend', '-m', commit_message, '.gitmodules'],
                 cwd=self.analysis_path,
                 stdout=subprocess.PIPE,
                 check=True,
@@ -378,6 +448,7 @@ class BABSBootstrap(BABS):
         self.datalad_save(
             path='code/', message="Save anything in folder code/ that hasn't been saved"
         )
+        self.finish_save_batch('Initialize BABS project')
 
         print('\nFinal steps...')
         # No need to keep the input dataset(s):
@@ -397,8 +468,7 @@ class BABSBootstrap(BABS):
         print('Updating input and output RIA...')
         #   datalad push --to input
         #   datalad push --to output
-        self.analysis_datalad_handle.push(to='input')
-        self.analysis_datalad_handle.push(to='output')
+        self._push_to_siblings(['input', 'output'])
 
         # Add an alias to the data in output RIA store:
         print("Adding an alias 'data' to output RIA store...")
@@ -420,7 +490,7 @@ class BABSBootstrap(BABS):
 
         # Initialize the job status csv file:
         self._create_initial_job_status_csv()
-        self.ensure_shared_group_git_safe_directories()
+        self.ensure_shared_group_git_safe_directories(force=True)
 
         print('\n')
         print(
@@ -502,6 +572,7 @@ class BABSBootstrap(BABS):
             input_datasets=self.input_datasets,
             templateflow_home=templateflow_home,
             final_zip_foldernames=final_zip_foldernames,
+            zip_options=self.zip_options,
         )
 
         with open(pipeline_script_path, 'w') as f:
@@ -541,6 +612,7 @@ class BABSBootstrap(BABS):
             container_images=container_images,
             datalad_run_message='pipeline',
             analysis_path=self.analysis_path,
+            container_cache_space=user_config.get('container_cache_space'),
         )
 
         with open(bash_path, 'w') as f:
@@ -605,6 +677,29 @@ class BABSBootstrap(BABS):
                 message='Import files',
             )
 
+    def _push_to_siblings(self, siblings):
+        """
+        Push the analysis dataset to its siblings, all at the same time.
+
+        Each push runs in its own `datalad push` process (DataLad's Python API
+        is not thread-safe), as pushing is mostly waiting on the filesystem.
+
+        Parameters
+        ----------
+        siblings: list of str
+            names of the siblings to push to, e.g. ['input', 'output']
+
+        Raises
+        ------
+        RuntimeError
+            if any of the pushes failed
+        """
+        _run_datalad_commands(
+            [['datalad', 'push', '--to', sibling] for sibling in siblings],
+            cwd=self.analysis_path,
+            description='push the analysis dataset',
+        )
+
     def clean_up(self):
         """
         If `babs init` failed, this function cleans up the BABS project `babs init` creates.
@@ -621,10 +716,15 @@ class BABSBootstrap(BABS):
         if op.exists(self.project_root):  # if BABS project root folder has been created:
             if op.exists(self.analysis_path):  # analysis folder is created by datalad
                 print('Removing input dataset(s) if cloned...')
+                # Input datasets that were cloned but not registered yet
+                # are deleted along with the project folder below.
+                registered_paths = self.analysis_datalad_handle.subdatasets(
+                    result_xfm='paths', result_renderer='disabled'
+                )
                 for in_ds in self.input_datasets:
                     if in_ds._babs_project_analysis_path is None:
                         continue
-                    if op.exists(in_ds.babs_project_analysis_path):
+                    if in_ds.babs_project_analysis_path in registered_paths:
                         # use `datalad remove` to remove:
                         _ = self.analysis_datalad_handle.remove(
                             path=in_ds.babs_project_analysis_path, reckless='modification'
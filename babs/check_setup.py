@@ -31,6 +31,7 @@ class BABSCheckSetup(BABS):
         submit_a_test_job: bool
             Whether to submit and run a test job.
         """
+        self.ensure_shared_group_runtime_ready()
         babs_proj_config = read_yaml(self.config_path, use_filelock=True)
 
         print('Checking setup of BABS project located at: ' + self.project_root)
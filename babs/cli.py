@@ -4,13 +4,14 @@ import argparse
 import warnings
 from functools import partial
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import pandas as pd
+# Heavy dependencies (datalad, pandas) and the BABS classes using them are only imported
+# by the `babs_*_main()` function of the chosen command, so that `babs` starts fast.
+from babs.constants import RUNNING_PYTEST
 
-from babs.utils import (
-    RUNNING_PYTEST,
-    validate_sub_ses_processing_inclusion,
-)
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def _path_exists(path, parser):
@@ -101,8 +102,9 @@ def _parse_init():
     )
     parser.add_argument(
         '--queue',
-        choices=['slurm'],
-        help='The name of the job scheduling queue that you will use.',
+        choices=['slurm', 'local'],
+        help='The name of the job scheduling queue that you will use. '
+        '``local`` runs the jobs on the current machine instead of a cluster.',
         required=True,
     )
     parser.add_argument(
@@ -384,6 +386,56 @@ def _parse_submit():
             'those jobs instead of raising errors.'
         ),
     )
+    parser.add_argument(
+        '--tasks-per-job',
+        type=int,
+        default=1,
+        help=(
+            'Number of subjects (or sessions) that each array task runs, one after another. '
+            'Packing short jobs reduces the number of array tasks the scheduler has to start. '
+            'Make sure `hard_runtime_limit` covers all of them.'
+        ),
+    )
+    parser.add_argument(
+        '--retry-failed',
+        action='store_true',
+        help='Submit only the jobs that failed (i.e., ended without results).',
+    )
+    parser.add_argument(
+        '--escalate',
+        action='store_true',
+        help=(
+            'With `--retry-failed`: use the scheduler accounting (`sacct`) to tell why '
+            'each job failed, and retry jobs that ran out of memory with twice the memory, '
+            'and jobs that timed out with twice the time limit, in separate job arrays.'
+        ),
+    )
+    parser.add_argument(
+        '--largest-first',
+        action='store_true',
+        help=(
+            'Submit the jobs with the most input data first (estimated from the input '
+            'datasets without getting their content), so the longest jobs do not start last.'
+        ),
+    )
+    parser.add_argument(
+        '--resource-classes',
+        type=PathExists,
+        help=(
+            'Path to a YAML file with a list of resource classes by input size, e.g. '
+            '`- {max_input_size: 2G, hard_memory_limit: 16G}`. '
+            'Jobs are submitted largest first, each class in its own job array(s) '
+            'with its own cluster resources.'
+        ),
+    )
+    parser.add_argument(
+        '--then-merge',
+        action='store_true',
+        help=(
+            'Also submit a job that runs `babs merge` on a compute node '
+            'once all submitted jobs have ended, whether they succeeded or not.'
+        ),
+    )
 
     return parser
 
@@ -410,6 +462,12 @@ def babs_submit_main(
     select: list | None,
     inclusion_file: Path | None,
     skip_running_jobs: bool = False,
+    tasks_per_job: int = 1,
+    retry_failed: bool = False,
+    escalate: bool = False,
+    largest_first: bool = False,
+    resource_classes: Path | None = None,
+    then_merge: bool = False,
 ):
     """This is the core function of ``babs submit``.
 
@@ -425,11 +483,33 @@ def babs_submit_main(
         path to a CSV file that lists the subjects (and sessions) to analyze.
     skip_running_jobs: bool
         whether to allow submission when there are running/pending jobs
+    tasks_per_job: int
+        number of subjects (sessions) that each array task runs
+    retry_failed: bool
+        whether to submit only the jobs that failed
+    escalate: bool
+        whether to retry jobs that ran out of memory (time) with more memory (time)
+    largest_first: bool
+        whether to submit the jobs with the most input data first
+    resource_classes: Path or None
+        path to a YAML file with a list of resource classes by input size
+    then_merge: bool
+        whether to also submit a job that runs ``babs merge`` after the submitted jobs
     """
+    if escalate and not retry_failed:
+        raise ValueError('`--escalate` can only be used together with `--retry-failed`.')
+    if retry_failed and (select is not None or inclusion_file is not None):
+        raise ValueError(
+            '`--retry-failed` cannot be combined with `--select` or `--inclusion-file`.'
+        )
     import pandas as pd
 
     from babs import BABSInteraction
-    from babs.utils import parse_select_arg
+    from babs.utils import (
+        parse_select_arg,
+        read_yaml,
+        validate_sub_ses_processing_inclusion,
+    )
 
     babs_proj = BABSInteraction(project_root)
 
@@ -446,6 +526,12 @@ def babs_submit_main(
         count=count,
         submit_df=df_job_specified,
         skip_running_jobs=skip_running_jobs,
+        tasks_per_job=tasks_per_job,
+        retry_failed=retry_failed,
+        escalate=escalate,
+        largest_first=largest_first,
+        resource_classes=None if resource_classes is None else read_yaml(resource_classes),
+        then_merge=then_merge,
     )
 
 
@@ -498,6 +584,14 @@ def _parse_status():
         default=300,
         help='Seconds between status checks when using --wait.',
     )
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        default=False,
+        help='Report percentiles of how long each phase of the finished jobs took '
+        '(clone, get, container run, zip, push, ...) instead of job counts. '
+        'Can be combined with --json.',
+    )
 
     return parser
 
@@ -523,6 +617,7 @@ def babs_status_main(
     wait: bool = False,
     wait_interval: int = 300,
     json_output: bool = False,
+    timings: bool = False,
 ):
     """
     This is the core function of `babs status`.
@@ -538,14 +633,112 @@ def babs_status_main(
     json_output: bool
         whether to emit only a machine-readable JSON summary to stdout
         instead of the human-readable table
+    timings: bool
+        whether to report per-phase job timings instead of job counts
     """
     from babs import BABSInteraction
 
+    if wait and timings:
+        raise ValueError('`--timings` cannot be combined with `--wait`.')
+
     babs_proj = BABSInteraction(project_root)
     if wait:
         babs_proj.babs_status_wait(interval=wait_interval)
     else:
-        babs_proj.babs_status(json_output=json_output)
+        babs_proj.babs_status(json_output=json_output, timings=timings)
+
+
+def _parse_run():
+    """Create and configure the argument parser for the `babs run` command.
+
+    It includes a description and formatter class, and adds arguments for the command.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        description=(
+            'Keep submitting jobs, a limited number at a time, '
+            'until all jobs have results or have failed too often.'
+        ),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    PathExists = partial(_path_exists, parser=parser)
+    parser.add_argument(
+        'project_root',
+        metavar='PATH',
+        help=(
+            'Absolute path to the root of BABS project. '
+            "For example, '/path/to/my_BABS_project/' "
+            '(default is current working directory).'
+        ),
+        nargs='?',
+        default=Path.cwd(),
+        type=PathExists,
+    )
+    parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        required=True,
+        help='Number of jobs to keep pending or running at any time.',
+    )
+    parser.add_argument(
+        '--interval',
+        type=int,
+        default=300,
+        help='Seconds between status checks (and submissions).',
+    )
+    parser.add_argument(
+        '--max-failures',
+        type=int,
+        default=3,
+        help='Number of times a job may fail before it is no longer resubmitted.',
+    )
+    parser.add_argument(
+        '--merge-interval',
+        type=int,
+        help=(
+            'If set, run `babs merge` every this many seconds (if there are new results) '
+            'and once more when all jobs are finished.'
+        ),
+    )
+
+    return parser
+
+
+def babs_run_main(
+    project_root: str,
+    max_in_flight: int,
+    interval: int = 300,
+    max_failures: int = 3,
+    merge_interval: int | None = None,
+):
+    """
+    This is the core function of `babs run`.
+
+    Parameters
+    ----------
+    project_root: str
+        absolute path to the directory of BABS project
+    max_in_flight: int
+        number of jobs to keep pending or running
+    interval: int
+        seconds between status checks
+    max_failures: int
+        number of times a job may fail before it is no longer resubmitted
+    merge_interval: int or None
+        seconds between runs of `babs merge`; None to not merge
+    """
+    from babs import BABSInteraction
+
+    babs_proj = BABSInteraction(project_root)
+    babs_proj.babs_run(
+        max_in_flight,
+        interval=interval,
+        max_failures=max_failures,
+        merge_interval=merge_interval,
+    )
 
 
 def _parse_merge():
@@ -733,7 +926,7 @@ def _parse_update_input_data():
 
 
 def babs_update_input_data_main(
-    project_root: str, dataset_name: str, initial_inclusion_df: pd.DataFrame | None = None
+    project_root: str, dataset_name: str, initial_inclusion_df: 'pd.DataFrame | None' = None
 ):
     """This is the core function of babs update-input-data.
 
@@ -757,6 +950,7 @@ COMMANDS = [
     ('check-setup', _parse_check_setup, babs_check_setup_main),
     ('submit', _parse_submit, babs_submit_main),
     ('status', _parse_status, babs_status_main),
+    ('run', _parse_run, babs_run_main),
     ('merge', _parse_merge, babs_merge_main),
     ('sync-code', _parse_sync_code, babs_sync_code_main),
     ('update-input-data', _parse_update_input_data, babs_update_input_data_main),
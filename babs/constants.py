@@ -1,3 +1,7 @@
+import os
+
+RUNNING_PYTEST = os.environ.get('RUNNING_PYTEST', '0') == '1'
+
 CHECK_MARK = '\N{CHECK MARK}'  # can be used by print(CHECK_MARK)
 PATH_FS_LICENSE_IN_CONTAINER = '/SGLR/FREESURFER_HOME/license.txt'
 
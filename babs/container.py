@@ -140,6 +140,7 @@ class Container:
             bids_app_args=self.config.get('bids_app_args', None),
             singularity_args=self.config.get('singularity_args', []),
             templateflow_home=templateflow_home,
+            zip_options=self.config.get('zip_options'),
         )
 
         with open(bash_path, 'w') as f:
@@ -190,6 +191,7 @@ class Container:
             container_name=self.container_name,
             zip_foldernames=self.config['zip_foldernames'],
             analysis_path=analysis_path,
+            container_cache_space=self.config.get('container_cache_space'),
         )
 
         with open(bash_path, 'w') as f:
@@ -256,7 +258,7 @@ class Container:
 
         # Section 1: Command for submitting the job: ---------------------------
         # Flags when submitting the job:
-        if system.type == 'slurm':
+        if system.type in ('slurm', 'local'):
             submit_head = 'sbatch'
             env_flags = '--export=DSLOCKFILE=' + babs.analysis_path + '/.SLURM_datalad_lock'
         else:
@@ -274,7 +276,7 @@ class Container:
             pushgitremote = babs.output_ria_data_dir
 
         # Generate the command:
-        if system.type == 'slurm':
+        if system.type in ('slurm', 'local'):
             name_flag_str = ' --job-name '
 
         # Section 2: Job name: ---------------------------
@@ -285,7 +287,7 @@ class Container:
             job_name = self.container_name[0:3]
 
         # Now, we can define stdout and stderr file names/paths:
-        if system.type == 'slurm':
+        if system.type in ('slurm', 'local'):
             # slurm clusters also need exact filenames:
             eo_args = (
                 '-e '
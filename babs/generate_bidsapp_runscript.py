@@ -5,7 +5,13 @@ import warnings
 
 from jinja2 import Environment, PackageLoader, StrictUndefined
 
-from babs.utils import RUNNING_PYTEST, replace_placeholder_from_config, var_safe_name
+from babs.constants import RUNNING_PYTEST
+from babs.utils import (
+    get_zip_compression_flags,
+    replace_placeholder_from_config,
+    validate_zip_options,
+    var_safe_name,
+)
 
 
 def generate_bidsapp_runscript(
@@ -18,6 +24,7 @@ def generate_bidsapp_runscript(
     bids_app_args=None,
     singularity_args=None,
     templateflow_home=None,
+    zip_options=None,
 ):
     """
     Generate a bash script that runs the BIDS App singularity image.
@@ -36,6 +43,8 @@ def generate_bidsapp_runscript(
         path to the templateflow home directory on local disk
     output_directory: str
         path to the output directory
+    zip_options: dict or None
+        section `zip_options` in the container config: how `7z` (de)compresses
 
     Returns
     -------
@@ -71,10 +80,10 @@ def generate_bidsapp_runscript(
         ) = bids_app_args_from_config(bids_app_args, input_datasets)
 
     # Get unzip commands for any zipped input datasets
-    cmd_unzip_inputds = get_input_unzipping_cmds(input_datasets)
+    cmd_unzip_inputds = get_input_unzipping_cmds(input_datasets, zip_options)
 
     # Generate zip command
-    cmd_zip = get_output_zipping_cmds(dict_zip_foldernames, processing_level)
+    cmd_zip = get_output_zipping_cmds(dict_zip_foldernames, processing_level, zip_options)
 
     # Render the template
     env = Environment(
@@ -109,7 +118,7 @@ def generate_bidsapp_runscript(
     )
 
 
-def get_output_zipping_cmds(dict_zip_foldernames, processing_level):
+def get_output_zipping_cmds(dict_zip_foldernames, processing_level, zip_options=None):
     """
     This is to generate bash command to zip BIDS App outputs.
 
@@ -120,6 +129,11 @@ def get_output_zipping_cmds(dict_zip_foldernames, processing_level):
         got from `app_output_settings_from_config()`.
     processing_level : {'subject', 'session'}
         whether processing is done on a subject-wise or session-wise basis
+    zip_options: dict or None
+        `config["zip_options"]`; compression level, number of threads
+        and store-only mode passed to `7z a`. If None, 7z defaults are used.
+        With `push_while_zipping`, each zip file is annexed and copied to
+        `output-storage` in the background as soon as it is created.
 
     Returns:
     ---------
@@ -142,6 +156,8 @@ def get_output_zipping_cmds(dict_zip_foldernames, processing_level):
             )
         value_temp = value
 
+    zip_options = validate_zip_options(zip_options)
+
     # Create Jinja environment
     env = Environment(
         loader=PackageLoader('babs', 'templates'),
@@ -159,6 +175,8 @@ def get_output_zipping_cmds(dict_zip_foldernames, processing_level):
         output_main_folder=OUTPUT_MAIN_FOLDERNAME,
         processing_level=processing_level,
         dict_zip_foldernames=dict_zip_foldernames,
+        zip_flags=get_zip_compression_flags(zip_options),
+        push_while_zipping=zip_options['push_while_zipping'],
     )
 
     return cmd
@@ -327,6 +345,7 @@ def generate_pipeline_runscript(
     input_datasets,
     templateflow_home=None,
     final_zip_foldernames=None,
+    zip_options=None,
 ):
     """Generate a bash script that runs an ordered pipeline of BIDS Apps.
 
@@ -354,6 +373,9 @@ def generate_pipeline_runscript(
         Top-level zip_foldernames configuration for final output zipping.
         If None, falls back to last step's config for backward compatibility.
 
+    zip_options: dict, optional
+        Top-level zip_options configuration: how `7z` (de)compresses.
+
     Returns
     -------
     str
@@ -450,10 +472,10 @@ def generate_pipeline_runscript(
         processed_steps[-1]['bids_app_output_dir'] = final_output_dir
 
     # Generate the final zip command using existing helper for consistency
-    cmd_zip = get_output_zipping_cmds(final_zip_foldernames, processing_level)
+    cmd_zip = get_output_zipping_cmds(final_zip_foldernames, processing_level, zip_options)
 
     # Get unzip commands for any zipped input datasets
-    cmd_unzip_inputds = get_input_unzipping_cmds(input_datasets)
+    cmd_unzip_inputds = get_input_unzipping_cmds(input_datasets, zip_options)
 
     # Render the template
     env = Environment(
@@ -479,7 +501,7 @@ def generate_pipeline_runscript(
     )
 
 
-def get_input_unzipping_cmds(input_datasets):
+def get_input_unzipping_cmds(input_datasets, zip_options=None):
     """
     This is to generate command in `<containerName>_zip.sh` to unzip
     a specific input dataset if needed.
@@ -488,14 +510,24 @@ def get_input_unzipping_cmds(input_datasets):
     ----------
     input_datasets: list of dicts
         each dict contains information of an input dataset
+    zip_options: dict or None
+        `config["zip_options"]`; if `parallel_unzip` is true and there is more
+        than one zipped input dataset, they are extracted concurrently.
+
+    Notes
+    -----
+    Per input dataset, `extract_patterns` limits extraction to matching members
+    of the zip file, and `mount_zip` mounts the zip file read-only instead.
 
     Returns:
     ---------
     cmd: str
         commands to unzip input datasets
     """
-    if not any(ds['is_zipped'] for ds in input_datasets):
+    zipped_datasets = [ds for ds in input_datasets if ds['is_zipped']]
+    if not zipped_datasets:
         return ''
+    zip_options = validate_zip_options(zip_options)
 
     env = Environment(
         loader=PackageLoader('babs', 'templates'),
@@ -506,6 +538,13 @@ def get_input_unzipping_cmds(input_datasets):
     )
     env.filters['shell_safe'] = var_safe_name
     template = env.get_template('unzip_inputds.sh.jinja2')
-    cmd = template.render(input_datasets=input_datasets)
+    # Mounted zip files need no extraction, so they don't count towards parallel unzipping:
+    n_extracted = sum(1 for ds in zipped_datasets if not ds.get('mount_zip'))
+    cmd = template.render(
+        zipped_datasets=zipped_datasets,
+        has_mounted_zip=n_extracted < len(zipped_datasets),
+        has_extracted_zip=n_extracted > 0,
+        parallel_unzip=zip_options['parallel_unzip'] and n_extracted > 1,
+    )
 
     return cmd
@@ -12,6 +12,8 @@ from babs.utils import var_safe_name
 DIRECTIVE_PREFIX = {
     'sge': '#$',
     'slurm': '#SBATCH',
+    # The local scheduler ignores the directives, apart from `--cpus-per-task`:
+    'local': '#SBATCH',
 }
 
 # Load scheduler system lookup table from YAML
@@ -32,6 +34,7 @@ def generate_submit_script(
     container_images=None,
     datalad_run_message=None,
     analysis_path=None,
+    container_cache_space=None,
 ):
     """
     Generate a bash script that runs the BIDS App singularity image.
@@ -39,7 +42,7 @@ def generate_submit_script(
     Parameters
     ----------
     queue_system : str
-        The queue system to use (Only accepts 'slurm').
+        The queue system to use ('slurm' or 'local').
     cluster_resources_config : dict
         Configuration for cluster resources.
     script_preamble : str
@@ -63,6 +66,9 @@ def generate_submit_script(
     analysis_path : str
         Absolute path to the analysis directory. Used in the generated script
         to locate shared container images.
+    container_cache_space : str, optional
+        `config["container_cache_space"]`: node-local directory where each
+        container image is staged once per node. None links the shared image.
 
     Returns
     -------
@@ -71,6 +77,12 @@ def generate_submit_script(
     """
     if analysis_path is None:
         raise ValueError('analysis_path is required')
+    if container_cache_space is not None and not isinstance(container_cache_space, str):
+        raise TypeError(
+            'Section `container_cache_space` must be a path (string), '
+            f'got {type(container_cache_space).__name__}'
+        )
+    concurrent_tasks, cpus_per_task = get_concurrent_tasks(cluster_resources_config)
     # Handle both InputDatasets objects and lists for consistency
     if hasattr(input_datasets, 'as_records'):
         # It's an InputDatasets object, convert to records
@@ -93,7 +105,7 @@ def generate_submit_script(
 
     if queue_system == 'sge':
         varname_jobid = 'JOB_ID'
-    elif queue_system == 'slurm':
+    elif queue_system in ('slurm', 'local'):
         varname_taskid = 'SLURM_ARRAY_TASK_ID'
         varname_jobid = 'SLURM_ARRAY_JOB_ID'
 
@@ -133,9 +145,59 @@ def generate_submit_script(
         container_image_paths=container_image_paths,
         datalad_run_message=datalad_run_message,
         analysis_path=analysis_path,
+        container_cache_space=container_cache_space,
+        concurrent_tasks=concurrent_tasks,
+        cpus_per_task=cpus_per_task,
     )
 
 
+def get_concurrent_tasks(cluster_resources_config):
+    """
+    Get how many subjects (sessions) one job runs at the same time,
+    and how many CPUs each of them gets.
+
+    Parameters:
+    ------------
+    cluster_resources_config: dictionary
+        the section `cluster_resources` in container's config yaml
+
+    Returns:
+    ------------
+    concurrent_tasks: int
+        `concurrent_tasks` in `cluster_resources`; 1 if not set
+    cpus_per_task: int or None
+        `number_of_cpus` split evenly across the concurrent tasks;
+        None if only one task runs at a time or `number_of_cpus` is not set
+    """
+    concurrent_tasks = cluster_resources_config.get('concurrent_tasks', 1)
+    if isinstance(concurrent_tasks, bool) or not isinstance(concurrent_tasks, int):
+        raise TypeError(
+            '`concurrent_tasks` in section `cluster_resources` must be an integer, '
+            f'got {concurrent_tasks!r}'
+        )
+    if concurrent_tasks < 1:
+        raise ValueError(
+            f'`concurrent_tasks` in section `cluster_resources` must be at least 1, '
+            f'got {concurrent_tasks}'
+        )
+    number_of_cpus = cluster_resources_config.get('number_of_cpus')
+    if concurrent_tasks == 1 or number_of_cpus is None:
+        return concurrent_tasks, None
+    try:
+        number_of_cpus = int(number_of_cpus)
+    except ValueError as e:
+        raise ValueError(
+            '`number_of_cpus` in section `cluster_resources` must be a number '
+            f'to split it across `concurrent_tasks`, got {number_of_cpus!r}'
+        ) from e
+    if number_of_cpus < concurrent_tasks:
+        raise ValueError(
+            f'`concurrent_tasks` ({concurrent_tasks}) in section `cluster_resources` '
+            f'cannot be larger than `number_of_cpus` ({number_of_cpus}).'
+        )
+    return concurrent_tasks, number_of_cpus // concurrent_tasks
+
+
 def generate_test_submit_script(
     queue_system,
     cluster_resources_config,
@@ -207,6 +269,9 @@ def generate_scheduler_directives(queue_system, cluster_resources_config):
     if customized_text := cluster_resources_config.pop('customized_text', None):
         lines.append(customized_text)
 
+    # Not a resource request, but how the job uses them (see `get_concurrent_tasks()`):
+    cluster_resources_config.pop('concurrent_tasks', None)
+
     for generic_resource_name, value in cluster_resources_config.items():
         if generic_resource_name not in queue_system_lut:
             warnings.warn(
@@ -3,13 +3,18 @@
 import os
 import re
 import warnings
-import zipfile
 from collections import defaultdict
+from fnmatch import fnmatchcase
 from glob import glob
 
-import datalad.api as dlapi
 import pandas as pd
 
+from babs.utils import get_file_sizes_from_git, list_git_tree
+from babs.zip_members import get_zip_member_names_batch
+
+# How many zip files `validate_zipped_input_contents()` lists the members of at the same time:
+MAX_CONCURRENT_ZIP_CHECKS = 8
+
 
 class InputDataset:
     """Represent an input dataset."""
@@ -25,6 +30,9 @@ class InputDataset:
         unzipped_path_containing_subject_dirs=None,
         required_files=None,
         common_paths=None,
+        extract_patterns=None,
+        mount_zip=False,
+        check_zip_files=1,
         processing_level=None,
         babs_project_analysis_path=None,
     ):
@@ -51,6 +59,16 @@ class InputDataset:
             also pulls all metadata blobs sitting at the dataset root, plus the subject
             tier for session-level jobs). Use this only for a non-inherited file the grab
             doesn't reach (e.g. a shared ``sourcedata/.../nidm.ttl``). Defaults to ``[]``.
+        extract_patterns: list of str or None
+            zipped input datasets only: paths (wildcards allowed) inside the zip file
+            to extract in each job, instead of extracting the whole zip file.
+            ``${subid}`` and ``${sesid}`` are expanded in the job. Defaults to ``[]``.
+        mount_zip: bool
+            zipped input datasets only: mount the zip file read-only with ``fuse-zip``
+            instead of extracting it. Falls back to extraction on nodes without ``fuse-zip``.
+        check_zip_files: int or 'all'
+            zipped input datasets only: how many zip files `babs init` checks
+            the folder structure of. Defaults to 1.
         processing_level: {'subject', 'session'} or None
             whether processing is done on a subject-wise or session-wise basis
         babs_project_analysis_path: str or None
@@ -66,6 +84,26 @@ class InputDataset:
             self.is_zipped = bool(is_zipped)
         self.required_files = required_files
         self.common_paths = [] if common_paths is None else common_paths
+        self.extract_patterns = [] if extract_patterns is None else list(extract_patterns)
+        self.mount_zip = bool(mount_zip)
+        if (self.extract_patterns or self.mount_zip) and not self.is_zipped:
+            raise ValueError(
+                f'Input dataset {name}: `extract_patterns` and `mount_zip`'
+                ' are only supported for zipped input datasets.'
+            )
+        if self.extract_patterns and self.mount_zip:
+            raise ValueError(
+                f'Input dataset {name}: `extract_patterns` and `mount_zip`'
+                ' cannot be used together. Please only keep one of them.'
+            )
+        if check_zip_files != 'all' and not (
+            isinstance(check_zip_files, int) and check_zip_files >= 1
+        ):
+            raise ValueError(
+                f'Input dataset {name}: `check_zip_files` must be a positive integer or "all",'
+                f' not {check_zip_files!r}.'
+            )
+        self.check_zip_files = check_zip_files
         if processing_level not in ['subject', 'session']:
             raise ValueError('invalid `processing_level`!')
         self.processing_level = processing_level
@@ -98,6 +136,8 @@ class InputDataset:
     @property
     def is_up_to_date(self):
         """Check if the input dataset is up to date."""
+        import datalad.api as dlapi
+
         in_babs_ds = dlapi.Dataset(self.babs_project_analysis_path)
         babs_sha = in_babs_ds.repo.get_hexsha()
 
@@ -127,6 +167,7 @@ class InputDataset:
                 self.name,
                 self.processing_level,
                 inclusion_df,
+                check_zip_files=self.check_zip_files,
             )
         else:
             validate_nonzipped_input_contents(
@@ -194,7 +235,11 @@ class InputDataset:
             if self.processing_level == 'session'
             else f'sub-*_{zip_name}*.zip'
         )
-        found_zip_files = sorted(glob(os.path.join(self.babs_project_analysis_path, zip_pattern)))
+        found_zip_files = [
+            path
+            for path, is_directory in list_git_tree(self.babs_project_analysis_path)
+            if not is_directory and fnmatchcase(path, zip_pattern)
+        ]
 
         found_sub_ses = []
         for zip_file in found_zip_files:
@@ -227,41 +272,58 @@ class InputDataset:
             A pandas DataFrame with the subjects and sessions available in the input dataset
         """
 
-        # Get all subject directories
-        sub_dirs = sorted(glob(os.path.join(self.babs_project_analysis_path, 'sub-*')))
-        if not sub_dirs:
+        # Get all subject (and session) directories from the git tree:
+        max_depth = 2 if self.processing_level == 'session' else 1
+        dirs = [
+            path
+            for path, is_directory in list_git_tree(self.babs_project_analysis_path, max_depth)
+            if is_directory
+        ]
+        sub_ids = [path for path in dirs if fnmatchcase(path, 'sub-*') and '/' not in path]
+        if not sub_ids:
             raise ValueError(f'No subject directories found in {self.babs_project_analysis_path}')
 
-        # Initialize lists to store subject and session IDs
-        sub_ids = []
-        ses_ids = []
+        if self.processing_level == 'session':
+            # Subjects with no session directories are skipped:
+            sub_ses = [path.split('/') for path in dirs if fnmatchcase(path, 'sub-*/ses-*')]
+            return pd.DataFrame(sub_ses, columns=['sub_id', 'ses_id'])
+
+        return pd.DataFrame({'sub_id': sub_ids})
 
-        # Process each subject directory
-        for sub_dir in sub_dirs:
-            sub_id = os.path.basename(sub_dir)  # e.g., 'sub-01'
+    def get_input_sizes(self):
+        """
+        Estimate how much input data each subject (session) has in this dataset,
+        from the git tree and annex keys, i.e., without getting any file content.
 
-            if self.processing_level == 'session':
-                # Get all session directories under this subject
-                ses_dirs = sorted(glob(os.path.join(sub_dir, 'ses-*')))
-                if not ses_dirs:
-                    continue  # Skip subjects with no sessions
-
-                # Add each session for this subject
-                for ses_dir in ses_dirs:
-                    ses_id = os.path.basename(ses_dir)  # e.g., 'ses-01'
-                    sub_ids.append(sub_id)
-                    ses_ids.append(ses_id)
+        Returns
+        -------
+        sizes_df: pandas DataFrame
+            columns `sub_id` (and `ses_id`) and `input_size` (bytes)
+        """
+        key_columns = ['sub_id', 'ses_id'] if self.processing_level == 'session' else ['sub_id']
+        sizes = defaultdict(int)
+        for path, size in get_file_sizes_from_git(self.babs_project_analysis_path).items():
+            parts = path.split('/')
+            if self.is_zipped:
+                # e.g. `sub-01_ses-A_freesurfer-7-3-2.zip` at the root of the dataset:
+                if len(parts) != 1 or not path.endswith('.zip'):
+                    continue
+                ids = re.findall(r'(?:^|_)((?:sub|ses)-[^_]+)', parts[0])
             else:
-                # For subject-level processing, just add the subject
-                sub_ids.append(sub_id)
+                # e.g. `sub-01/ses-A/anat/sub-01_ses-A_T1w.nii.gz`:
+                ids = parts[:-1][:2]
+            sub_ids = [the_id for the_id in ids if the_id.startswith('sub-')]
+            ses_ids = [the_id for the_id in ids if the_id.startswith('ses-')]
+            if not sub_ids or (self.processing_level == 'session' and not ses_ids):
+                continue
+            key = (sub_ids[0], ses_ids[0]) if self.processing_level == 'session' else sub_ids[0]
+            sizes[key] += size
 
-        # Create DataFrame
         if self.processing_level == 'session':
-            df = pd.DataFrame({'sub_id': sub_ids, 'ses_id': ses_ids})
+            rows = [(sub_id, ses_id, size) for (sub_id, ses_id), size in sizes.items()]
         else:
-            df = pd.DataFrame({'sub_id': sub_ids})
-
-        return df
+            rows = [(sub_id, size) for sub_id, size in sizes.items()]
+        return pd.DataFrame(rows, columns=key_columns + ['input_size'])
 
     def as_dict(self):
         """Return the input dataset as a dictionary."""
@@ -279,15 +341,42 @@ class InputDataset:
             'unzipped_path_containing_subject_dirs': unzipped_path,
             'required_files': self.required_files,
             'common_paths': self.common_paths,
+            'extract_patterns': self.extract_patterns,
+            'mount_zip': self.mount_zip,
+            'check_zip_files': self.check_zip_files,
             'processing_level': self.processing_level,
             'babs_project_analysis_path': self.babs_project_analysis_path,
         }
 
 
 def validate_zipped_input_contents(
-    dataset_abs_path, root_dir_name, processing_level, included_subjects_df=None
+    dataset_abs_path,
+    root_dir_name,
+    processing_level,
+    included_subjects_df=None,
+    check_zip_files=1,
 ):
-    """Validate the contents of a zipped input dataset."""
+    """Validate the contents of a zipped input dataset.
+
+    * There should be zip files named after the subjects (sessions), one per job.
+    * The zip files should have a folder named `root_dir_name` at their root.
+      This is checked for `check_zip_files` of them, from their list of members
+      (see `babs.zip_members.get_zip_member_names_batch()`).
+
+    Parameters
+    ----------
+    dataset_abs_path : str
+        absolute path to the input dataset
+    root_dir_name : str
+        name of the input dataset, i.e., of the folder at the root of its zip files
+    processing_level : {'subject', 'session'}
+        whether processing is done on a subject-wise or session-wise basis
+    included_subjects_df : pandas DataFrame or None
+        the subjects (and sessions) to check the zip files of, or `None` for all of them
+    check_zip_files : int or 'all'
+        how many of these zip files to check the folder structure of,
+        spread evenly over them
+    """
     zip_pattern = (
         f'sub-*_ses-*_{root_dir_name}*.zip'
         if processing_level == 'session'
@@ -322,43 +411,63 @@ def validate_zipped_input_contents(
                 'There is more than one zip file per subject in the zipped input dataset.'
             )
 
-    # Now that we know there is only one zip file per job, get an example zip file
-    # so we can test that the folder structure is what we expect
+    # Now that we know there is only one zip file per job, check the folder structure
+    # of some (or all) zip files:
     if included_subjects_df is None:
-        # if not filter is provided, use the first zip file
-        temp_zipfile = found_zip_files[0]
+        # if not filter is provided, use all zip files
+        candidate_zipfiles = found_zip_files
     else:
-        # if a filter is provided, use the first row of the included_subjects_df
-        # to find the zip file
-        first_row = included_subjects_df.iloc[0]
-        search_subid = first_row['sub_id']
-        search_sesid = f'_{first_row["ses_id"]}' if processing_level == 'session' else ''
-        query = f'{search_subid}{search_sesid}_*{root_dir_name}*.zip'
-        temp_zipfile = glob(os.path.join(dataset_abs_path, query))
-        # If there were multiple matches we would have found them above
-        if not temp_zipfile:
-            raise FileNotFoundError(f'No zip file found for inclusion-based query {query}')
-        temp_zipfile = temp_zipfile[0]
-
-    temp_zipfilename = os.path.basename(temp_zipfile)
-
-    # Get the file from datalad
-    dlapi.get(path=temp_zipfile, dataset=dataset_abs_path)
-
-    # Check folder structure
-    with zipfile.ZipFile(temp_zipfile) as zf:
-        zip_contents = zf.namelist()
-        if not any(name.startswith(f'{root_dir_name}/') for name in zip_contents):
-            warnings.warn(
-                f'In input dataset (named "{root_dir_name}"), '
-                f'there is no folder called "{root_dir_name}" in zipped '
-                f'input file "{temp_zipfilename}". '
-                'This may cause error when running BIDS App for this subject/session',
-                stacklevel=2,
+        # if a filter is provided, use the zip files of the included subjects (sessions)
+        zipfile_by_job = {}
+        for zip_file in found_zip_files:
+            ids = re.findall(r'(?:^|_)((?:sub|ses)-[^_]+)', os.path.basename(zip_file))
+            zipfile_by_job.setdefault(
+                tuple(ids[:2] if processing_level == 'session' else ids[:1]), zip_file
             )
+        candidate_zipfiles = []
+        key_columns = ['sub_id', 'ses_id'] if processing_level == 'session' else ['sub_id']
+        for key in included_subjects_df[key_columns].itertuples(index=False, name=None):
+            if key not in zipfile_by_job:
+                query = f'{"_".join(key)}_*{root_dir_name}*.zip'
+                raise FileNotFoundError(f'No zip file found for inclusion-based query {query}')
+            candidate_zipfiles.append(zipfile_by_job[key])
+
+    if check_zip_files == 'all' or check_zip_files >= len(candidate_zipfiles):
+        checked_zipfiles = candidate_zipfiles
+    else:
+        # a sample spread evenly over the (sorted) zip files:
+        checked_zipfiles = [
+            candidate_zipfiles[i * len(candidate_zipfiles) // check_zip_files]
+            for i in range(check_zip_files)
+        ]
+
+    # Check folder structure. Listing the members of a zip file only reads its end,
+    # so the zip files are listed concurrently and usually without getting them:
+    member_names = get_zip_member_names_batch(
+        dataset_abs_path, checked_zipfiles, max_workers=MAX_CONCURRENT_ZIP_CHECKS
+    )
+    zipfiles_without_folder = [
+        os.path.basename(zip_file)
+        for zip_file, names in zip(checked_zipfiles, member_names, strict=True)
+        if not any(name.startswith(f'{root_dir_name}/') for name in names)
+    ]
+    if zipfiles_without_folder:
+        warnings.warn(
+            f'In input dataset (named "{root_dir_name}"), '
+            f'there is no folder called "{root_dir_name}" in zipped '
+            f'input file(s) {_list_missing([f"{name!r}" for name in zipfiles_without_folder])}'
+            f' ({len(zipfiles_without_folder)} of {len(checked_zipfiles)} checked). '
+            'This may cause error when running BIDS App for these subjects/sessions',
+            stacklevel=2,
+        )
+
 
-    # Cleanup
-    dlapi.drop(path=temp_zipfile, dataset=dataset_abs_path)
+def _list_missing(items, max_listed=10):
+    """Join the first `max_listed` of `items` for an error message."""
+    listed = ', '.join(items[:max_listed])
+    if len(items) > max_listed:
+        listed += f' (and {len(items) - max_listed} more)'
+    return listed
 
 
 def validate_nonzipped_input_contents(
@@ -370,30 +479,38 @@ def validate_nonzipped_input_contents(
       "ses" folders are optional.
     * If session-wise processing is enabled, there should be both "sub" and "ses" folders.
 
+    The folders are read from the git tree of the dataset once, and all subjects
+    (sessions) of `included_subjects_df` that are missing are reported at once.
+
     Parameters
     ----------
     dataset_abs_path : str
         absolute path to the input dataset
+    dataset_name : str
+        name of the input dataset
     processing_level : {'subject', 'session'}
         whether processing is done on a subject-wise or session-wise basis
+    included_subjects_df : pandas DataFrame or None
+        the subjects (and sessions) to check for, or `None` to check all of them
     """
+    max_depth = 2 if processing_level == 'session' else 1
+    dirs = [
+        path for path, is_directory in list_git_tree(dataset_abs_path, max_depth) if is_directory
+    ]
+    existing_subjects = {path for path in dirs if fnmatchcase(path, 'sub-*') and '/' not in path}
 
-    # Check if there is sub-*:
-    subject_dirs = sorted(glob(os.path.join(dataset_abs_path, 'sub-*')))
-
-    # only get the sub's foldername, if it's a directory:
     if included_subjects_df is not None:
-        subjects = included_subjects_df['sub_id'].tolist()
-
-        # Perform a quick check that the subjects exist
-        for subject in subjects:
-            if not os.path.exists(os.path.join(dataset_abs_path, subject)):
-                raise FileNotFoundError(
-                    f'There is no `{subject}` folder in input dataset {dataset_name}, '
-                    f'located at {dataset_abs_path}. Check the inclusion dataframe.'
-                )
+        subjects = included_subjects_df['sub_id'].drop_duplicates().tolist()
+        missing_subjects = [subject for subject in subjects if subject not in existing_subjects]
+        if missing_subjects:
+            listed = _list_missing([f'`{subject}`' for subject in missing_subjects])
+            raise FileNotFoundError(
+                f'There is no {listed} folder'
+                f' in input dataset {dataset_name}, located at {dataset_abs_path}.'
+                ' Check the inclusion dataframe.'
+            )
     else:
-        subjects = [os.path.basename(temp) for temp in subject_dirs if os.path.isdir(temp)]
+        subjects = sorted(existing_subjects)
     if not subjects:
         raise FileNotFoundError(
             f'In input dataset {dataset_name}, located at {dataset_abs_path}. '
@@ -402,27 +519,36 @@ def validate_nonzipped_input_contents(
 
     # For session: also check if there is session in each sub-*:
     if processing_level == 'session':
-        for subject in subjects:  # every sub- folder should contain a session folder
-            session_dirs = sorted(glob(os.path.join(dataset_abs_path, subject, 'ses-*')))
-            sessions = [os.path.basename(temp) for temp in session_dirs if os.path.isdir(temp)]
-            if len(sessions) == 0:
+        existing_sub_ses = {
+            tuple(path.split('/')) for path in dirs if fnmatchcase(path, 'sub-*/ses-*')
+        }
+        # every sub- folder should contain a session folder:
+        subjects_with_sessions = {sub_id for sub_id, _ in existing_sub_ses}
+        subjects_without_sessions = [
+            subject for subject in subjects if subject not in subjects_with_sessions
+        ]
+        if subjects_without_sessions:
+            listed = _list_missing([f'"{subject}"' for subject in subjects_without_sessions])
+            raise FileNotFoundError(
+                f'In input dataset {dataset_name}, located at {dataset_abs_path}. '
+                f'There is no `ses-*` folder in subject folder(s) {listed}!'
+            )
+
+        # Check that all the included sessions are present
+        if included_subjects_df is not None:
+            missing_sub_ses = [
+                f'`{ses_id}` folder in "{sub_id}"'
+                for sub_id, ses_id in included_subjects_df[['sub_id', 'ses_id']].itertuples(
+                    index=False
+                )
+                if (sub_id, ses_id) not in existing_sub_ses
+            ]
+            if missing_sub_ses:
                 raise FileNotFoundError(
-                    f'In input dataset {dataset_name}, located at {dataset_abs_path}.'
-                    f'There is no `ses-*` folder in subject folder "{subject}"!'
+                    f'In input dataset {dataset_name}, located at {dataset_abs_path}. '
+                    f'There is no {_list_missing(missing_sub_ses)}!'
                 )
 
-            # Check that all the included sessions are present
-            if included_subjects_df is not None:
-                sessions = included_subjects_df[included_subjects_df['sub_id'] == subject][
-                    'ses_id'
-                ].tolist()
-                for session in sessions:
-                    if session not in session_dirs:
-                        raise FileNotFoundError(
-                            f'In input dataset {dataset_name}, located at {dataset_abs_path}.'
-                            f'There is no `{session}` folder in "{subject}"!'
-                        )
-
 
 class OutputDataset(InputDataset):
     """Represent an output dataset."""
@@ -444,4 +570,7 @@ class OutputDataset(InputDataset):
         )
         self.required_files = input_dataset.required_files
         self.common_paths = input_dataset.common_paths
+        self.extract_patterns = input_dataset.extract_patterns
+        self.mount_zip = input_dataset.mount_zip
+        self.check_zip_files = input_dataset.check_zip_files
         self.processing_level = input_dataset.processing_level
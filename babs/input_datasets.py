@@ -1,7 +1,9 @@
 """This module is for input dataset(s)."""
 
-from babs.input_dataset import InputDataset, OutputDataset
-from babs.utils import combine_inclusion_dataframes, validate_sub_ses_processing_inclusion
+import pandas as pd
+
+from babs.input_dataset import InputDataset, OutputDataset, _list_missing
+from babs.utils import intersect_inclusion_dataframes, validate_sub_ses_processing_inclusion
 
 
 class InputDatasets:
@@ -40,6 +42,10 @@ class InputDatasets:
             got by method `set_inclusion_dataframe()`, based on `processing_inclusion_file`
             Assign `None` for now, before calling that method
             See that method for more.
+        inclusion_dropouts: dict
+            got by method `generate_inclusion_dataframe()`:
+            input dataset name -> pandas DataFrame of the subjects (sessions)
+            that are in other input datasets but not in this one
         """
 
         self._datasets = []
@@ -51,6 +57,7 @@ class InputDatasets:
             self._datasets.append(InputDataset(name=dataset_name, **dataset_config))
             self._dataset_dict[dataset_name] = self._datasets[-1]
         self.initial_inclu_df = None
+        self.inclusion_dropouts = {}
         self.processing_level = processing_level
 
     def __getitem__(self, key):
@@ -100,10 +107,13 @@ class InputDatasets:
 
     def validate_input_contents(self):
         """
-        Parameters
-        ----------
-        processing_level : {'subject', 'session'}
-            whether processing is done on a subject-wise or session-wise basis
+        Check the contents of all input datasets, one after another.
+
+        They are not checked concurrently, as checking a zipped input dataset
+        may get and drop zip files with DataLad's Python API, which is not thread-safe.
+        (The zip files of one dataset are still listed concurrently where possible,
+        see `babs.zip_members.get_zip_member_names_batch()`.)
+        If several datasets are invalid, the error of the first one is raised.
         """
 
         for dataset in self._datasets:
@@ -127,11 +137,36 @@ class InputDatasets:
                 dataset.generate_inclusion_dataframe() for dataset in self._datasets
             ]
 
-            # Merge all these dataframes so that only rows present in each are kept:
-            inclu_df = combine_inclusion_dataframes(initial_inclusion_dfs)
+            # Keep only the rows present in each of these dataframes:
+            inclu_df, dropouts = intersect_inclusion_dataframes(initial_inclusion_dfs)
+            self.inclusion_dropouts = {}
+            for dataset, dropout_df in zip(self._datasets, dropouts, strict=True):
+                if dropout_df.empty:
+                    continue
+                self.inclusion_dropouts[dataset.name] = dropout_df
+                dropped = dropout_df.astype(str).agg('_'.join, axis=1).tolist()
+                print(
+                    f'Input dataset {dataset.name} lacks {len(dropped)}'
+                    f' {"session(s)" if self.processing_level == "session" else "subject(s)"}'
+                    ' of the other input dataset(s), which will not be analyzed: '
+                    f'{_list_missing(dropped)}'
+                )
 
         return validate_sub_ses_processing_inclusion(inclu_df, self.processing_level)
 
+    def get_input_sizes(self):
+        """
+        Estimate how much input data each subject (session) has across all input datasets.
+
+        Returns
+        -------
+        sizes_df: pandas DataFrame
+            columns `sub_id` (and `ses_id`) and `input_size` (bytes, summed over the datasets)
+        """
+        sizes_df = pd.concat([dataset.get_input_sizes() for dataset in self._datasets])
+        key_columns = ['sub_id', 'ses_id'] if self.processing_level == 'session' else ['sub_id']
+        return sizes_df.groupby(key_columns, as_index=False)['input_size'].sum()
+
     def as_records(self):
         """Return the input datasets as a list of dictionaries."""
         return [in_ds.as_dict() for in_ds in self._datasets]
@@ -4,20 +4,43 @@ import json
 import os.path as op
 import sys
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import datalad.api as dlapi
 import numpy as np
+import pandas as pd
 
 from babs.base import BABS
 from babs.scheduler import (
+    MAX_CONCURRENT_SUBMISSIONS,
+    escalated_sbatch_args,
+    get_max_array_size,
     report_job_status,
+    report_job_timings,
+    resource_class_sbatch_args,
+    run_sacct,
     submit_array,
+    submit_merge_job,
+)
+from babs.status import (
+    FAILURE_CAUSES,
+    SchedulerState,
+    failure_causes_from_sacct,
+    job_status_counts,
+    job_timing_summary,
+    read_job_timings,
 )
-from babs.status import job_status_counts
 from babs.utils import (
     update_submitted_job_ids,
+    validate_resource_classes,
 )
 
+_FAILURE_DESCRIPTIONS = {
+    'timeout': 'ran out of time (retried with a longer time limit)',
+    'oom': 'ran out of memory (retried with more memory)',
+    'other': 'failed for other reasons (retried as before)',
+}
+
 
 class BABSInteraction(BABS):
     """Implement interactions with a BABS project - submitting jobs and checking status."""
@@ -42,6 +65,8 @@ class BABSInteraction(BABS):
                 continue
 
             print(f'Running `datalad get {image_path}`...')
+            import datalad.api as dlapi
+
             statuses = dlapi.get(path=image_path_abs, dataset=containers_path)
             if isinstance(statuses, dict):
                 statuses = [statuses]
@@ -62,7 +87,19 @@ class BABSInteraction(BABS):
                     'Container image is still not available after `datalad get`: ' + image_path_abs
                 )
 
-    def babs_submit(self, count=None, submit_df=None, skip_failed=False, skip_running_jobs=False):
+    def babs_submit(
+        self,
+        count=None,
+        submit_df=None,
+        skip_failed=False,
+        skip_running_jobs=False,
+        tasks_per_job=1,
+        retry_failed=False,
+        escalate=False,
+        largest_first=False,
+        resource_classes=None,
+        then_merge=False,
+    ):
         """
         This function submits jobs that don't have results yet and prints out job status.
 
@@ -77,7 +114,33 @@ class BABSInteraction(BABS):
             default: None
         skip_running_jobs: bool
             whether to allow submission when there are running/pending jobs
+        tasks_per_job: int
+            number of subjects (sessions) that each array task runs, one after another.
+            default: 1
+        retry_failed: bool
+            whether to submit only the jobs that failed
+        escalate: bool
+            whether to retry jobs that ran out of memory (time) with more memory (time),
+            see `escalated_sbatch_args()`. Requires `retry_failed`.
+        largest_first: bool
+            whether to submit the jobs with the most input data first
+        resource_classes: list of dict or None
+            cluster resources by input size, see `validate_resource_classes()`.
+            The jobs of each class are submitted in their own job array(s), largest first.
+        then_merge: bool
+            whether to also submit a job that runs `babs merge`
+            after all submitted job arrays have ended
         """
+        if isinstance(tasks_per_job, bool) or not isinstance(tasks_per_job, int):
+            raise TypeError('`tasks_per_job` must be an integer.')
+        if tasks_per_job < 1:
+            raise ValueError('`tasks_per_job` must be at least 1.')
+        if escalate and not retry_failed:
+            raise ValueError('`escalate` can only be used together with `retry_failed`.')
+        if retry_failed and submit_df is not None:
+            raise ValueError('`retry_failed` cannot be combined with selecting jobs to submit.')
+        if resource_classes is not None:
+            resource_classes = validate_resource_classes(resource_classes)
 
         self.ensure_shared_group_runtime_ready()
 
@@ -107,8 +170,13 @@ class BABSInteraction(BABS):
                 print('All currently running jobs are in CG state; proceeding with submission.')
 
         # Find the rows that don't have results yet
+        if retry_failed:
+            # Jobs may have failed since `babs status` was last run:
+            self._update_results_status()
         status_df = self.get_job_status_df()
         df_needs_submit = status_df[~status_df['has_results']].reset_index(drop=True)
+        if retry_failed:
+            df_needs_submit = df_needs_submit[df_needs_submit['is_failed'].fillna(False)]
         if skip_failed:
             df_needs_submit = df_needs_submit[~df_needs_submit['submitted']]
 
@@ -152,46 +220,250 @@ class BABSInteraction(BABS):
             print('No jobs to submit')
             return
 
+        # Longest jobs first: jobs that start last should be the short ones
+        if largest_first or resource_classes is not None:
+            df_needs_submit = self._sort_by_input_size(df_needs_submit)
+
         # If count is positive, submit the first `count` jobs
         if count is not None:
             print(f'Submitting the first {count} jobs')
             df_needs_submit = df_needs_submit.head(min(count, df_needs_submit.shape[0]))
+        df_needs_submit = df_needs_submit.reset_index(drop=True)
+
+        # Jobs that need different sbatch options are submitted in separate arrays:
+        row_sbatch_args = [()] * df_needs_submit.shape[0]
+        if resource_classes is not None:
+            row_sbatch_args = self._get_resource_class_sbatch_args(
+                df_needs_submit, resource_classes
+            )
+        if escalate:
+            row_sbatch_args = [
+                class_args + escalated_args
+                for class_args, escalated_args in zip(
+                    row_sbatch_args,
+                    self._get_escalated_sbatch_args(df_needs_submit),
+                    strict=True,
+                )
+            ]
+        sbatch_arg_groups = {}
+        for position, sbatch_args in enumerate(row_sbatch_args):
+            sbatch_arg_groups.setdefault(sbatch_args, []).append(position)
 
         self.ensure_container_images_available()
 
-        # We know task_id ahead of time, so we can add it to the dataframe
-        df_needs_submit['task_id'] = np.arange(1, df_needs_submit.shape[0] + 1)
+        # Each array task runs `tasks_per_job` consecutive subjects (sessions),
+        # i.e., all rows of the task manifest with its task_id.
+        # Arrays can't be larger than the scheduler's `MaxArraySize`,
+        # so a large submission is split into several arrays, each with its own job id.
+        # Array indices must be smaller than `MaxArraySize` and start at 1:
+        max_tasks_per_array = get_max_array_size(self.queue) - 1
+        array_index = np.zeros(df_needs_submit.shape[0], dtype=int)
+        task_id = np.zeros(df_needs_submit.shape[0], dtype=int)
+        array_sbatch_args = []
+        for sbatch_args, positions in sbatch_arg_groups.items():
+            job_index = np.arange(len(positions)) // tasks_per_job
+            array_index[positions] = len(array_sbatch_args) + job_index // max_tasks_per_array
+            # We know task_id ahead of time, so we can add it to the dataframe
+            task_id[positions] = job_index % max_tasks_per_array + 1
+            n_group_arrays = int(job_index[-1]) // max_tasks_per_array + 1
+            array_sbatch_args += [list(sbatch_args)] * n_group_arrays
+        df_needs_submit['task_id'] = task_id
+        n_arrays = len(array_sbatch_args)
+        if tasks_per_job > 1:
+            n_tasks = df_needs_submit.groupby(array_index)['task_id'].max().sum()
+            print(
+                f'Packing {df_needs_submit.shape[0]} jobs into {n_tasks}'
+                f' array tasks of at most {tasks_per_job} jobs each.'
+            )
+        if n_arrays > 1:
+            print(
+                f'Submitting {df_needs_submit.shape[0]} jobs in {n_arrays} job arrays'
+                f' (at most {max_tasks_per_array} array tasks each, MaxArraySize).'
+            )
         # Columns to write before we know the job_id (pre-submit)
         pre_submit_cols = (
             ['sub_id', 'ses_id', 'task_id']
             if self.processing_level == 'session'
             else ['sub_id', 'task_id']
         )
-        # Write the job submission dataframe to a csv file before submitting
-        df_needs_submit[pre_submit_cols].to_csv(self.job_submit_path_abs, index=False)
-        job_id = submit_array(
-            self.analysis_path,
-            self.queue,
-            df_needs_submit.shape[0],
-        )
-
-        df_needs_submit['job_id'] = job_id
-        # Update the job submission dataframe with the new job id
-        print(f'Submitting the following jobs:\n{df_needs_submit}')
         submit_cols = (
             ['sub_id', 'ses_id', 'job_id', 'task_id']
             if self.processing_level == 'session'
             else ['sub_id', 'job_id', 'task_id']
         )
-        df_needs_submit[submit_cols].to_csv(self.job_submit_path_abs, index=False)
+        # Write the job submission dataframe to a csv file before submitting.
+        # A single array reads its tasks from this file. As task ids repeat across arrays,
+        # each array of a split submission gets its own task manifest instead.
+        df_needs_submit[pre_submit_cols].to_csv(self.job_submit_path_abs, index=False)
+        df_needs_submit['job_id'] = pd.NA
+        array_submit_paths = [None]
+        if n_arrays > 1:
+            array_submit_paths = []
+            for i_array in range(n_arrays):
+                array_submit_path = op.join(
+                    self.analysis_path, 'code', f'job_submit_{i_array + 1}.csv'
+                )
+                df_needs_submit.loc[array_index == i_array, pre_submit_cols].to_csv(
+                    array_submit_path, index=False
+                )
+                array_submit_paths.append(array_submit_path)
+
+        # The arrays are submitted concurrently, so a slow controller (or sbatch retrying
+        # after a transient error) holds up one array instead of all that follow it:
+        submit_errors = []
+        try:
+            with ThreadPoolExecutor(max_workers=min(n_arrays, MAX_CONCURRENT_SUBMISSIONS)) as pool:
+                futures = {
+                    pool.submit(
+                        submit_array,
+                        self.analysis_path,
+                        self.queue,
+                        int(df_needs_submit.loc[array_index == i_array, 'task_id'].max()),
+                        job_submit_path=array_submit_paths[i_array],
+                        sbatch_args=array_sbatch_args[i_array],
+                    ): i_array
+                    for i_array in range(n_arrays)
+                }
+                # Only this thread writes to `df_needs_submit`:
+                for future in as_completed(futures):
+                    i_array = futures[future]
+                    try:
+                        job_id = future.result()
+                    except Exception as exc:
+                        submit_errors.append(exc)
+                        print(f'Failed to submit job array {i_array + 1} of {n_arrays}: {exc}')
+                        continue
+                    df_needs_submit.loc[array_index == i_array, 'job_id'] = job_id
+        finally:
+            # Record the arrays that were submitted, even if a later one failed:
+            df_submitted = df_needs_submit[df_needs_submit['job_id'].notna()].copy()
+            if not df_submitted.empty:
+                df_submitted['job_id'] = df_submitted['job_id'].astype(int)
+                # Update the job submission dataframe with the new job id(s)
+                print(f'Submitting the following jobs:\n{df_submitted}')
+                df_submitted[submit_cols].to_csv(self.job_submit_path_abs, index=False)
+
+                # Update the results df
+                updated_results_df = update_submitted_job_ids(
+                    self.get_job_status_df(), df_submitted[submit_cols]
+                )
+                updated_results_df.to_csv(self.job_status_path_abs, index=False)
+
+        if submit_errors:
+            raise RuntimeError(
+                f'{len(submit_errors)} of {n_arrays} job array(s) could not be submitted.'
+                ' The other arrays were submitted and recorded;'
+                ' run `babs submit` again to submit the remaining jobs.'
+            ) from submit_errors[0]
+
+        if then_merge:
+            array_job_ids = [int(job_id) for job_id in df_needs_submit['job_id'].unique()]
+            merge_job_id = submit_merge_job(
+                self.analysis_path, self.project_root, self.queue, array_job_ids
+            )
+            print(
+                f'Submitted job {merge_job_id} that runs `babs merge`'
+                f' after job array(s) {", ".join(map(str, array_job_ids))} ended.'
+            )
+
+    def _sort_by_input_size(self, df_jobs):
+        """
+        Sort jobs by how much input data they have, largest first.
 
-        # Update the results df
-        updated_results_df = update_submitted_job_ids(
-            self.get_job_status_df(), df_needs_submit[submit_cols]
+        Parameters
+        ----------
+        df_jobs: pd.DataFrame
+            the jobs, with `sub_id` (and `ses_id`)
+
+        Returns
+        -------
+        pd.DataFrame
+            `df_jobs` sorted, with column `input_size` (bytes)
+        """
+        print('Estimating the size of the input data of each job...')
+        sizes_df = self.input_datasets.get_input_sizes()
+        key_columns = ['sub_id', 'ses_id'] if self.processing_level == 'session' else ['sub_id']
+        df_jobs = df_jobs.drop(columns='input_size', errors='ignore').merge(
+            sizes_df, on=key_columns, how='left'
+        )
+        df_jobs['input_size'] = df_jobs['input_size'].fillna(0).astype(int)
+        return df_jobs.sort_values('input_size', ascending=False, kind='stable').reset_index(
+            drop=True
         )
-        updated_results_df.to_csv(self.job_status_path_abs, index=False)
 
-    def babs_status(self, json_output=False):
+    def _get_resource_class_sbatch_args(self, df_jobs, resource_classes):
+        """
+        Get the sbatch options for each job from the resource class of its input size.
+        Jobs larger than every class keep the resources in `participant_job.sh`.
+
+        Parameters
+        ----------
+        df_jobs: pd.DataFrame
+            the jobs, with `input_size` (see `_sort_by_input_size()`)
+        resource_classes: list of dict
+            validated by `validate_resource_classes()`
+
+        Returns
+        -------
+        list of tuple
+            the sbatch options for each row of `df_jobs`
+        """
+        class_sbatch_args = [
+            tuple(resource_class_sbatch_args(resource_class, self.queue))
+            for resource_class in resource_classes
+        ]
+        row_sbatch_args = []
+        for input_size in df_jobs['input_size']:
+            i_class = next(
+                (
+                    i
+                    for i, resource_class in enumerate(resource_classes)
+                    if resource_class['max_input_size'] is None
+                    or input_size <= resource_class['max_input_size']
+                ),
+                None,
+            )
+            row_sbatch_args.append(() if i_class is None else class_sbatch_args[i_class])
+        for i_class, sbatch_args in enumerate(class_sbatch_args):
+            n_jobs = row_sbatch_args.count(sbatch_args)
+            if n_jobs:
+                print(f'Jobs in resource class {i_class + 1} ({" ".join(sbatch_args)}): {n_jobs}')
+        if n_jobs := row_sbatch_args.count(()):
+            print(f'Jobs larger than every resource class (as in participant_job.sh): {n_jobs}')
+        return row_sbatch_args
+
+    def _get_escalated_sbatch_args(self, df_failed):
+        """
+        Get the sbatch options to retry each failed job with,
+        based on why it failed according to the scheduler's accounting.
+
+        Parameters
+        ----------
+        df_failed: pd.DataFrame
+            the failed jobs, with their `job_id` and `task_id`
+
+        Returns
+        -------
+        list of tuple
+            the sbatch options for each row of `df_failed`
+        """
+        job_ids = sorted({int(job_id) for job_id in df_failed['job_id'].dropna()})
+        causes = failure_causes_from_sacct(run_sacct(self.queue, job_ids))
+        unknown = {'cause': 'other', 'req_mem': '', 'time_limit': ''}
+        row_causes = [
+            causes.get((int(job_id), int(task_id)), unknown)
+            if pd.notna(job_id) and pd.notna(task_id)
+            else unknown
+            for job_id, task_id in zip(df_failed['job_id'], df_failed['task_id'], strict=True)
+        ]
+        row_sbatch_args = [tuple(escalated_sbatch_args(**row_cause)) for row_cause in row_causes]
+        for cause in FAILURE_CAUSES:
+            n_jobs = sum(row_cause['cause'] == cause for row_cause in row_causes)
+            if n_jobs:
+                print(f'Failed jobs that {_FAILURE_DESCRIPTIONS[cause]}: {n_jobs}')
+        return row_sbatch_args
+
+    def babs_status(self, json_output=False, timings=False):
         """
         Check job status and makes a nice report.
 
@@ -200,8 +472,20 @@ class BABSInteraction(BABS):
         json_output: bool
             If True, emit only the machine-readable JSON summary to stdout
             (the interface contract) instead of the human-readable table.
+        timings: bool
+            If True, report percentiles of how long each phase of the jobs took
+            (from the timing records in `logs/timings/`) instead of job counts.
         """
         self.ensure_shared_group_runtime_ready()
+        if timings:
+            timings_path = op.join(self.analysis_path, 'logs', 'timings')
+            summary = job_timing_summary(read_job_timings(timings_path))
+            if json_output:
+                print(json.dumps(summary))
+            else:
+                report_job_timings(summary, timings_path)
+            return
+
         statuses = self._update_results_status()
         if json_output:
             print(json.dumps(job_status_counts(statuses)))
@@ -246,3 +530,106 @@ class BABSInteraction(BABS):
         except KeyboardInterrupt:
             print('\nInterrupted by user.')
             sys.exit(130)
+
+    def babs_run(self, max_in_flight, interval=300, max_failures=3, merge_interval=None):
+        """Keep submitting jobs until every job has results or has failed too often.
+
+        Each round refreshes the job status, and submits jobs (those never submitted,
+        and failed ones) until `max_in_flight` jobs are pending or running.
+        Exits 0 once all jobs have results; exits 1 if some jobs failed
+        `max_failures` times and were given up; exits 130 on Ctrl-C.
+
+        Parameters
+        ----------
+        max_in_flight: int
+            number of jobs to keep pending or running
+        interval: int
+            seconds between rounds
+        max_failures: int
+            number of times a job may fail before it is no longer resubmitted.
+            Failures are counted while `babs run` runs; a job that had already
+            failed when it started counts as failed once.
+        merge_interval: int or None
+            if set, run `babs merge` every `merge_interval` seconds (when there are
+            results to merge) and once more at the end. None: never merge.
+        """
+        if max_in_flight < 1:
+            raise ValueError('`max_in_flight` must be at least 1.')
+        if max_failures < 1:
+            raise ValueError('`max_failures` must be at least 1.')
+
+        self.ensure_shared_group_runtime_ready()
+
+        # job ids of the failed runs of each job:
+        failed_job_ids = defaultdict(set)
+        last_merge = time.monotonic()
+        try:
+            while True:
+                statuses = self._update_results_status()
+                for key, job in statuses.items():
+                    if job.is_failed:
+                        failed_job_ids[key].add(job.job_id)
+
+                in_flight = [
+                    job
+                    for job in statuses.values()
+                    if job.submitted and job.scheduler_state != SchedulerState.DONE
+                ]
+                given_up = [
+                    job
+                    for key, job in statuses.items()
+                    if job.is_failed and len(failed_job_ids[key]) >= max_failures
+                ]
+                to_submit = [
+                    job
+                    for key, job in statuses.items()
+                    if not job.submitted
+                    or (job.is_failed and len(failed_job_ids[key]) < max_failures)
+                ]
+                n_results = sum(job.has_results for job in statuses.values())
+                print(
+                    f'\n[{time.strftime("%Y-%m-%d %H:%M:%S")}] {n_results} with results,'
+                    f' {len(in_flight)} pending/running, {len(to_submit)} to submit,'
+                    f' {len(given_up)} given up after {max_failures} failure(s).'
+                )
+                sys.stdout.flush()
+
+                if not in_flight and not to_submit:
+                    if merge_interval is not None:
+                        self._merge_if_results()
+                    print(
+                        f'\nAll jobs finished: {n_results} with results, {len(given_up)} failed.'
+                    )
+                    if given_up:
+                        sys.exit(1)
+                    return
+
+                n_submit = min(max_in_flight - len(in_flight), len(to_submit))
+                if n_submit > 0:
+                    submit_df = pd.DataFrame(
+                        [
+                            {'sub_id': job.sub_id, 'ses_id': job.ses_id}
+                            if self.processing_level == 'session'
+                            else {'sub_id': job.sub_id}
+                            for job in to_submit[:n_submit]
+                        ]
+                    )
+                    self.babs_submit(submit_df=submit_df, skip_running_jobs=True)
+
+                if merge_interval is not None and time.monotonic() - last_merge >= merge_interval:
+                    self._merge_if_results()
+                    last_merge = time.monotonic()
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print('\nInterrupted by user.')
+            sys.exit(130)
+
+    def _merge_if_results(self):
+        """Run `babs merge` if there are results branches in the output RIA."""
+        if not self._get_results_branches():
+            return
+        print('\nMerging the results of finished jobs...')
+        from babs.merge import BABSMerge
+
+        BABSMerge(self.project_root).babs_merge()
@@ -0,0 +1,398 @@
+"""Run BABS jobs on the current machine instead of a cluster.
+
+The ``local`` scheduler backend takes the same ``sbatch`` command lines as Slurm
+(see ``submit_job_template.yaml``), and runs the array tasks of each job
+with a pool of worker processes in a detached runner process (see ``run_job()``).
+Each task gets ``SLURM_ARRAY_JOB_ID`` and ``SLURM_ARRAY_TASK_ID`` like on Slurm,
+so ``participant_job.sh`` runs unchanged.
+
+The state of the jobs is kept in ``LOCAL_SCHEDULER_DIR``, one folder per job:
+
+- ``job.json``: what to run, parsed from the ``sbatch`` command line;
+- ``runner.pid``: the process that runs the tasks of the job;
+- ``<task_id>.start``: when the task started;
+- ``<task_id>.exit``: the exit code of the task, once it has ended.
+
+``squeue()`` and ``sacct()`` report the jobs in the format of Slurm's ``squeue`` and ``sacct``,
+so the status of the jobs goes through the same path as on Slurm.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import os.path as op
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Where the local backend keeps the state of its jobs (shared by all projects of a user):
+LOCAL_SCHEDULER_DIR = os.environ.get(
+    'BABS_LOCAL_SCHEDULER_DIR',
+    op.join(
+        os.environ.get('XDG_CACHE_HOME', op.expanduser('~/.cache')), 'babs', 'local_scheduler'
+    ),
+)
+
+# How often (seconds) a job with `--dependency` checks whether the jobs it waits for have ended:
+DEPENDENCY_POLL_INTERVAL = 5
+
+# Runners started by this process, reaped once they exit so they don't linger as zombies:
+_runners = []
+
+
+def _sbatch_parser():
+    """Parse the subset of ``sbatch`` options that BABS uses."""
+    parser = argparse.ArgumentParser(prog='sbatch', add_help=False)
+    parser.add_argument('--job-name', '-J', default=None)
+    parser.add_argument('--output', '-o', default=None)
+    parser.add_argument('--error', '-e', default=None)
+    parser.add_argument('--array', '-a', default=None)
+    parser.add_argument('--dependency', '-d', default=None)
+    parser.add_argument('--export', default=None)
+    parser.add_argument('--wrap', default=None)
+    parser.add_argument('--cpus-per-task', '-c', type=int, default=None)
+    parser.add_argument('--mem', default='')
+    parser.add_argument('--time', '-t', default=None)
+    parser.add_argument('script', nargs='?', default=None)
+    parser.add_argument('script_args', nargs=argparse.REMAINDER)
+    return parser
+
+
+def parse_array_spec(spec):
+    """
+    Parse the value of ``sbatch --array``.
+
+    Parameters
+    ----------
+    spec: str or None
+        e.g. ``'1-100'``, ``'1-100%10'`` (at most 10 tasks at a time) or ``'1'``.
+        None: not an array job, i.e., one task.
+
+    Returns
+    -------
+    task_ids: list of int
+    throttle: int or None
+    """
+    if spec is None:
+        return [1], None
+    match = re.fullmatch(r'(\d+)(?:-(\d+))?(?:%(\d+))?', spec)
+    if not match:
+        raise ValueError(f'Unsupported `--array` for the local scheduler: {spec!r}')
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    throttle = int(match.group(3)) if match.group(3) else None
+    return list(range(first, last + 1)), throttle
+
+
+def parse_sbatch_command(sbatch_cmd_list, working_dir):
+    """
+    Turn an ``sbatch`` command line into the description of a local job.
+
+    Parameters
+    ----------
+    sbatch_cmd_list: list of str
+        the ``sbatch`` command, e.g. from ``submit_job_template.yaml``
+    working_dir: str
+        the working directory of the job
+
+    Returns
+    -------
+    job: dict
+        what `run_job()` needs to run the tasks of the job
+    """
+    options, unknown = _sbatch_parser().parse_known_args(sbatch_cmd_list[1:])
+    if options.wrap is not None:
+        command = ['/bin/sh', '-c', options.wrap]
+    elif options.script is not None:
+        command = [op.join(working_dir, options.script), *options.script_args]
+    else:
+        raise ValueError(f'No job script in the sbatch command: {sbatch_cmd_list}')
+    if unknown:
+        print(f'The local scheduler ignores these sbatch options: {" ".join(unknown)}')
+
+    task_ids, throttle = parse_array_spec(options.array)
+    cpus_per_task = options.cpus_per_task
+    if cpus_per_task is None:
+        cpus_per_task = 1 if options.wrap is not None else _cpus_per_task_from_script(command[0])
+    if throttle is None:
+        # Fill the machine, as each task uses `cpus_per_task` CPUs:
+        throttle = max(1, (os.cpu_count() or 1) // cpus_per_task)
+
+    # `--export=NAME=value,...`: all other variables are inherited from `babs submit`
+    env = {}
+    for item in (options.export or '').split(','):
+        name, sep, value = item.partition('=')
+        if sep:
+            env[name] = value
+
+    dependencies = []
+    if options.dependency is not None:
+        # e.g. `afterany:123:124`; the local scheduler waits for them to end in any case
+        dependencies = [int(job_id) for job_id in options.dependency.split(':')[1:]]
+
+    job_name = options.job_name or op.basename(command[0])
+    output = options.output or op.join(working_dir, 'slurm-%A_%a.out')
+    return {
+        'name': job_name,
+        'command': command,
+        'working_dir': working_dir,
+        'env': env,
+        'task_ids': task_ids,
+        'max_concurrent_tasks': throttle,
+        'cpus_per_task': cpus_per_task,
+        'mem': options.mem,
+        'time_limit': options.time or 'UNLIMITED',
+        'dependencies': dependencies,
+        'output': output,
+        'error': options.error or output,
+    }
+
+
+def _cpus_per_task_from_script(script_path):
+    """Read ``#SBATCH --cpus-per-task`` from the header of the job script, 1 if not set."""
+    try:
+        with open(script_path, errors='replace') as f:
+            header = f.read(8192)
+    except OSError:
+        return 1
+    match = re.search(r'^#SBATCH\s+(?:--cpus-per-task[= ]|-c\s*)(\d+)', header, re.MULTILINE)
+    return int(match.group(1)) if match else 1
+
+
+def _job_dir(job_id):
+    return op.join(LOCAL_SCHEDULER_DIR, str(job_id))
+
+
+def _next_job_id():
+    """Get a new job id, unique among all local jobs of this user."""
+    os.makedirs(LOCAL_SCHEDULER_DIR, exist_ok=True)
+    with open(op.join(LOCAL_SCHEDULER_DIR, 'last_job_id'), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        job_id = int(f.read().strip() or 0) + 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(job_id))
+    return job_id
+
+
+def _read_job(job_id):
+    job_dir = _job_dir(job_id)
+    try:
+        with open(op.join(job_dir, 'job.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _runner_alive(job_id):
+    _runners[:] = [runner for runner in _runners if runner.poll() is None]
+    try:
+        with open(op.join(_job_dir(job_id), 'runner.pid')) as f:
+            pid = int(f.read())
+    except (FileNotFoundError, ValueError):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _task_exit_code(job_id, task_id):
+    try:
+        with open(op.join(_job_dir(job_id), f'{task_id}.exit')) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _task_start_time(job_id, task_id):
+    try:
+        with open(op.join(_job_dir(job_id), f'{task_id}.start')) as f:
+            return float(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _format_elapsed(seconds):
+    """Format a duration like ``squeue`` does, e.g. ``5:03``, ``1:05:03`` or ``2-01:05:03``."""
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f'{days}-{hours:02d}:{minutes:02d}:{seconds:02d}'
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes}:{seconds:02d}'
+
+
+def submit(sbatch_cmd_list, working_dir):
+    """
+    Submit a job to the local scheduler.
+
+    Parameters
+    ----------
+    sbatch_cmd_list: list of str
+        the ``sbatch`` command to run locally
+    working_dir: str
+        the working directory of the job
+
+    Returns
+    -------
+    job_id: int
+        the id of the local job
+    """
+    job = parse_sbatch_command(sbatch_cmd_list, working_dir)
+    job_id = _next_job_id()
+    job_dir = _job_dir(job_id)
+    os.makedirs(job_dir)
+    with open(op.join(job_dir, 'job.json'), 'w') as f:
+        json.dump(job, f, indent=2)
+
+    # The runner outlives `babs submit`, like a job outlives `sbatch`:
+    with open(op.join(job_dir, 'runner.log'), 'w') as runner_log:
+        runner = subprocess.Popen(
+            [sys.executable, '-c', f'from babs.local_scheduler import run_job; run_job({job_id})'],
+            stdin=subprocess.DEVNULL,
+            stdout=runner_log,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, 'BABS_LOCAL_SCHEDULER_DIR': LOCAL_SCHEDULER_DIR},
+            start_new_session=True,
+        )
+    with open(op.join(job_dir, 'runner.pid'), 'w') as f:
+        f.write(str(runner.pid))
+    _runners.append(runner)
+    return job_id
+
+
+def job_ended(job_id):
+    """Whether all tasks of a local job have ended (or its runner is gone)."""
+    job = _read_job(job_id)
+    if job is None or not _runner_alive(job_id):
+        return True
+    return all(_task_exit_code(job_id, task_id) is not None for task_id in job['task_ids'])
+
+
+def squeue(job_id):
+    """
+    Report the pending and running tasks of a local job like ``squeue``.
+
+    Parameters
+    ----------
+    job_id: int
+        the id of the local job
+
+    Returns
+    -------
+    str
+        one line for each task that has not ended yet, in the format of
+        ``squeue -r --noheader --format=%i|%t|%M|%l|%D|%C|%P|%j``
+    """
+    job = _read_job(job_id)
+    if job is None or not _runner_alive(job_id):
+        return ''
+    lines = []
+    for task_id in job['task_ids']:
+        if _task_exit_code(job_id, task_id) is not None:
+            continue
+        start_time = _task_start_time(job_id, task_id)
+        if start_time is None:
+            state, time_used = 'PD', '0:00'
+        else:
+            state, time_used = 'R', _format_elapsed(time.time() - start_time)
+        lines.append(
+            f'{job_id}_{task_id}|{state}|{time_used}|{job["time_limit"]}|1|'
+            f'{job["cpus_per_task"]}|local|{job["name"]}'
+        )
+    return ''.join(line + '\n' for line in lines)
+
+
+def sacct(job_ids):
+    """
+    Report the ended tasks of local jobs like ``sacct``.
+
+    Parameters
+    ----------
+    job_ids: list of int
+        the ids of the local jobs
+
+    Returns
+    -------
+    str
+        one line for each ended task, in the format of
+        ``sacct --noheader --parsable2 --format=JobID,State,ReqMem,Timelimit``.
+        Tasks are ``COMPLETED`` or ``FAILED`` by exit code.
+    """
+    lines = []
+    for job_id in job_ids:
+        job = _read_job(job_id)
+        if job is None:
+            continue
+        for task_id in job['task_ids']:
+            exit_code = _task_exit_code(job_id, task_id)
+            if exit_code is None:
+                continue
+            state = 'COMPLETED' if exit_code == 0 else 'FAILED'
+            lines.append(f'{job_id}_{task_id}|{state}|{job["mem"]}|{job["time_limit"]}')
+    return ''.join(line + '\n' for line in lines)
+
+
+def _log_path(pattern, job_id, task_id):
+    for placeholder, value in (('%A', job_id), ('%a', task_id), ('%j', job_id)):
+        pattern = pattern.replace(placeholder, str(value))
+    return pattern
+
+
+def _run_task(job_id, job, task_id):
+    """Run one array task of a local job, recording when it started and how it ended."""
+    job_dir = _job_dir(job_id)
+    with open(op.join(job_dir, f'{task_id}.start'), 'w') as f:
+        f.write(str(time.time()))
+    env = {
+        **os.environ,
+        **job['env'],
+        'SLURM_JOB_ID': str(job_id),
+        'SLURM_ARRAY_JOB_ID': str(job_id),
+        'SLURM_ARRAY_TASK_ID': str(task_id),
+        'SLURM_JOB_NAME': job['name'],
+        'SLURM_CPUS_PER_TASK': str(job['cpus_per_task']),
+    }
+    output = _log_path(job['output'], job_id, task_id)
+    error = _log_path(job['error'], job_id, task_id)
+    with open(output, 'a') as stdout, open(error, 'a') if error != output else stdout as stderr:
+        try:
+            exit_code = subprocess.run(
+                job['command'],
+                cwd=job['working_dir'],
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=stdout,
+                stderr=stderr,
+                check=False,
+            ).returncode
+        except OSError as e:
+            stderr.write(f'Failed to run {job["command"][0]}: {e}\n')
+            exit_code = 127
+    with open(op.join(job_dir, f'{task_id}.exit'), 'w') as f:
+        f.write(str(exit_code))
+
+
+def run_job(job_id):
+    """
+    Run all tasks of a local job, at most ``max_concurrent_tasks`` at a time.
+
+    This is what the runner process started by `submit()` does.
+    """
+    job = _read_job(job_id)
+    while not all(job_ended(dependency) for dependency in job['dependencies']):
+        time.sleep(DEPENDENCY_POLL_INTERVAL)
+    with ThreadPoolExecutor(max_workers=job['max_concurrent_tasks']) as pool:
+        # Each worker waits for its task's process, so tasks run in parallel:
+        list(pool.map(lambda task_id: _run_task(job_id, job, task_id), job['task_ids']))
@@ -113,6 +113,8 @@ class BABSMerge(BABS):
             This option should only be used by developers for testing purpose.
         """
 
+        self.ensure_shared_group_runtime_ready()
+
         # First, make sure all the results branches are reflected in the results dataframe
         self._update_results_status()
 
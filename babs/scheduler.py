@@ -1,13 +1,25 @@
 import os.path as op
 import re
+import shlex
+import shutil
 import subprocess
+import sys
+import uuid
 from io import StringIO
 
+import backoff
 import pandas as pd
 import yaml
 
-from babs.status import job_status_counts
-from babs.utils import get_username, scheduler_status_columns, status_dtypes
+from babs import local_scheduler
+from babs.generate_submit_script import SCHEDULER_SYSTEM_LUT
+from babs.status import TIMING_PERCENTILES, job_status_counts
+from babs.utils import (
+    RESOURCE_CLASS_KEYS,
+    get_username,
+    scheduler_status_columns,
+    status_dtypes,
+)
 
 
 def run_squeue(queue, job_id: int) -> str:
@@ -16,7 +28,7 @@ def run_squeue(queue, job_id: int) -> str:
     Parameters
     ----------
     queue : str
-        Job scheduling system type (only 'slurm' supported).
+        Job scheduling system type, 'slurm' or 'local'.
     job_id : int
         The job array ID to query.
 
@@ -26,8 +38,10 @@ def run_squeue(queue, job_id: int) -> str:
         Raw squeue stdout (pipe-delimited lines), or empty string if
         no jobs found.
     """
-    if queue != 'slurm':
-        raise NotImplementedError(f'Queue {queue!r} is not supported.')
+    return get_scheduler_backend(queue).squeue(job_id)
+
+
+def _run_squeue_slurm(job_id):
     if not check_slurm_available():
         raise RuntimeError('Slurm commands are not available on this system.')
 
@@ -53,6 +67,49 @@ def run_squeue(queue, job_id: int) -> str:
     return result.stdout
 
 
+def run_sacct(queue, job_ids) -> str:
+    """Run sacct and return raw pipe-delimited output.
+
+    Parameters
+    ----------
+    queue : str
+        Job scheduling system type, 'slurm' or 'local'.
+    job_ids : list of int
+        The job array IDs to query.
+
+    Returns
+    -------
+    str
+        Raw sacct stdout (pipe-delimited lines: job_id|state|req_mem|time_limit),
+        one line for each array task and each of its steps.
+    """
+    if not job_ids:
+        return ''
+    return get_scheduler_backend(queue).sacct(job_ids)
+
+
+def _run_sacct_slurm(job_ids):
+    cmd = [
+        'sacct',
+        '--noheader',
+        '--parsable2',
+        '--format=JobID,State,ReqMem,Timelimit',
+        '-j',
+        ','.join(str(job_id) for job_id in job_ids),
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    except FileNotFoundError as e:
+        raise RuntimeError(
+            'sacct is not available on this system; it is needed to tell why jobs failed.'
+        ) from e
+    if result.returncode != 0:
+        raise RuntimeError(
+            f'sacct failed with return code {result.returncode}\nstderr: {result.stderr}'
+        )
+    return result.stdout
+
+
 def check_slurm_available() -> bool:
     """Check if Slurm commands are available on the system.
 
@@ -100,17 +157,6 @@ def squeue_to_pandas(job_id=None) -> pd.DataFrame:
     RuntimeError
         If squeue command fails or returns unexpected output.
     """
-    squeue_columns = [
-        # job_id is {array_id}_{task_id}: it will be split later
-        'job_id',
-        'state',
-        'time_used',
-        'time_limit',
-        'nodes',
-        'cpus',
-        'partition',
-        'name',
-    ]
     # Get current username
     username = get_username()
 
@@ -146,8 +192,36 @@ def squeue_to_pandas(job_id=None) -> pd.DataFrame:
     # print('\nFull squeue output:')
     # print(result.stdout)
 
+    return squeue_output_to_pandas(result.stdout)
+
+
+def squeue_output_to_pandas(raw_squeue) -> pd.DataFrame:
+    """Parse the output of `squeue -r --noheader --format=%i|%t|%M|%l|%D|%C|%P|%j`.
+
+    Parameters
+    ----------
+    raw_squeue: str
+        the squeue output, one line for each array task
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the columns `scheduler_status_columns`, see `squeue_to_pandas()`.
+    """
+    squeue_columns = [
+        # job_id is {array_id}_{task_id}: it will be split later
+        'job_id',
+        'state',
+        'time_used',
+        'time_limit',
+        'nodes',
+        'cpus',
+        'partition',
+        'name',
+    ]
+
     # Handle empty output
-    if not result.stdout.strip():
+    if not raw_squeue.strip():
         # print('Warning: squeue returned empty output')
         # Return empty DataFrame with correct columns
         return pd.DataFrame(columns=scheduler_status_columns)
@@ -155,13 +229,13 @@ def squeue_to_pandas(job_id=None) -> pd.DataFrame:
     try:
         # Parse the output into a DataFrame
         df = pd.read_csv(
-            StringIO(result.stdout),
+            StringIO(raw_squeue),
             sep='|',
             names=squeue_columns,
             skipinitialspace=True,
         )
     except Exception as e:
-        raise RuntimeError(f'Failed to parse squeue output: {e!s}\nOutput was: {result.stdout}')
+        raise RuntimeError(f'Failed to parse squeue output: {e!s}\nOutput was: {raw_squeue}')
 
     # separate job_id into job_id and task_id
     df['task_id'] = df['job_id'].str.split('_').str[1].astype(int)
@@ -184,23 +258,84 @@ def squeue_to_pandas(job_id=None) -> pd.DataFrame:
     return df
 
 
-def sbatch_get_job_id(sbatch_cmd_list, working_dir):
-    """
-    Robustly submit a SLURM sbatch command and get the job id
+# sbatch fails now and then when the Slurm controller is busy. Submissions that
+# the controller rejected with one of these errors are retried with exponential backoff:
+SBATCH_REJECTED_ERRORS = (
+    'Unable to contact slurm controller',
+    'Slurm temporarily unable to accept job',
+)
+# After these errors, the controller may have accepted the job nonetheless, e.g. when
+# only its reply timed out. The job is looked up by its comment before sbatch is retried,
+# so that it is never submitted twice:
+SBATCH_AMBIGUOUS_ERRORS = (
+    'Socket timed out',
+    'Resource temporarily unavailable',
+    'Communication connection failure',
+    'Zero Bytes were transmitted or received',
+)
+SBATCH_MAX_TRIES = 6
+# Seconds; the waits between tries are drawn up to 1, 2, 4, ... times this, at most 60 s:
+SBATCH_BACKOFF_FACTOR = 2
+# How many job arrays of a split submission `babs submit` submits at the same time:
+MAX_CONCURRENT_SUBMISSIONS = 4
+
+
+class TransientSubmissionError(RuntimeError):
+    """sbatch failed for a reason that may go away when retried, e.g. a busy controller."""
+
+
+def _print_sbatch_retry(details):
+    print(
+        f'sbatch failed ({details["exception"]}); '
+        f'retrying in {details["wait"]:.0f} s (try {details["tries"] + 1}/{SBATCH_MAX_TRIES})'
+    )
 
-    Parameters
-    ----------
-    sbatch_cmd_list: list
-        the command to submit the job
-    working_dir: str
-        the working directory to run the command from
+
+def _find_job_by_comment(comment):
+    """
+    Find the job submitted with `--comment=<comment>`, if the controller accepted it.
 
     Returns
     -------
-    int
-        the job id
+    int or None
+        the (array) job id, or None if there is no such job
+    """
+    proc_squeue = subprocess.run(
+        ['squeue', '--noheader', f'--user={get_username()}', '--format=%A|%k'],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if proc_squeue.returncode != 0:
+        raise TransientSubmissionError(
+            'Could not check with squeue whether the job was submitted despite the error: '
+            f'{proc_squeue.stderr}'
+        )
+    for line in proc_squeue.stdout.splitlines():
+        job_id, _, job_comment = line.partition('|')
+        if job_comment.strip() == comment:
+            return int(job_id)
+    return None
+
+
+@backoff.on_exception(
+    backoff.expo,
+    TransientSubmissionError,
+    max_tries=lambda: SBATCH_MAX_TRIES,
+    on_backoff=_print_sbatch_retry,
+    factor=lambda: SBATCH_BACKOFF_FACTOR,
+    max_value=60,
+)
+def _submit_once(sbatch_cmd_list, working_dir, comment, maybe_submitted):
     """
-    # run the command, get the job id:
+    One try of `sbatch_get_job_id()`. `maybe_submitted` is shared by all tries:
+    it lists the ambiguous errors of the previous tries, after which the job is looked up first.
+    """
+    if maybe_submitted:
+        job_id = _find_job_by_comment(comment)
+        if job_id is not None:
+            return job_id
+
     proc_cmd = subprocess.run(
         sbatch_cmd_list,
         cwd=working_dir,
@@ -209,6 +344,15 @@ def sbatch_get_job_id(sbatch_cmd_list, working_dir):
         check=False,
     )
     if proc_cmd.returncode != 0:
+        if any(error in proc_cmd.stderr for error in SBATCH_REJECTED_ERRORS):
+            raise TransientSubmissionError(f'Failed to submit array job: {proc_cmd.stderr}')
+        if any(error in proc_cmd.stderr for error in SBATCH_AMBIGUOUS_ERRORS):
+            maybe_submitted.append(proc_cmd.stderr)
+            job_id = _find_job_by_comment(comment)
+            if job_id is not None:
+                print(f'sbatch failed ({proc_cmd.stderr.strip()}), but job {job_id} was submitted')
+                return job_id
+            raise TransientSubmissionError(f'Failed to submit array job: {proc_cmd.stderr}')
         raise RuntimeError(f'Failed to submit array job: {proc_cmd.stderr}')
 
     # Get the job id from the output
@@ -220,7 +364,159 @@ def sbatch_get_job_id(sbatch_cmd_list, working_dir):
     return int(job_id_match.group(1))
 
 
-def submit_array(analysis_path, queue, maxarray):
+def sbatch_get_job_id(sbatch_cmd_list, working_dir):
+    """
+    Robustly submit a SLURM sbatch command and get the job id
+
+    If sbatch fails with one of `SBATCH_REJECTED_ERRORS`, it is retried
+    with exponential backoff, up to `SBATCH_MAX_TRIES` times.
+    If it fails with one of `SBATCH_AMBIGUOUS_ERRORS`, the job is first looked up
+    by a unique `--comment`, and only submitted again if it is not found.
+
+    Parameters
+    ----------
+    sbatch_cmd_list: list
+        the command to submit the job
+    working_dir: str
+        the working directory to run the command from
+
+    Returns
+    -------
+    int
+        the job id
+    """
+    comment = f'babs-{uuid.uuid4().hex}'
+    sbatch_cmd_list = [sbatch_cmd_list[0], f'--comment={comment}', *sbatch_cmd_list[1:]]
+    return _submit_once(sbatch_cmd_list, working_dir, comment, maybe_submitted=[])
+
+
+# `babs submit --retry-failed --escalate` multiplies the memory of jobs that ran
+# out of memory, and the time limit of jobs that timed out, by this factor:
+ESCALATION_FACTOR = 2
+
+_SLURM_MEMORY_UNITS_MB = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+
+
+def _slurm_memory_to_mb(memory):
+    """Parse a Slurm memory size (e.g. ``32G``, ``4000Mc``) into (MB, per_cpu)."""
+    match = re.fullmatch(r'([\d.]+)([KMGT]?)([nc]?)', memory.strip())
+    if not match:
+        return None, False
+    value = float(match.group(1)) * _SLURM_MEMORY_UNITS_MB[match.group(2) or 'M']
+    return value, match.group(3) == 'c'
+
+
+def _slurm_time_to_minutes(time_limit):
+    """Parse a Slurm time limit (``[days-]hours:minutes:seconds`` or ``minutes:seconds``)."""
+    match = re.fullmatch(r'(?:(\d+)-)?(?:(\d+):)?(\d+):(\d+)', time_limit.strip())
+    if not match:
+        # e.g. UNLIMITED, Partition_Limit
+        return None
+    days, hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) + seconds / 60
+
+
+def escalated_sbatch_args(cause, req_mem, time_limit, factor=ESCALATION_FACTOR):
+    """
+    Get the sbatch options to retry a failed job with more of the resource it ran out of.
+
+    Options on the sbatch command line override the `#SBATCH` directives
+    in `participant_job.sh`.
+
+    Parameters
+    ----------
+    cause: str
+        why the job failed, one of `babs.status.FAILURE_CAUSES`
+    req_mem: str
+        memory the job requested, as reported by sacct (e.g. ``32G``)
+    time_limit: str
+        time limit of the job, as reported by sacct (e.g. ``1-00:00:00``)
+    factor: float
+        how much more memory or time to request
+
+    Returns
+    -------
+    list of str
+        e.g. ``['--mem=65536M']``; empty if there is nothing to escalate.
+    """
+    if cause == 'oom':
+        memory_mb, per_cpu = _slurm_memory_to_mb(req_mem)
+        if memory_mb:
+            flag = '--mem-per-cpu' if per_cpu else '--mem'
+            return [f'{flag}={int(memory_mb * factor + 0.5)}M']
+    elif cause == 'timeout':
+        minutes = _slurm_time_to_minutes(time_limit)
+        if minutes:
+            # `--time=<minutes>` is understood by every Slurm version:
+            return [f'--time={int(minutes * factor + 0.5)}']
+    return []
+
+
+def resource_class_sbatch_args(resource_class, queue):
+    """
+    Get the sbatch options that request the cluster resources of a resource class
+    (see `babs.utils.validate_resource_classes()`).
+
+    Parameters
+    ----------
+    resource_class: dict
+        keys of section `cluster_resources` (e.g. `hard_memory_limit`) and their values
+    queue: str
+        the type of job scheduling system, "slurm" or "local"
+
+    Returns
+    -------
+    list of str
+        e.g. ``['--mem=16G', '--time=04:00:00']``
+    """
+    get_scheduler_backend(queue)  # validates `queue`
+    return [
+        SCHEDULER_SYSTEM_LUT[queue][key].replace('$VALUE', str(value))
+        for key, value in resource_class.items()
+        if key in RESOURCE_CLASS_KEYS and SCHEDULER_SYSTEM_LUT[queue][key]
+    ]
+
+
+# Slurm's default `MaxArraySize`, used if it cannot be read from `scontrol show config`:
+SLURM_DEFAULT_MAX_ARRAY_SIZE = 1001
+
+
+def get_max_array_size(queue):
+    """
+    Get the maximum job array size allowed by the job scheduling system.
+
+    Parameters
+    ----------
+    queue: str
+        the type of job scheduling system, "slurm" or "local"
+
+    Returns
+    -------
+    max_array_size: int
+        Slurm's `MaxArraySize`. Array indices must be smaller than this,
+        so an array starting at index 1 has at most `max_array_size - 1` tasks.
+        `SLURM_DEFAULT_MAX_ARRAY_SIZE` if it cannot be determined.
+    """
+    return get_scheduler_backend(queue).max_array_size()
+
+
+def _get_max_array_size_slurm():
+    try:
+        proc = subprocess.run(
+            ['scontrol', 'show', 'config'],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+    except FileNotFoundError:
+        return SLURM_DEFAULT_MAX_ARRAY_SIZE
+    match = re.search(r'^MaxArraySize\s*=\s*(\d+)', proc.stdout, re.MULTILINE)
+    if proc.returncode != 0 or not match:
+        return SLURM_DEFAULT_MAX_ARRAY_SIZE
+    return int(match.group(1))
+
+
+def submit_array(analysis_path, queue, maxarray, job_submit_path=None, sbatch_args=None):
     """
     This is to submit a job array based on template yaml file.
 
@@ -229,11 +525,16 @@ def submit_array(analysis_path, queue, maxarray):
     analysis_path: str
         path to the `analysis` folder. One attribute in class `BABS`
     queue: str
-        the type of job scheduling system, "sge" or "slurm"
+        the type of job scheduling system, "slurm" or "local"
     maxarray: str
         max index of the array (first index is always 1)
-    flag_print_message: bool
-        to print a message (True) or not (False)
+    job_submit_path: str or None
+        the task manifest (CSV with one row per array task) the jobs of this array
+        read their subject (and session) from.
+        None: `code/job_submit.csv`, i.e., the one in the template yaml file.
+    sbatch_args: list of str or None
+        extra options for sbatch (e.g. ``['--mem=64G']``), which override
+        the directives in `participant_job.sh` for the jobs of this array.
 
     Returns:
     ------------------
@@ -255,13 +556,58 @@ def submit_array(analysis_path, queue, maxarray):
     # sections in this template yaml file:
     cmd_template = templates['cmd_template']
     cmd = cmd_template.replace('${max_array}', f'{maxarray}')
+    if job_submit_path is not None:
+        cmd = cmd.replace(op.join(analysis_path, 'code', 'job_submit.csv'), job_submit_path)
 
-    if queue == 'slurm':
-        job_id = sbatch_get_job_id(cmd.split(), analysis_path)
-    else:
-        raise ValueError('Invalid job scheduler system type `queue`: ' + queue)
+    cmd_list = cmd.split()
+    # sbatch options must come before the job script:
+    cmd_list[1:1] = sbatch_args or []
+    return get_scheduler_backend(queue).submit(cmd_list, analysis_path)
 
-    return job_id
+
+def submit_merge_job(analysis_path, project_root, queue, job_ids):
+    """
+    Submit a job that runs `babs merge` once the given job arrays have ended.
+
+    Parameters
+    ----------
+    analysis_path: str
+        path to the `analysis` folder. One attribute in class `BABS`
+    project_root: str
+        path to the BABS project, to run `babs merge` on
+    queue: str
+        the type of job scheduling system, "slurm" or "local"
+    job_ids: list of int
+        the job arrays to wait for. `babs merge` runs when all their tasks
+        have ended, whether they succeeded or not (`afterany`).
+
+    Returns
+    -------
+    job_id: int
+        the ID of the merge job
+    """
+    backend = get_scheduler_backend(queue)
+
+    template_yaml_path = op.join(analysis_path, 'code', 'submit_job_template.yaml')
+    with open(template_yaml_path) as f:
+        job_name = yaml.safe_load(f)['job_name_template'] + '_merge'
+    # The `babs` installed with this Python, as the merge job may not activate any environment:
+    babs_executable = op.join(op.dirname(sys.executable), 'babs')
+    if not op.exists(babs_executable):
+        babs_executable = shutil.which('babs') or 'babs'
+    cmd = [
+        'sbatch',
+        '--dependency=afterany:' + ':'.join(str(job_id) for job_id in job_ids),
+        '--job-name',
+        job_name,
+        '-e',
+        op.join(analysis_path, 'logs', f'{job_name}.e%j'),
+        '-o',
+        op.join(analysis_path, 'logs', f'{job_name}.o%j'),
+        '--wrap',
+        shlex.join([babs_executable, 'merge', str(project_root)]),
+    ]
+    return backend.submit(cmd, analysis_path)
 
 
 def submit_one_test_job(analysis_path, queue):
@@ -274,7 +620,7 @@ def submit_one_test_job(analysis_path, queue):
     analysis_path: str
         path to the `analysis` folder. One attribute in class `BABS`
     queue: str
-        the type of job scheduling system, "sge" or "slurm"
+        the type of job scheduling system, "slurm" or "local"
 
     Returns:
     -----------
@@ -301,10 +647,7 @@ def submit_one_test_job(analysis_path, queue):
     # sections in this template yaml file:
     cmd = templates['cmd_template']
 
-    if queue == 'slurm':
-        job_id = sbatch_get_job_id(cmd.split(), analysis_path)
-    else:
-        raise ValueError('Invalid job scheduler system type `queue`: ' + queue)
+    job_id = get_scheduler_backend(queue).submit(cmd.split(), analysis_path)
     print(f'Test job has been submitted (job ID: {job_id}).')
 
     return job_id
@@ -349,6 +692,41 @@ def report_job_status(statuses, analysis_path):
     )
 
 
+def report_job_timings(summary, timings_path):
+    """
+    Print a report of how long the phases of the jobs took.
+
+    Parameters
+    ----------
+    summary : dict
+        Output of ``babs.status.job_timing_summary()``.
+    timings_path : str
+        Path to the folder with the timing records of the jobs.
+    """
+    from jinja2 import Environment, PackageLoader, StrictUndefined
+
+    env = Environment(
+        loader=PackageLoader('babs', 'templates'),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        autoescape=False,
+        undefined=StrictUndefined,
+    )
+    template = env.get_template('job_timings_report.jinja')
+
+    print(
+        template.render(
+            n_jobs=summary['jobs'],
+            n_nodes=summary['nodes'],
+            n_failed=summary['failed'],
+            columns=[f'p{q}' for q in TIMING_PERCENTILES] + ['max'],
+            phases=summary['phases'],
+            scratch_kb=summary['scratch_kb'],
+            timings_path=timings_path,
+        )
+    )
+
+
 def request_all_job_status(queue, job_id=None):
     """
     This is to get all jobs' status
@@ -357,7 +735,7 @@ def request_all_job_status(queue, job_id=None):
     Parameters
     ----------
     queue: str
-        the type of job scheduling system, "sge" or "slurm"
+        the type of job scheduling system, "slurm" or "local"
     job_id: int or None
         the job id to request status for
 
@@ -370,8 +748,7 @@ def request_all_job_status(queue, job_id=None):
     """
     if queue == 'sge':
         raise NotImplementedError('SGE is not supported anymore.')
-    elif queue == 'slurm':
-        return _request_all_job_status_slurm(job_id)
+    return get_scheduler_backend(queue).request_all_job_status(job_id)
 
 
 def _request_all_job_status_slurm(job_id=None):
@@ -387,3 +764,78 @@ def _request_all_job_status_slurm(job_id=None):
     if not check_slurm_available():
         raise RuntimeError('Slurm commands are not available on this system.')
     return squeue_to_pandas(job_id)
+
+
+class SlurmBackend:
+    """Run the jobs on a Slurm cluster, with `sbatch`, `squeue` and `sacct`."""
+
+    name = 'slurm'
+
+    def submit(self, sbatch_cmd_list, working_dir):
+        return sbatch_get_job_id(sbatch_cmd_list, working_dir)
+
+    def squeue(self, job_id):
+        return _run_squeue_slurm(job_id)
+
+    def sacct(self, job_ids):
+        return _run_sacct_slurm(job_ids)
+
+    def max_array_size(self):
+        return _get_max_array_size_slurm()
+
+    def request_all_job_status(self, job_id=None):
+        return _request_all_job_status_slurm(job_id)
+
+
+class LocalBackend:
+    """
+    Run the jobs on the current machine, see `babs.local_scheduler`.
+
+    The tasks of each job array run in a pool of worker processes,
+    with `SLURM_ARRAY_TASK_ID` and `SLURM_ARRAY_JOB_ID` set as on Slurm.
+    Their status is reported in the format of `squeue` and `sacct`.
+    """
+
+    name = 'local'
+
+    def submit(self, sbatch_cmd_list, working_dir):
+        return local_scheduler.submit(sbatch_cmd_list, working_dir)
+
+    def squeue(self, job_id):
+        return local_scheduler.squeue(job_id)
+
+    def sacct(self, job_ids):
+        return local_scheduler.sacct(job_ids)
+
+    def max_array_size(self):
+        # No limit, other than the largest index a Slurm array could have:
+        return sys.maxsize
+
+    def request_all_job_status(self, job_id=None):
+        return squeue_output_to_pandas(self.squeue(job_id))
+
+
+# Scheduler backends by `queue` in the BABS configuration. A backend submits `sbatch`
+# command lines (`submit_job_template.yaml`) and reports jobs like `squeue` and `sacct`:
+SCHEDULER_BACKENDS = {
+    'slurm': SlurmBackend,
+    'local': LocalBackend,
+}
+
+
+def get_scheduler_backend(queue):
+    """
+    Get the scheduler backend that submits and monitors the jobs.
+
+    Parameters
+    ----------
+    queue: str
+        the type of job scheduling system, "slurm" or "local"
+
+    Returns
+    -------
+    SlurmBackend or LocalBackend
+    """
+    if queue not in SCHEDULER_BACKENDS:
+        raise ValueError('Invalid job scheduler system type `queue`: ' + queue)
+    return SCHEDULER_BACKENDS[queue]()
@@ -1,11 +1,15 @@
 """Job status data model and CSV I/O for babs status."""
 
 import csv
+import glob
+import json
 import os
 import re
 from dataclasses import dataclass, replace
 from enum import Enum
 
+import numpy as np
+
 
 class SchedulerState(Enum):
     """States a job can be in relative to the scheduler.
@@ -368,6 +372,142 @@ def update_from_scheduler(
     return updated
 
 
+# -- Failure causes -----------------------------------------------------------
+
+# Why a job failed, from the states that `sacct` reports for it and its steps:
+FAILURE_CAUSES = ('timeout', 'oom', 'other')
+
+
+def failure_causes_from_sacct(raw_sacct: str) -> dict[tuple[int, int], dict]:
+    """Classify why each array task failed from raw sacct output.
+
+    Parses sacct output (pipe-delimited: job_id|state|req_mem|time_limit), with one
+    line for each array task (``jobid_taskid``) and one for each of its steps
+    (``jobid_taskid.batch``, ...). A task ran out of memory if it or any of its steps
+    has state OUT_OF_MEMORY, and it timed out if any of them has state TIMEOUT.
+
+    Returns
+    -------
+    dict[tuple[int, int], dict]
+        (job_id, task_id) -> ``{'cause': one of FAILURE_CAUSES,
+        'req_mem': str, 'time_limit': str}``, the latter two as requested
+        for the task (e.g., ``'32G'`` and ``'1-00:00:00'``).
+    """
+    tasks: dict[tuple[int, int], dict] = {}
+    for line in raw_sacct.strip().splitlines():
+        parts = line.strip().split('|')
+        if len(parts) != 4:
+            continue
+        raw_job_id, step = (parts[0].split('.', 1) + [None])[:2]
+        id_parts = raw_job_id.split('_')
+        # pending tasks are listed as ranges, e.g. `123_[4-10]`:
+        if len(id_parts) != 2 or not id_parts[1].isdigit():
+            continue
+        task = tasks.setdefault(
+            (int(id_parts[0]), int(id_parts[1])),
+            {'states': set(), 'req_mem': '', 'time_limit': ''},
+        )
+        # e.g. "CANCELLED by 1234":
+        task['states'].add(parts[1].split()[0] if parts[1] else '')
+        if step is None:
+            task['req_mem'] = parts[2]
+            task['time_limit'] = parts[3]
+
+    causes = {}
+    for ids, task in tasks.items():
+        if 'OUT_OF_MEMORY' in task['states']:
+            cause = 'oom'
+        elif 'TIMEOUT' in task['states']:
+            cause = 'timeout'
+        else:
+            cause = 'other'
+        causes[ids] = {
+            'cause': cause,
+            'req_mem': task['req_mem'],
+            'time_limit': task['time_limit'],
+        }
+    return causes
+
+
+# -- Job timings --------------------------------------------------------------
+
+TIMING_PERCENTILES = (50, 90, 99)
+
+# Phases timed by ``participant_job.sh``, in the order they run in a job:
+JOB_PHASES = (
+    'clone',
+    'sparse_checkout',
+    'get',
+    'container_setup',
+    'container_run',
+    'zip',
+    'push',
+    'lock_wait',
+    'branch_push',
+)
+
+
+def read_job_timings(timings_dir: str) -> list[dict]:
+    """Read the per-job timing records written by ``participant_job.sh``.
+
+    Each job writes ``<timings_dir>/<branch>.json`` when it exits, e.g.
+    ``{"branch": ..., "node": ..., "exit_code": 0, "scratch_kb": 123,
+    "phases": {"clone": 12, "get": 3, ...}}`` (phase durations in seconds).
+    Records that cannot be parsed (e.g. a job killed while writing) are skipped.
+    """
+    records = []
+    for path in sorted(glob.glob(os.path.join(timings_dir, '*.json'))):
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(record, dict) and isinstance(record.get('phases'), dict):
+            records.append(record)
+    return records
+
+
+def _percentile_summary(values: list) -> dict:
+    values = np.asarray(values, dtype=float)
+    summary = {'count': int(values.size)}
+    for q in TIMING_PERCENTILES:
+        summary[f'p{q}'] = float(np.percentile(values, q))
+    summary['max'] = float(values.max())
+    return summary
+
+
+def job_timing_summary(records: list[dict]) -> dict:
+    """Aggregate job timing records into percentiles per phase.
+
+    Shared by the human report and ``babs status --timings --json``.
+    ``phases`` follows the order of ``JOB_PHASES`` and ends with ``total``,
+    the sum of all phases of a job. Phases a job never reached
+    (e.g. because it failed earlier) are left out of that phase's percentiles.
+    """
+    phase_values: dict[str, list] = {}
+    totals = []
+    scratch_kb = []
+    for record in records:
+        for phase, seconds in record['phases'].items():
+            phase_values.setdefault(phase, []).append(seconds)
+        totals.append(sum(record['phases'].values()))
+        if isinstance(record.get('scratch_kb'), int | float):
+            scratch_kb.append(record['scratch_kb'])
+
+    ordered = [phase for phase in JOB_PHASES if phase in phase_values]
+    ordered += [phase for phase in phase_values if phase not in JOB_PHASES]
+    phases = {phase: _percentile_summary(phase_values[phase]) for phase in ordered}
+    if totals:
+        phases['total'] = _percentile_summary(totals)
+    return {
+        'jobs': len(records),
+        'failed': sum(1 for record in records if record.get('exit_code') != 0),
+        'nodes': len({record.get('node') for record in records}),
+        'phases': phases,
+        'scratch_kb': _percentile_summary(scratch_kb) if scratch_kb else None,
+    }
+
+
 # -- Initialization -----------------------------------------------------------
 
 
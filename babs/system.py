@@ -9,7 +9,7 @@ def validate_queue(queue):
     For valid ones, the type string will be changed to lower case.
     If not valid, raise error message.
     """
-    list_supported = ['slurm']
+    list_supported = ['slurm', 'local']
     if queue.lower() in list_supported:
         queue = queue.lower()  # change to lower case, if needed
     elif queue.lower() == 'sge':
@@ -33,13 +33,13 @@ class System:
         ----------
         system_type: str
             Type of the cluster management system.
-            Options are: "sge" and "slurm"
+            Options are: "slurm" and "local"
 
         Attributes
         ----------
         type: str
             Type of the cluster management system.
-            Options are: "sge" and "slurm"
+            Options are: "slurm" and "local"
         dict: dict
             Guidance dict (loaded from `dict_cluster_systems.yaml`)
             for how to run this type of cluster.
@@ -26,6 +26,7 @@ class BABSUpdate(BABS):
         """
         This function syncs the code in the BABS project with the code in the repository.
         """
+        self.ensure_shared_group_runtime_ready()
         updated_files = [
             status
             for status in self.analysis_datalad_handle.status(eval_subdataset_state='commit')
@@ -46,6 +47,8 @@ class BABSUpdate(BABS):
         """
         This function updates the input data in the BABS project.
         """
+        self.ensure_shared_group_runtime_ready()
+
         # Get the input data dataset
         dataset_to_update = self.input_datasets[dataset_name]
 
@@ -8,12 +8,11 @@ import subprocess
 import warnings
 from importlib.metadata import version
 
+import numpy as np
 import pandas as pd
 import yaml
 from filelock import FileLock, Timeout
 
-RUNNING_PYTEST = os.environ.get('RUNNING_PYTEST', '0') == '1'
-
 
 def var_safe_name(name):
     """Map a name to a valid POSIX shell identifier by replacing every non-word
@@ -256,6 +255,106 @@ def app_output_settings_from_config(config):
     return config['zip_foldernames'], bids_app_output_dir
 
 
+# Keys accepted in the optional `zip_options` section, with their defaults.
+# `None` means "leave it to 7z".
+ZIP_OPTIONS_DEFAULTS = {
+    'compression_level': None,
+    'num_threads': None,
+    'store_only': False,
+    'parallel_unzip': False,
+    'push_while_zipping': False,
+}
+
+
+def validate_zip_options(zip_options):
+    """
+    Validate the optional `zip_options` section of the container configuration YAML file
+    and fill in the defaults.
+
+    Parameters:
+    ------------
+    zip_options: dict or None
+        `config["zip_options"]`, i.e., how `7z` should (de)compress in the job.
+        Supported keys: `compression_level` (0-9, `7z -mx`),
+        `num_threads` (`7z -mmt`), `store_only` (no compression, `7z -mx=0`),
+        `parallel_unzip` (extract zipped input datasets concurrently),
+        and `push_while_zipping` (upload each zip file while the next one is compressed).
+
+    Returns:
+    ---------
+    zip_options: dict
+        all keys of `ZIP_OPTIONS_DEFAULTS`, with user-provided values.
+    """
+    if zip_options is None:
+        zip_options = {}
+    if not isinstance(zip_options, dict):
+        raise TypeError(
+            f'Section `zip_options` must be a mapping (key: value pairs), '
+            f'got {type(zip_options).__name__}'
+        )
+
+    unknown_keys = sorted(set(zip_options) - set(ZIP_OPTIONS_DEFAULTS))
+    if unknown_keys:
+        raise ValueError(
+            f'Invalid key(s) in section `zip_options`: {", ".join(unknown_keys)}. '
+            f'Supported keys are: {", ".join(ZIP_OPTIONS_DEFAULTS)}'
+        )
+    validated = {**ZIP_OPTIONS_DEFAULTS, **zip_options}
+
+    for key in ('store_only', 'parallel_unzip', 'push_while_zipping'):
+        if not isinstance(validated[key], bool):
+            raise TypeError(f'`{key}` in section `zip_options` must be true or false.')
+
+    level = validated['compression_level']
+    if level is not None and (
+        isinstance(level, bool) or not isinstance(level, int) or not 0 <= level <= 9
+    ):
+        raise ValueError(
+            f'`compression_level` in section `zip_options` must be an integer '
+            f'between 0 and 9, got {level!r}'
+        )
+    if validated['store_only'] and level not in (None, 0):
+        raise ValueError(
+            '`store_only: true` and `compression_level` in section `zip_options` '
+            'contradict each other. Please only keep one of them.'
+        )
+
+    num_threads = validated['num_threads']
+    if num_threads is not None and (
+        isinstance(num_threads, bool) or not isinstance(num_threads, int) or num_threads < 1
+    ):
+        raise ValueError(
+            f'`num_threads` in section `zip_options` must be a positive integer, '
+            f'got {num_threads!r}'
+        )
+
+    return validated
+
+
+def get_zip_compression_flags(zip_options):
+    """
+    Translate validated `zip_options` into the switches of `7z a`.
+
+    Parameters:
+    ------------
+    zip_options: dict
+        output of `validate_zip_options()`
+
+    Returns:
+    ---------
+    flags: list of str
+        e.g., ``['-mx=1', '-mmt=4']``; empty if 7z defaults should be used.
+    """
+    flags = []
+    if zip_options['store_only']:
+        flags.append('-mx=0')
+    elif zip_options['compression_level'] is not None:
+        flags.append(f'-mx={zip_options["compression_level"]}')
+    if zip_options['num_threads'] is not None:
+        flags.append(f'-mmt={zip_options["num_threads"]}')
+    return flags
+
+
 def get_username():
     """
     Get the current username.
@@ -311,6 +410,36 @@ def print_versions_from_yaml(fn_yaml):
     return flag_writable, flag_all_installed
 
 
+def read_datalad_dataset_id(dataset_path):
+    """
+    Read the id of a DataLad dataset from its committed configuration, `.datalad/config`,
+    with ``git config``, i.e., without calling `datalad`.
+
+    Parameters:
+    --------------
+    dataset_path: str
+        path to the DataLad dataset
+
+    Returns:
+    -------------
+    dataset_id: str or None
+        the dataset id (`datalad.dataset.id`), or None if it is not found
+    """
+    config_path = os.path.join(dataset_path, '.datalad', 'config')
+    if not os.path.exists(config_path):
+        return None
+    proc_config = subprocess.run(
+        ['git', 'config', '--file', config_path, '--includes', '--get', 'datalad.dataset.id'],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+    # exit code 1: the key is not set
+    if proc_config.returncode != 0:
+        return None
+    return proc_config.stdout.strip() or None
+
+
 def get_git_show_ref_shasum(branch_name, the_path):
     """
     This is to get current commit's shasum by calling `git show-ref`.
@@ -352,6 +481,210 @@ def get_git_show_ref_shasum(branch_name, the_path):
     return git_ref, msg
 
 
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
+def parse_size(size):
+    """
+    Parse a size such as ``500M`` or ``2G`` (powers of 1024) into bytes.
+
+    Parameters:
+    ------------
+    size: int or str
+        number of bytes, or a number followed by K, M, G or T
+
+    Returns:
+    ---------
+    n_bytes: int
+    """
+    if isinstance(size, int) and not isinstance(size, bool):
+        return size
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)B?\s*', str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError(f'Invalid size {size!r}; expected e.g. 500M or 2G.')
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def get_file_sizes_from_git(repo_path):
+    """
+    Get the size of every file in a git (or datalad) repository
+    without getting the content of annexed files.
+
+    Parameters:
+    --------------
+    repo_path: str
+        path to the git (or datalad) repository
+
+    Returns:
+    -------------
+    file_sizes: dict
+        path relative to the repository -> size in bytes.
+        For annexed files, the size is read from their annex key (``...-s<bytes>--...``),
+        for other files it is the size of the git blob.
+    """
+    proc_ls_tree = subprocess.run(
+        ['git', 'ls-tree', '-r', '-l', '-z', 'HEAD'],
+        cwd=repo_path,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    file_sizes = {}
+    symlinks = {}
+    for entry in proc_ls_tree.stdout.decode('utf-8').split('\0'):
+        if not entry:
+            continue
+        # e.g. `120000 blob <sha> 128\tsub-01/anat/sub-01_T1w.nii.gz`:
+        info, path = entry.split('\t', 1)
+        mode, object_type, sha, size = info.split()
+        if object_type != 'blob':
+            continue
+        if mode == '120000':
+            symlinks.setdefault(sha, []).append(path)
+        else:
+            file_sizes[path] = int(size)
+
+    if symlinks:
+        # Annexed files are symlinks to their key; read all targets at once:
+        proc_cat_file = subprocess.run(
+            ['git', 'cat-file', '--batch'],
+            cwd=repo_path,
+            input='\n'.join(symlinks).encode('utf-8'),
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        # The output is `<sha> blob <size>\n<target>\n` for each symlink:
+        output = proc_cat_file.stdout
+        position = 0
+        for paths in symlinks.values():
+            header_end = output.index(b'\n', position)
+            target_size = int(output[position:header_end].split()[2])
+            target = output[header_end + 1 : header_end + 1 + target_size].decode('utf-8')
+            position = header_end + 1 + target_size + 1
+            key_size = re.search(r'-s(\d+)--', os.path.basename(target))
+            for path in paths:
+                file_sizes[path] = int(key_size.group(1)) if key_size else 0
+
+    return file_sizes
+
+
+def list_git_tree(repo_path, max_depth=1):
+    """
+    List the files and directories committed in a git (or datalad) repository,
+    from one ``git ls-tree`` of its HEAD, i.e., without a checkout or any ``stat`` calls.
+
+    Parameters:
+    --------------
+    repo_path: str
+        path to the git (or datalad) repository
+    max_depth: int
+        1: only the entries at the root of the repository;
+        larger: also the directories up to this many levels deep
+        (deeper files are not listed).
+
+    Returns:
+    -------------
+    entries: list of tuple
+        (path relative to the repository, is_directory), in git's (sorted) order.
+        Subdatasets (git submodules) are directories. ``git ls-tree`` does not
+        descend into them, so the directories of installed subdatasets are listed
+        from their own trees (e.g. `sub-01/ses-A` when `sub-01` is a subdataset);
+        the contents of subdatasets that are not installed are not listed.
+    """
+    ls_tree_cmd = ['git', 'ls-tree', '-z', 'HEAD']
+    if max_depth > 1:
+        # `-r -d`: all directories (and subdatasets), recursively, but no files
+        ls_tree_cmd[2:2] = ['-r', '-d']
+    proc_ls_tree = subprocess.run(
+        ls_tree_cmd,
+        cwd=repo_path,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    entries = []
+    for entry in proc_ls_tree.stdout.decode('utf-8').split('\0'):
+        if not entry:
+            continue
+        # e.g. `040000 tree <sha>\tsub-01/ses-A`:
+        info, path = entry.split('\t', 1)
+        depth = path.count('/') + 1
+        if depth > max_depth:
+            continue
+        object_type = info.split()[1]
+        entries.append((path, object_type != 'blob'))
+        # a subdataset (gitlink), whose directories are only in its own tree:
+        subdataset_path = os.path.join(repo_path, path)
+        if (
+            object_type == 'commit'
+            and depth < max_depth
+            and os.path.exists(os.path.join(subdataset_path, '.git'))
+        ):
+            entries.extend(
+                (f'{path}/{sub_path}', is_directory)
+                for sub_path, is_directory in list_git_tree(subdataset_path, max_depth - depth)
+                if is_directory
+            )
+    return entries
+
+
+RESOURCE_CLASS_KEYS = (
+    'hard_memory_limit',
+    'temporary_disk_space',
+    'number_of_cpus',
+    'hard_runtime_limit',
+)
+
+
+def validate_resource_classes(resource_classes):
+    """
+    Validate the resource classes for `babs submit --resource-classes`.
+
+    Parameters:
+    ------------
+    resource_classes: list of dict
+        from smallest to largest input size. Each class has `max_input_size`
+        (e.g. ``2G``; may be left out in the last class, which then takes all larger jobs),
+        and the cluster resources of its jobs with the keys of section `cluster_resources`
+        (see `RESOURCE_CLASS_KEYS`).
+
+    Returns:
+    ---------
+    resource_classes: list of dict
+        with `max_input_size` in bytes (None for the last class without it).
+    """
+    if not isinstance(resource_classes, list) or not resource_classes:
+        raise TypeError('Resource classes must be a non-empty list of mappings.')
+
+    validated = []
+    for i_class, resource_class in enumerate(resource_classes):
+        if not isinstance(resource_class, dict):
+            raise TypeError(
+                f'Resource class {i_class + 1} must be a mapping (key: value pairs), '
+                f'got {type(resource_class).__name__}'
+            )
+        unknown_keys = sorted(set(resource_class) - {'max_input_size', *RESOURCE_CLASS_KEYS})
+        if unknown_keys:
+            raise ValueError(
+                f'Invalid key(s) in resource class {i_class + 1}: {", ".join(unknown_keys)}. '
+                f'Supported keys are: max_input_size, {", ".join(RESOURCE_CLASS_KEYS)}'
+            )
+        max_input_size = resource_class.get('max_input_size')
+        if max_input_size is None:
+            if i_class != len(resource_classes) - 1:
+                raise ValueError(
+                    f'Resource class {i_class + 1} needs `max_input_size`; '
+                    'only the last class may leave it out.'
+                )
+        else:
+            max_input_size = parse_size(max_input_size)
+            if validated and max_input_size <= validated[-1]['max_input_size']:
+                raise ValueError(
+                    'Resource classes must be ordered by increasing `max_input_size`.'
+                )
+        validated.append({**resource_class, 'max_input_size': max_input_size})
+
+    return validated
+
+
 def get_results_branches(ria_directory):
     """
     Get branch list from git repository.
@@ -493,19 +826,15 @@ def update_submitted_job_ids(results_df, submitted_df):
     """
     if 'sub_id' not in submitted_df:
         raise ValueError('job_submit_df must have a sub_id column')
-
-    # There should be only one job id per submitted job
-    submitted_job_id = submitted_df['job_id'].unique()
-    if len(submitted_job_id) != 1:
-        raise ValueError('There should be only one job id per submitted job')
-    submitted_job_id = int(submitted_job_id[0])
+    if submitted_df['job_id'].isna().any():
+        raise ValueError('Every submitted job must have a job id')
 
     use_sesid = 'ses_id' in results_df and 'ses_id' in submitted_df
     merge_on = ['sub_id', 'ses_id'] if use_sesid else ['sub_id']
     merged = pd.merge(results_df, submitted_df, on=merge_on, how='left', suffixes=('', '_batch'))
-    # Updated which jobs have failed. If they have been submitted, do not have results,
-    # and are not currently running, they have failed.
-    updated_mask = merged['job_id_batch'] == submitted_job_id
+    # Large submissions are split into several arrays, so each row carries
+    # the job id of its own array:
+    updated_mask = merged['job_id_batch'].notna()
 
     merged.loc[updated_mask, 'job_id'] = merged.loc[updated_mask, 'job_id_batch']
     merged.loc[updated_mask, 'task_id'] = merged.loc[updated_mask, 'task_id_batch']
@@ -697,6 +1026,108 @@ def validate_sub_ses_processing_inclusion(processing_inclusion_file, processing_
     return initial_inclu_df
 
 
+def intersect_inclusion_dataframes(inclusion_dfs):
+    """Intersect the subjects (and sessions) of several inclusion DataFrames.
+
+    As with merging them pairwise, each DataFrame is matched on the columns it has
+    in common with the others (e.g. `sub_id` and `ses_id`, or only `sub_id`).
+    When all DataFrames have the same columns in common, the key rows of each DataFrame
+    are hashed once, so that all DataFrames are intersected in one pass.
+
+    Parameters
+    ----------
+    inclusion_dfs : list of pandas DataFrame
+        List of DataFrames containing subject and session information
+
+    Returns
+    -------
+    combined_df : pandas DataFrame
+        The rows of the first DataFrame that are present in all DataFrames,
+        with the other columns of all DataFrames
+    dropouts : list of pandas DataFrame
+        For each of `inclusion_dfs`, the keys (e.g. `sub_id` and `ses_id`)
+        that are in another DataFrame but not in this one
+    """
+    if not inclusion_dfs:
+        raise ValueError('No DataFrames provided')
+
+    shared_columns = {
+        (i, j): [column for column in df.columns if column in other_df.columns]
+        for i, df in enumerate(inclusion_dfs)
+        for j, other_df in enumerate(inclusion_dfs)
+        if i != j
+    }
+    key_columns = [
+        column
+        for column in inclusion_dfs[0].columns
+        if all(column in df.columns for df in inclusion_dfs[1:])
+    ]
+    if any(set(columns) != set(key_columns) for columns in shared_columns.values()):
+        return _intersect_inclusion_dataframes_pairwise(inclusion_dfs, shared_columns)
+    if not key_columns:
+        raise ValueError('The DataFrames have no columns in common')
+
+    key_indexes = [pd.MultiIndex.from_frame(df[key_columns]) for df in inclusion_dfs]
+    all_keys = key_indexes[0].append(key_indexes[1:]).drop_duplicates()
+    in_df = [all_keys.isin(key_index) for key_index in key_indexes]
+    common_keys = all_keys[np.logical_and.reduce(in_df)]
+    dropouts = [all_keys[~is_in].to_frame(index=False) for is_in in in_df]
+
+    combined_df = inclusion_dfs[0][key_indexes[0].isin(common_keys)]
+    for df, key_index in zip(inclusion_dfs[1:], key_indexes[1:], strict=True):
+        other_columns = [column for column in df.columns if column not in combined_df.columns]
+        if other_columns:
+            combined_df = combined_df.merge(
+                df.loc[key_index.isin(common_keys), key_columns + other_columns],
+                on=key_columns,
+            )
+
+    return combined_df.reset_index(drop=True), dropouts
+
+
+def _intersect_inclusion_dataframes_pairwise(inclusion_dfs, shared_columns):
+    """`intersect_inclusion_dataframes()` for DataFrames with different columns in common.
+
+    `shared_columns` maps the positions ``(i, j)`` of two DataFrames
+    to the columns they have in common.
+    """
+    combined_df = inclusion_dfs[0]
+    for df in inclusion_dfs[1:]:
+        on = [column for column in combined_df.columns if column in df.columns]
+        if not on:
+            raise ValueError('The DataFrames have no columns in common')
+        combined_df = combined_df.merge(df, on=on)
+
+    dropouts = []
+    for i, df in enumerate(inclusion_dfs):
+        missing = []
+        for j, other_df in enumerate(inclusion_dfs):
+            on = shared_columns.get((i, j))
+            if not on:
+                continue
+            other_keys = pd.MultiIndex.from_frame(other_df[on])
+            missing.append(
+                other_keys[~other_keys.isin(pd.MultiIndex.from_frame(df[on]))].to_frame(
+                    index=False
+                )
+            )
+        # Keys with more columns first, so that a key with fewer columns (e.g. only `sub_id`)
+        # is only listed when no key with more columns covers it:
+        missing.sort(key=lambda keys: -keys.shape[1])
+        dropout_df = missing[0]
+        for keys in missing[1:]:
+            if set(keys.columns) <= set(dropout_df.columns):
+                listed = pd.MultiIndex.from_frame(dropout_df[keys.columns])
+                keys = keys[~pd.MultiIndex.from_frame(keys).isin(listed)]
+            dropout_df = pd.concat([dropout_df, keys])
+        dropout_df = dropout_df.drop_duplicates(ignore_index=True)
+        dropouts.append(
+            dropout_df[[column for column in df.columns if column in dropout_df.columns]]
+        )
+
+    return combined_df.reset_index(drop=True), dropouts
+
+
 def combine_inclusion_dataframes(initial_inclusion_dfs):
     """Combine multiple inclusion DataFrames into a single DataFrame.
 
@@ -716,11 +1147,5 @@ def combine_inclusion_dataframes(initial_inclusion_dfs):
     if len(initial_inclusion_dfs) == 1:
         return initial_inclusion_dfs[0]
 
-    # Start with the first DataFrame
-    combined_df = initial_inclusion_dfs[0]
-
-    # Iteratively join with remaining DataFrames
-    for df in initial_inclusion_dfs[1:]:
-        combined_df = pd.merge(combined_df, df, how='inner')
-
+    combined_df, _ = intersect_inclusion_dataframes(initial_inclusion_dfs)
     return combined_df
@@ -0,0 +1,239 @@
+"""List the members of the zip files of zipped input datasets without getting them.
+
+A zip file lists its members in its central directory, at the end of the file,
+so `zipfile` only needs a few small reads to list them. For an annexed zip file
+that is not present locally, these reads are done with HTTP range requests
+if git-annex knows a URL for it; otherwise the zip file is got and dropped again
+(in one `datalad get` and one `datalad drop` for all such zip files, as DataLad's
+Python API is not thread-safe).
+
+The member names are cached in ``ZIP_MEMBERS_CACHE_DIR`` by annex key.
+As annex keys are checksums of the content, the cache never goes stale,
+and is shared by all clones of a dataset (e.g., by every ``babs init`` with it).
+"""
+
+import http.client
+import io
+import json
+import os
+import os.path as op
+import subprocess
+import tempfile
+import urllib.parse
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Where the member names of annexed zip files are cached (shared by all projects of a user):
+ZIP_MEMBERS_CACHE_DIR = os.environ.get(
+    'BABS_ZIP_MEMBERS_CACHE_DIR',
+    op.join(os.environ.get('XDG_CACHE_HOME', op.expanduser('~/.cache')), 'babs', 'zip_members'),
+)
+
+# Size of the reads from a remote zip file; the central directory usually fits in one or two:
+RANGE_READ_SIZE = 256 * 1024
+
+
+class HTTPRangeReader(io.RawIOBase):
+    """A seekable, read-only file that reads a URL with HTTP range requests."""
+
+    def __init__(self, url, timeout=30):
+        self.timeout = timeout
+        self._position = 0
+        self._connection = None
+        self._url = url
+        response = self._request('HEAD')
+        # follow a few redirects, e.g. to a storage backend:
+        for _ in range(5):
+            if response.status not in (301, 302, 303, 307, 308):
+                break
+            self._url = urllib.parse.urljoin(self._url, response.getheader('Location'))
+            self._connection.close()
+            self._connection = None
+            response = self._request('HEAD')
+        if response.status != 200 or response.getheader('Accept-Ranges') != 'bytes':
+            raise OSError(f'{url} does not support range requests')
+        try:
+            self.size = int(response.getheader('Content-Length'))
+        except (TypeError, ValueError):  # e.g. a chunked response
+            raise OSError(f'{url} does not report the size of the file')
+
+    def _request(self, method, headers=None):
+        url = urllib.parse.urlsplit(self._url)
+        if self._connection is None:
+            if url.scheme == 'https':
+                self._connection = http.client.HTTPSConnection(url.netloc, timeout=self.timeout)
+            elif url.scheme == 'http':
+                self._connection = http.client.HTTPConnection(url.netloc, timeout=self.timeout)
+            else:
+                raise OSError(f'Unsupported URL scheme: {self._url}')
+        path = f'{url.path or "/"}?{url.query}' if url.query else url.path or '/'
+        self._connection.request(method, path, headers=headers or {})
+        response = self._connection.getresponse()
+        if method == 'HEAD':
+            response.read()
+        return response
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+        return self._position
+
+    def readinto(self, buffer):
+        end = min(self._position + len(buffer), self.size)
+        if end <= self._position:
+            return 0
+        response = self._request('GET', {'Range': f'bytes={self._position}-{end - 1}'})
+        if response.status != 206:
+            # not to download the whole file with `response.read()`:
+            self._connection.close()
+            self._connection = None
+            raise OSError(f'{self._url} ignored the range request')
+        data = response.read()
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+        super().close()
+
+
+def _get_annex_urls(dataset_abs_path, annex_key):
+    """Get the http(s) URLs git-annex knows for `annex_key`, if any."""
+    try:
+        proc_whereis = subprocess.run(
+            ['git', 'annex', 'whereis', '--json', '--key', annex_key],
+            cwd=dataset_abs_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    urls = []
+    for line in proc_whereis.stdout.splitlines():
+        for remote in json.loads(line).get('whereis', []):
+            urls += [
+                url for url in remote.get('urls', []) if url.startswith(('http://', 'https://'))
+            ]
+    return urls
+
+
+def _read_member_names_without_getting(dataset_abs_path, zip_path, annex_key):
+    """
+    List the members of a zip file from its local content or from its URLs.
+
+    Returns
+    -------
+    list of str or None
+        the names of the members, or None if the zip file has to be got to list them
+    """
+    if op.exists(zip_path):  # the content is present (for annexed files: the symlink resolves)
+        with zipfile.ZipFile(zip_path) as zf:
+            return zf.namelist()
+
+    for url in _get_annex_urls(dataset_abs_path, annex_key):
+        try:
+            reader = io.BufferedReader(HTTPRangeReader(url), buffer_size=RANGE_READ_SIZE)
+            with zipfile.ZipFile(reader) as zf:
+                return zf.namelist()
+        except (OSError, http.client.HTTPException, ValueError, zipfile.BadZipFile):
+            continue
+    return None
+
+
+def _get_cached_member_names(annex_key):
+    cache_path = op.join(ZIP_MEMBERS_CACHE_DIR, f'{annex_key}.json')
+    if not op.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def _cache_member_names(annex_key, member_names):
+    os.makedirs(ZIP_MEMBERS_CACHE_DIR, exist_ok=True)
+    # Write to a temporary file first, so concurrent readers never see a partial cache:
+    fd, temp_path = tempfile.mkstemp(dir=ZIP_MEMBERS_CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(member_names, f)
+    os.replace(temp_path, op.join(ZIP_MEMBERS_CACHE_DIR, f'{annex_key}.json'))
+
+
+def get_zip_member_names_batch(dataset_abs_path, zip_paths, max_workers=1):
+    """
+    List the members of zip files in a (datalad) dataset, without getting them if possible.
+
+    The zip files are listed concurrently from their local content, cache or URLs.
+    Those that can only be listed by getting them are got (and dropped) all at once.
+
+    Parameters
+    ----------
+    dataset_abs_path: str
+        absolute path to the dataset
+    zip_paths: list of str
+        paths to the zip files, absolute or relative to `dataset_abs_path`
+    max_workers: int
+        how many zip files to list at the same time
+
+    Returns
+    -------
+    list of list of str
+        the names of the members of each zip file, as `zipfile.ZipFile.namelist()`
+    """
+    zip_paths = [op.join(dataset_abs_path, zip_path) for zip_path in zip_paths]
+
+    def list_without_getting(zip_path):
+        # Annexed files are symlinks to `.git/annex/objects/.../<annex key>`:
+        annex_key = op.basename(os.readlink(zip_path)) if op.islink(zip_path) else None
+        if annex_key is None:
+            try:
+                with zipfile.ZipFile(zip_path) as zf:
+                    return annex_key, zf.namelist()
+            except zipfile.BadZipFile:
+                # e.g. an unlocked annexed file, a pointer file while its content is absent:
+                return annex_key, None
+        member_names = _get_cached_member_names(annex_key)
+        if member_names is None:
+            member_names = _read_member_names_without_getting(
+                dataset_abs_path, zip_path, annex_key
+            )
+            if member_names is not None:
+                _cache_member_names(annex_key, member_names)
+        return annex_key, member_names
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        listed = list(pool.map(list_without_getting, zip_paths))
+    annex_keys = [annex_key for annex_key, _ in listed]
+    all_member_names = [member_names for _, member_names in listed]
+
+    to_get = [i for i, member_names in enumerate(all_member_names) if member_names is None]
+    if to_get:
+        import datalad.api as dlapi
+
+        paths_to_get = [zip_paths[i] for i in to_get]
+        dlapi.get(path=paths_to_get, dataset=dataset_abs_path)
+        try:
+            for i in to_get:
+                with zipfile.ZipFile(zip_paths[i]) as zf:
+                    all_member_names[i] = zf.namelist()
+                if annex_keys[i] is not None:
+                    _cache_member_names(annex_keys[i], all_member_names[i])
+        finally:
+            dlapi.drop(path=paths_to_get, dataset=dataset_abs_path)
+    return all_member_names
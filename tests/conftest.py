@@ -49,6 +49,21 @@ def squeue_available():
     return True
 
 
+@pytest.fixture
+def fake_slurm(tmp_path, monkeypatch):
+    """Use the fake Slurm commands in `tests/fake_slurm` instead of Slurm.
+
+    Returns the path to the fake's state file, which also counts the calls of each command.
+    See `tests/fake_slurm/fake_slurm.py` for the environment variables that configure it.
+    """
+    state_path = tmp_path / 'fake_slurm.json'
+    monkeypatch.setenv(
+        'PATH', op.join(__location__, 'fake_slurm') + os.pathsep + os.environ['PATH']
+    )
+    monkeypatch.setenv('FAKE_SLURM_STATE', str(state_path))
+    return state_path
+
+
 @pytest.fixture(scope='session')
 def simbids_apptainer_image():
     """
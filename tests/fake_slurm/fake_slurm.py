@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""A fake Slurm: ``sbatch``, ``squeue``, ``sacct``, ``scontrol`` and ``sacctmgr``.
+
+The commands in this folder are symlinks to this script, which acts by the name
+it is called with. Put the folder first in ``PATH`` to use them instead of Slurm:
+
+    PATH="$(pwd)/tests/fake_slurm:${PATH}" pytest tests/test_fake_slurm.py
+
+Nothing is run: submitted jobs only exist in a JSON state file, and the state of
+each array task follows from the time since its job was submitted, i.e.,
+pending for ``FAKE_SLURM_PENDING_SECONDS``, then running for ``FAKE_SLURM_RUN_SECONDS``
+(in waves of ``%<throttle>`` tasks), then ended. As only the job arrays are stored,
+arrays of tens of thousands of tasks are cheap to simulate.
+
+Environment variables (read at submission, so each job keeps its own settings):
+
+FAKE_SLURM_STATE
+    path to the state file (default: ``$TMPDIR/fake_slurm.json``)
+FAKE_SLURM_LATENCY
+    seconds each command takes, e.g. to mimic a busy controller (default: 0)
+FAKE_SLURM_PENDING_SECONDS, FAKE_SLURM_RUN_SECONDS
+    how long each task is pending and running (default: 0 and 60)
+FAKE_SLURM_TASK_STATES
+    end states of specific array tasks, e.g. ``2=OUT_OF_MEMORY,5=TIMEOUT``
+    (default: all other tasks end ``COMPLETED``)
+FAKE_SLURM_FAILURE_RATE
+    fraction of the other tasks that end ``FAILED``, chosen deterministically (default: 0)
+FAKE_SLURM_SBATCH_FAILURES
+    number of ``sbatch`` calls that fail with a transient error first, without submitting
+    the job (default: 0)
+FAKE_SLURM_SBATCH_ACCEPTED_FAILURES
+    number of ``sbatch`` calls that submit the job, but still fail as their reply
+    timed out (default: 0)
+FAKE_SLURM_MAX_ARRAY_SIZE
+    ``MaxArraySize`` (default: 1001)
+
+The state file also counts how often each command was called (``calls``),
+e.g. to check how many ``squeue`` calls ``babs status`` makes.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import os.path as op
+import re
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+
+COMPACT_STATES = {
+    'PENDING': 'PD',
+    'RUNNING': 'R',
+    'COMPLETED': 'CD',
+    'FAILED': 'F',
+    'OUT_OF_MEMORY': 'OOM',
+    'TIMEOUT': 'TO',
+    'CANCELLED': 'CA',
+}
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, str(default)))
+
+
+def state_path():
+    return os.environ.get('FAKE_SLURM_STATE', op.join(tempfile.gettempdir(), 'fake_slurm.json'))
+
+
+@contextmanager
+def locked_state():
+    """Read the state file, and write it back (if changed), holding a lock."""
+    path = state_path()
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {
+                'next_job_id': 1000,
+                'sbatch_failures': 0,
+                'sbatch_accepted_failures': 0,
+                'jobs': {},
+                'calls': {},
+            }
+        before = json.dumps(state, sort_keys=True)
+        yield state
+        if json.dumps(state, sort_keys=True) != before:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f'{days}-{hours:02d}:{minutes:02d}:{seconds:02d}'
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes}:{seconds:02d}'
+
+
+def _end_state(job, job_id, task_id):
+    if str(task_id) in job['task_states']:
+        return job['task_states'][str(task_id)]
+    # deterministic, so that repeated calls agree:
+    if zlib.crc32(f'{job_id}_{task_id}'.encode()) / 2**32 < job['failure_rate']:
+        return 'FAILED'
+    return 'COMPLETED'
+
+
+def _start_time(state, job_id):
+    """When the first tasks of a job start: after pending, and after its dependencies."""
+    job = state['jobs'][str(job_id)]
+    start = job['submit_time'] + job['pending_seconds']
+    for dependency in job['dependencies']:
+        if str(dependency) in state['jobs']:
+            start = max(start, _end_time(state, dependency))
+    return start
+
+
+def _task_ids(job):
+    return range(job['first_task'], job['last_task'] + 1)
+
+
+def _end_time(state, job_id):
+    job = state['jobs'][str(job_id)]
+    n_tasks = len(_task_ids(job))
+    n_waves = -(-n_tasks // (job['throttle'] or n_tasks))
+    return _start_time(state, job_id) + n_waves * job['run_seconds']
+
+
+def task_states(state, job_id, now=None):
+    """Get ``(task_id, state, seconds running)`` for each task of a job at time ``now``."""
+    now = time.time() if now is None else now
+    job = state['jobs'][str(job_id)]
+    start = _start_time(state, job_id)
+    throttle = job['throttle'] or len(_task_ids(job))
+    for index, task_id in enumerate(_task_ids(job)):
+        task_start = start + (index // throttle) * job['run_seconds']
+        if now < task_start:
+            yield task_id, 'PENDING', 0
+        elif now < task_start + job['run_seconds']:
+            yield task_id, 'RUNNING', now - task_start
+        else:
+            yield task_id, _end_state(job, job_id, task_id), job['run_seconds']
+
+
+def _parse_array(spec):
+    """Parse `--array=<first>-<last>%<throttle>` into (first, last, throttle)."""
+    match = re.fullmatch(r'(\d+)(?:-(\d+))?(?:%(\d+))?', spec)
+    if not match:
+        return None
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    return first, last, int(match.group(3)) if match.group(3) else None
+
+
+def sbatch(argv, state):
+    parser = argparse.ArgumentParser(prog='sbatch', add_help=False)
+    parser.add_argument('--job-name', '-J', default=None)
+    parser.add_argument('--array', '-a', default=None)
+    parser.add_argument('--dependency', '-d', default=None)
+    parser.add_argument('--mem', default='4G')
+    parser.add_argument('--time', '-t', default='1-00:00:00')
+    parser.add_argument('--cpus-per-task', '-c', type=int, default=1)
+    parser.add_argument('--wrap', default=None)
+    parser.add_argument('--comment', default='')
+    # accepted, but not used:
+    for option in (('--output', '-o'), ('--error', '-e'), ('--export',), ('--partition', '-p')):
+        parser.add_argument(*option)
+    parser.add_argument('script', nargs='?', default=None)
+    parser.add_argument('script_args', nargs=argparse.REMAINDER)
+    options, _ = parser.parse_known_args(argv)
+
+    if state['sbatch_failures'] < int(os.environ.get('FAKE_SLURM_SBATCH_FAILURES', '0')):
+        state['sbatch_failures'] += 1
+        print(
+            'sbatch: error: Batch job submission failed: Socket timed out on send/recv operation',
+            file=sys.stderr,
+        )
+        return 1
+    if options.wrap is None and (options.script is None or not op.exists(options.script)):
+        print(f'sbatch: error: Unable to open file {options.script}', file=sys.stderr)
+        return 1
+    first, last, throttle = 1, 1, None
+    if options.array is not None:
+        array = _parse_array(options.array)
+        max_array_size = int(os.environ.get('FAKE_SLURM_MAX_ARRAY_SIZE', '1001'))
+        if array is None or array[1] >= max_array_size:
+            print(
+                'sbatch: error: Batch job submission failed: Invalid job array specification',
+                file=sys.stderr,
+            )
+            return 1
+        first, last, throttle = array
+
+    task_states_env = os.environ.get('FAKE_SLURM_TASK_STATES', '')
+    job_id = state['next_job_id']
+    state['next_job_id'] += 1
+    state['jobs'][str(job_id)] = {
+        'name': options.job_name or op.basename(options.script or 'wrap'),
+        'first_task': first,
+        'last_task': last,
+        'throttle': throttle,
+        'mem': options.mem,
+        'time_limit': options.time,
+        'cpus': options.cpus_per_task,
+        'dependencies': [int(i) for i in (options.dependency or '').split(':')[1:]],
+        'submit_time': time.time(),
+        'pending_seconds': _env_float('FAKE_SLURM_PENDING_SECONDS', 0),
+        'run_seconds': _env_float('FAKE_SLURM_RUN_SECONDS', 60),
+        'task_states': dict(item.split('=') for item in task_states_env.split(',') if item),
+        'failure_rate': _env_float('FAKE_SLURM_FAILURE_RATE', 0),
+        'comment': options.comment,
+    }
+    n_accepted_failures = int(os.environ.get('FAKE_SLURM_SBATCH_ACCEPTED_FAILURES', '0'))
+    if state['sbatch_accepted_failures'] < n_accepted_failures:
+        state['sbatch_accepted_failures'] += 1
+        print(
+            'sbatch: error: Batch job submission failed: Socket timed out on send/recv operation',
+            file=sys.stderr,
+        )
+        return 1
+    print(f'Submitted batch job {job_id}')
+    return 0
+
+
+SQUEUE_HEADERS = {
+    'i': 'JOBID',
+    'A': 'ARRAY_JOB_ID',
+    'K': 'ARRAY_TASK_ID',
+    't': 'ST',
+    'T': 'STATE',
+    'M': 'TIME',
+    'l': 'TIME_LIMIT',
+    'D': 'NODES',
+    'C': 'CPUS',
+    'P': 'PARTITION',
+    'j': 'NAME',
+    'u': 'USER',
+    'k': 'COMMENT',
+}
+
+
+def _squeue_field(code, job_id, job, task_id, task_state, seconds):
+    fields = {
+        'i': f'{job_id}_{task_id}',
+        'A': str(job_id),
+        'K': str(task_id),
+        't': COMPACT_STATES[task_state],
+        'T': task_state,
+        'M': _format_duration(seconds),
+        'l': job['time_limit'],
+        'D': '1',
+        'C': str(job['cpus']),
+        'P': 'normal',
+        'j': job['name'],
+        'u': os.environ.get('USER', 'user'),
+        'k': job.get('comment', ''),
+    }
+    return fields.get(code, '')
+
+
+def squeue(argv, state):
+    parser = argparse.ArgumentParser(prog='squeue', add_help=False)
+    parser.add_argument('--format', '-o', default='%i|%t|%M|%l|%D|%C|%P|%j')
+    parser.add_argument('--jobs', '-j', default=None)
+    parser.add_argument('--noheader', '-h', action='store_true')
+    options, _ = parser.parse_known_args(argv)
+
+    if options.jobs is None:
+        job_ids = sorted(state['jobs'], key=int)
+    else:
+        job_ids = options.jobs.split(',')
+        if any(job_id not in state['jobs'] for job_id in job_ids):
+            print('slurm_load_jobs error: Invalid job id specified', file=sys.stderr)
+            return 1
+    lines = []
+    now = time.time()
+    for job_id in job_ids:
+        job = state['jobs'][job_id]
+        for task_id, task_state, seconds in task_states(state, job_id, now):
+            if task_state in ('PENDING', 'RUNNING'):
+                lines.append(
+                    _format_squeue_line(options.format, job_id, job, task_id, task_state, seconds)
+                )
+    if not options.noheader:
+        print(
+            re.sub(
+                r'%\.?\d*([a-zA-Z])', lambda m: SQUEUE_HEADERS.get(m.group(1), ''), options.format
+            )
+        )
+    sys.stdout.write(''.join(line + '\n' for line in lines))
+    return 0
+
+
+def _format_squeue_line(format_string, job_id, job, task_id, task_state, seconds):
+    return re.sub(
+        r'%\.?\d*([a-zA-Z])',
+        lambda m: _squeue_field(m.group(1), job_id, job, task_id, task_state, seconds),
+        format_string,
+    )
+
+
+def sacct(argv, state):
+    parser = argparse.ArgumentParser(prog='sacct', add_help=False)
+    parser.add_argument('--format', '-o', default='JobID,State,ReqMem,Timelimit')
+    parser.add_argument('--jobs', '-j', default='')
+    parser.add_argument('--parsable2', '-P', action='store_true')
+    parser.add_argument('--noheader', '-n', action='store_true')
+    options, _ = parser.parse_known_args(argv)
+
+    fields = options.format.split(',')
+    rows = []
+    now = time.time()
+    for job_id in options.jobs.split(','):
+        if job_id not in state['jobs']:
+            continue
+        job = state['jobs'][job_id]
+        pending = []
+        for task_id, task_state, seconds in task_states(state, job_id, now):
+            if task_state == 'PENDING':
+                pending.append(task_id)
+                continue
+            row = {
+                'JobID': f'{job_id}_{task_id}',
+                'State': task_state,
+                'ReqMem': job['mem'],
+                'Timelimit': job['time_limit'],
+                'Elapsed': _format_duration(seconds),
+                'JobName': job['name'],
+            }
+            rows.append(row)
+            if task_state != 'RUNNING':
+                # The batch step of an ended task; it is cancelled when the task times out:
+                step_state = 'CANCELLED' if task_state == 'TIMEOUT' else task_state
+                rows.append({**row, 'JobID': f'{job_id}_{task_id}.batch', 'State': step_state})
+        if pending:
+            # pending tasks are listed as a range:
+            rows.append(
+                {
+                    'JobID': f'{job_id}_[{pending[0]}-{pending[-1]}]',
+                    'State': 'PENDING',
+                    'ReqMem': job['mem'],
+                    'Timelimit': job['time_limit'],
+                    'Elapsed': '00:00:00',
+                    'JobName': job['name'],
+                }
+            )
+    separator = '|' if options.parsable2 else ' '
+    if not options.noheader:
+        print(separator.join(fields))
+    for row in rows:
+        print(separator.join(row.get(field, '') for field in fields))
+    return 0
+
+
+def scontrol(argv, state):
+    if argv[:2] != ['show', 'config']:
+        print(f'scontrol: fake_slurm only supports `show config`, got {argv}', file=sys.stderr)
+        return 1
+    print('Configuration data as of fake_slurm')
+    print('ClusterName             = fake')
+    print(f'MaxArraySize            = {os.environ.get("FAKE_SLURM_MAX_ARRAY_SIZE", "1001")}')
+    return 0
+
+
+def sacctmgr(argv, state):
+    return 0
+
+
+COMMANDS = {
+    'sbatch': sbatch,
+    'squeue': squeue,
+    'sacct': sacct,
+    'scontrol': scontrol,
+    'sacctmgr': sacctmgr,
+}
+
+
+def main(argv):
+    command = op.basename(argv[0])
+    if command not in COMMANDS:
+        print(f'fake_slurm: unknown command {command!r}', file=sys.stderr)
+        return 2
+    time.sleep(_env_float('FAKE_SLURM_LATENCY', 0))
+    with locked_state() as state:
+        state['calls'][command] = state['calls'].get(command, 0) + 1
+        return COMMANDS[command](argv[1:], state)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -10,11 +10,14 @@ import subprocess
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import datalad.api as dlapi
 import pandas as pd
 import pytest
 import yaml
 from conftest import get_config_simbids_path, update_yaml_for_run
 
+import babs.base
+import babs.bootstrap
 from babs import BABSCheckSetup
 from babs.base import BABS, CONFIG_SECTIONS
 from babs.bootstrap import BABSBootstrap
@@ -242,6 +245,60 @@ def test_datalad_save_failure(babs_project_sessionlevel, monkeypatch):
         babs_proj.datalad_save(path=test_file, message='Test save')
 
 
+def test_save_batch_saves_in_one_commit(tmp_path, monkeypatch):
+    """`datalad_save()` calls between `start_save_batch()` and `finish_save_batch()`."""
+    for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+        monkeypatch.setenv(var, 'BABS tester')
+    for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+        monkeypatch.setenv(var, 'babs@example.com')
+    analysis_path = tmp_path / 'analysis'
+    dlapi.create(str(analysis_path), annex=False)
+    babs_proj = object.__new__(BABS)
+    babs_proj.analysis_path = str(analysis_path)
+    babs_proj._analysis_datalad_handle = None
+    babs_proj._save_batch = None
+
+    def count_commits():
+        return int(
+            subprocess.run(
+                ['git', 'rev-list', '--count', 'HEAD'],
+                cwd=analysis_path,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+
+    n_commits = count_commits()
+    babs_proj.start_save_batch()
+    (analysis_path / 'code').mkdir()
+    (analysis_path / 'code' / 'participant_job.sh').write_text('#!/bin/bash\n')
+    babs_proj.datalad_save(path='code/participant_job.sh', message='Participant compute job')
+    (analysis_path / '.gitignore').write_text('logs\n')
+    babs_proj.datalad_save(path=[str(analysis_path / '.gitignore')], message='Save .gitignore')
+    assert count_commits() == n_commits
+
+    babs_proj.finish_save_batch('Initialize BABS project')
+    assert count_commits() == n_commits + 1
+    last_commit = subprocess.run(
+        ['git', 'show', '--format=%B', '--name-only', 'HEAD'],
+        cwd=analysis_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert last_commit.startswith(
+        'Initialize BABS project\n\n- Participant compute job\n- Save .gitignore\n'
+    )
+    assert 'code/participant_job.sh' in last_commit
+    assert '.gitignore' in last_commit
+
+    # After the batch, `datalad_save()` saves right away again:
+    (analysis_path / 'code' / 'README').write_text('code\n')
+    babs_proj.datalad_save(path='code/README', message='Add README')
+    assert count_commits() == n_commits + 2
+
+
 def test_key_info_ria_only(babs_project_sessionlevel):
     """Test wtf_key_info with flag_output_ria_only=True."""
     babs_proj = BABS(babs_project_sessionlevel)
@@ -291,6 +348,76 @@ def test_key_info_resolves_ria_alias_symlink(babs_project_sessionlevel):
     assert babs_proj.output_ria_data_dir == expected_resolved
 
 
+def test_key_info_without_datalad_wtf(babs_project_sessionlevel):
+    """The dataset id of `analysis` is cached by `babs init` and not read by `datalad wtf`."""
+    babs_proj = BABS(babs_project_sessionlevel)
+    assert babs_proj.analysis_dataset_id == read_yaml(babs_proj.config_path)['analysis_dataset_id']
+
+    # projects created before the id was cached read it from `analysis/.datalad/config`:
+    babs_proj.analysis_dataset_id = None
+    real_subprocess_run = subprocess.run
+
+    def mock_run(cmd, *args, **kwargs):
+        assert cmd[0] != 'datalad', '`datalad wtf` should not be called'
+        return real_subprocess_run(cmd, *args, **kwargs)
+
+    with patch('babs.base.subprocess.run', side_effect=mock_run):
+        babs_proj.wtf_key_info(flag_output_ria_only=False)
+    assert babs_proj.analysis_dataset_id == read_yaml(babs_proj.config_path)['analysis_dataset_id']
+
+
+def test_project_info_is_got_on_first_use_and_cached(tmp_path):
+    """Constructing a project runs no `git`; `output_ria_data_dir` is cached by config mtime."""
+    project_root = tmp_path / 'my_babs_project'
+    analysis_path = project_root / 'analysis'
+    output_ria_data_dir = project_root / 'output_ria' / '238' / 'da2f2-2fc4-4b88-a2c5-aa6e754b5d0b'
+    output_ria_data_dir.mkdir(parents=True)
+    (analysis_path / 'code').mkdir(parents=True)
+    subprocess.run(['git', 'init', '-q', str(analysis_path)], check=True)
+    subprocess.run(
+        ['git', '-C', str(analysis_path), 'remote', 'add', 'output', str(output_ria_data_dir)],
+        check=True,
+    )
+    config_path = analysis_path / 'code' / 'babs_proj_config.yaml'
+    config = {
+        'processing_level': 'subject',
+        'queue': 'slurm',
+        'container': {'name': 'simbids-0-0-3'},
+        'input_datasets': {
+            'BIDS': {
+                'origin_url': '/path/to/BIDS',
+                'path_in_babs': 'inputs/data/BIDS',
+                'is_zipped': False,
+            }
+        },
+    }
+    config_path.write_text(yaml.safe_dump(config))
+
+    real_subprocess_run = subprocess.run
+    git_calls = []
+
+    def mock_run(cmd, *args, **kwargs):
+        git_calls.append(cmd)
+        return real_subprocess_run(cmd, *args, **kwargs)
+
+    with patch('babs.base.subprocess.run', side_effect=mock_run):
+        babs_proj = BABS(project_root)
+        assert git_calls == []
+        assert babs_proj.input_datasets['BIDS'].path_in_babs == 'inputs/data/BIDS'
+        assert babs_proj.output_ria_data_dir == str(output_ria_data_dir)
+        assert len(git_calls) == 1
+
+        # another command of the same project reads it from the cache:
+        assert BABS(project_root).output_ria_data_dir == str(output_ria_data_dir)
+        assert len(git_calls) == 1
+
+        # a changed configuration invalidates the cache:
+        mtime_ns = config_path.stat().st_mtime_ns + 10**9
+        os.utime(config_path, ns=(mtime_ns, mtime_ns))
+        assert BABS(project_root).output_ria_data_dir == str(output_ria_data_dir)
+        assert len(git_calls) == 2
+
+
 @pytest.mark.parametrize(
     ('throttle_value', 'expected_in_template'),
     [(10, True), (None, False)],
@@ -480,10 +607,122 @@ def test_shared_group_inits_analysis_and_rias(
         assert mode == 0o770
 
     safe_dirs = subprocess.run(
-        ['git', 'config', '--global', '--get-all', 'safe.directory'],
+        ['git', 'config', '--global', '--includes', '--get-all', 'safe.directory'],
         stdout=subprocess.PIPE,
         text=True,
         check=True,
     ).stdout.splitlines()
     assert str(Path(babs_bootstrap.analysis_path).resolve()) in safe_dirs
     assert str(output_ria_dir.resolve()) in safe_dirs
+
+
+def test_shared_group_safe_directories_are_registered_once(tmp_path, monkeypatch):
+    """The repositories are registered in one go; later calls are skipped by the marker."""
+    global_git_config = tmp_path / 'gitconfig'
+    monkeypatch.setenv('GIT_CONFIG_GLOBAL', str(global_git_config))
+    safe_directories_path = tmp_path / 'config' / 'babs' / 'safe_directories.gitconfig'
+    monkeypatch.setattr(babs.base, 'GIT_SAFE_DIRECTORIES_PATH', str(safe_directories_path))
+
+    project_root = tmp_path / 'my_babs_project'
+    ria_repos = [
+        project_root / 'input_ria' / '238' / 'da2f2-2fc4-4b88-a2c5-aa6e754b5d0b',
+        project_root / 'output_ria' / '238' / 'da2f2-2fc4-4b88-a2c5-aa6e754b5d0b',
+    ]
+    for repo_path in [project_root / 'analysis', *ria_repos]:
+        repo_path.mkdir(parents=True)
+    babs_proj = object.__new__(BABS)
+    babs_proj.shared_group = 'my_group'
+    babs_proj.analysis_path = str(project_root / 'analysis')
+    babs_proj.input_ria_path = str(project_root / 'input_ria')
+    babs_proj.output_ria_path = str(project_root / 'output_ria')
+    babs_proj.input_datasets = []
+
+    def get_safe_dirs():
+        return subprocess.run(
+            ['git', 'config', '--global', '--includes', '--get-all', 'safe.directory'],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+
+    babs_proj.ensure_shared_group_git_safe_directories()
+    assert get_safe_dirs() == sorted(str(p) for p in [project_root / 'analysis', *ria_repos])
+
+    # Once registered, no git and no search of the RIA stores:
+    new_repo = project_root / 'output_ria' / 'alias' / 'new'
+    new_repo.mkdir(parents=True)
+    with patch('babs.base.subprocess.run') as mock_run:
+        babs_proj.ensure_shared_group_git_safe_directories()
+    mock_run.assert_not_called()
+    assert str(new_repo) not in get_safe_dirs()
+
+    babs_proj.ensure_shared_group_git_safe_directories(force=True)
+    assert str(new_repo) in get_safe_dirs()
+    assert global_git_config.read_text().count('safe_directories.gitconfig') == 1
+
+
+def test_push_to_siblings_updates_both_rias(tmp_path, monkeypatch):
+    """`babs init` pushes the analysis dataset to the input and output RIAs concurrently."""
+    for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+        monkeypatch.setenv(var, 'BABS tester')
+    for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+        monkeypatch.setenv(var, 'babs@example.com')
+    analysis_path = tmp_path / 'analysis'
+    dlapi.create(str(analysis_path), annex=False)
+    for sibling in ('input', 'output'):
+        ria_path = tmp_path / f'{sibling}_ria'
+        subprocess.run(['git', 'init', '--bare', '-q', str(ria_path)], check=True)
+        subprocess.run(
+            ['git', 'remote', 'add', sibling, str(ria_path)], cwd=analysis_path, check=True
+        )
+    babs_proj = object.__new__(BABSBootstrap)
+    babs_proj.analysis_path = str(analysis_path)
+
+    babs_proj._push_to_siblings(['input', 'output'])
+
+    def rev_parse(path, ref):
+        return subprocess.run(
+            ['git', 'rev-parse', ref], cwd=path, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    branch = subprocess.run(
+        ['git', 'branch', '--show-current'],
+        cwd=analysis_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    analysis_head = rev_parse(analysis_path, 'HEAD')
+    for sibling in ('input', 'output'):
+        assert rev_parse(tmp_path / f'{sibling}_ria', branch) == analysis_head
+
+    with pytest.raises(RuntimeError, match='datalad push --to missing'):
+        babs_proj._push_to_siblings(['input', 'missing'])
+
+
+def test_run_datalad_commands_limits_processes(tmp_path, monkeypatch):
+    """At most `max_processes` commands run at once; the failed ones are reported."""
+    fake_datalad = tmp_path / 'bin' / 'datalad'
+    fake_datalad.parent.mkdir()
+    # Each command records how many commands were running when it started:
+    fake_datalad.write_text(
+        '#!/bin/bash\n'
+        'touch "running.$1"\n'
+        'ls running.* | wc -l > "seen.$1"\n'
+        'sleep 0.2\n'
+        'rm "running.$1"\n'
+        '[ "$1" != fail ] || { echo "no such dataset"; exit 1; }\n'
+    )
+    fake_datalad.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{fake_datalad.parent}:{os.environ["PATH"]}')
+    names = ['a', 'b', 'c', 'fail', 'd']
+
+    with pytest.raises(RuntimeError, match='datalad fail:\nno such dataset'):
+        babs.bootstrap._run_datalad_commands(
+            [['datalad', name] for name in names],
+            cwd=tmp_path,
+            max_processes=2,
+            description='clone',
+        )
+
+    assert all(int((tmp_path / f'seen.{name}').read_text()) <= 2 for name in names)
@@ -1,7 +1,11 @@
 """Tests for BABS command-line entry points."""
 
+import subprocess
+import sys
 from importlib.metadata import distribution
 
+import pytest
+
 
 def test_console_script_entry_points_load():
     """Ensure every installed BABS console script resolves to a callable."""
@@ -15,3 +19,43 @@ def test_console_script_entry_points_load():
 
     for entry_point in console_scripts:
         assert callable(entry_point.load()), f'{entry_point.name} does not resolve to a callable'
+
+
+def _import_times(statement):
+    """Run `statement` in a fresh interpreter with `-X importtime`.
+
+    Returns a dict of each imported module -> its cumulative import time in microseconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self_us, cumulative_us, module = line.removeprefix('import time:').split('|')
+        import_times[module.strip()] = int(cumulative_us)
+    return import_times
+
+
+@pytest.mark.parametrize(
+    ('statement', 'deferred_modules'),
+    [
+        # every `babs` command imports the CLI and builds its parser:
+        ('import babs.cli; babs.cli._get_parser()', ['datalad.api', 'pandas', 'babs.base']),
+        ('import babs', ['datalad.api', 'pandas', 'babs.base']),
+        # `babs status` and `babs submit`:
+        ('from babs import BABSInteraction', ['datalad.api']),
+    ],
+)
+def test_heavy_imports_are_deferred(statement, deferred_modules):
+    import_times = _import_times(statement)
+    imported = [
+        f'{module} ({import_times[module] / 1000:.0f} ms)'
+        for module in deferred_modules
+        if module in import_times
+    ]
+    assert not imported, f'`{statement}` imported {", ".join(imported)}'
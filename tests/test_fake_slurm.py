@@ -0,0 +1,149 @@
+"""Tests of BABS' Slurm interface against the fake Slurm in `tests/fake_slurm`.
+
+These run on any Linux machine, and check how BABS scales to many jobs,
+e.g. how many times `babs status` calls `squeue`.
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from babs.base import BABS
+from babs.scheduler import (
+    get_max_array_size,
+    request_all_job_status,
+    run_sacct,
+    sbatch_get_job_id,
+    submit_array,
+)
+from babs.status import (
+    SchedulerState,
+    create_initial_statuses,
+    failure_causes_from_sacct,
+    read_job_status_csv,
+    write_job_status_csv,
+)
+
+
+def _write_submit_template(analysis_path):
+    code = analysis_path / 'code'
+    code.mkdir(parents=True)
+    (analysis_path / 'logs').mkdir()
+    script = code / 'participant_job.sh'
+    script.write_text('#!/bin/bash\n')
+    (code / 'submit_job_template.yaml').write_text(
+        f"cmd_template: 'sbatch --job-name toy -e {analysis_path}/logs/toy.e%A_%a"
+        f' -o {analysis_path}/logs/toy.o%A_%a --array=1-${{max_array}} {script}'
+        f" in out {code}/job_submit.csv'\n"
+        "job_name_template: 'toy'\n"
+    )
+
+
+def _calls(state_path):
+    return json.loads(state_path.read_text())['calls']
+
+
+def test_fake_slurm_task_states(fake_slurm, tmp_path, monkeypatch):
+    """Tasks are pending, then running, then end in the configured states."""
+    _write_submit_template(tmp_path)
+    monkeypatch.setenv('FAKE_SLURM_PENDING_SECONDS', '1000')
+    pending_job = submit_array(str(tmp_path), 'slurm', 3)
+    monkeypatch.setenv('FAKE_SLURM_PENDING_SECONDS', '0')
+    running_job = sbatch_get_job_id(
+        ['sbatch', '--array=1-2%1', str(tmp_path / 'code' / 'participant_job.sh')], str(tmp_path)
+    )
+    monkeypatch.setenv('FAKE_SLURM_RUN_SECONDS', '0')
+    monkeypatch.setenv('FAKE_SLURM_TASK_STATES', '2=OUT_OF_MEMORY,3=TIMEOUT')
+    ended_job = submit_array(str(tmp_path), 'slurm', 4, sbatch_args=['--mem=8G'])
+
+    assert request_all_job_status('slurm', pending_job)['state'].tolist() == ['PD'] * 3
+    # throttled to one task at a time:
+    assert request_all_job_status('slurm', running_job)['state'].tolist() == ['R', 'PD']
+    assert request_all_job_status('slurm', ended_job).empty
+
+    causes = failure_causes_from_sacct(run_sacct('slurm', [ended_job]))
+    assert {task_id: cause['cause'] for (_, task_id), cause in causes.items()} == {
+        1: 'other',
+        2: 'oom',
+        3: 'timeout',
+        4: 'other',
+    }
+    assert causes[(ended_job, 2)]['req_mem'] == '8G'
+    assert _calls(fake_slurm)['sbatch'] == 3
+
+
+def test_sbatch_retries_transient_errors(fake_slurm, tmp_path, monkeypatch):
+    """sbatch is retried when the controller times out, but not when the job is invalid."""
+    _write_submit_template(tmp_path)
+    monkeypatch.setattr('babs.scheduler.SBATCH_BACKOFF_FACTOR', 0)
+    monkeypatch.setenv('FAKE_SLURM_SBATCH_FAILURES', '2')
+    job_id = submit_array(str(tmp_path), 'slurm', 3)
+    assert request_all_job_status('slurm', job_id).shape[0] == 3
+    assert _calls(fake_slurm)['sbatch'] == 3
+
+    monkeypatch.setattr('babs.scheduler.SBATCH_MAX_TRIES', 2)
+    monkeypatch.setenv('FAKE_SLURM_SBATCH_FAILURES', '5')
+    with pytest.raises(RuntimeError, match='Socket timed out'):
+        submit_array(str(tmp_path), 'slurm', 3)
+    assert _calls(fake_slurm)['sbatch'] == 5
+
+    # MaxArraySize is 1001 by default:
+    monkeypatch.setenv('FAKE_SLURM_SBATCH_FAILURES', '0')
+    with pytest.raises(RuntimeError, match='Invalid job array specification'):
+        submit_array(str(tmp_path), 'slurm', 1001)
+    assert _calls(fake_slurm)['sbatch'] == 6
+
+
+def test_sbatch_reuses_job_accepted_despite_timeout(fake_slurm, tmp_path, monkeypatch):
+    """When sbatch times out after the job was accepted, the job is not submitted again."""
+    _write_submit_template(tmp_path)
+    monkeypatch.setattr('babs.scheduler.SBATCH_BACKOFF_FACTOR', 0)
+    monkeypatch.setenv('FAKE_SLURM_PENDING_SECONDS', '1000')
+    monkeypatch.setenv('FAKE_SLURM_SBATCH_ACCEPTED_FAILURES', '1')
+    job_id = submit_array(str(tmp_path), 'slurm', 3)
+
+    state = json.loads(fake_slurm.read_text())
+    assert list(state['jobs']) == [str(job_id)]
+    assert state['calls']['sbatch'] == 1
+    assert request_all_job_status('slurm', job_id).shape[0] == 3
+
+
+def test_fake_slurm_max_array_size(fake_slurm, tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_SLURM_MAX_ARRAY_SIZE', '5001')
+    assert get_max_array_size('slurm') == 5001
+
+
+def test_status_calls_squeue_once_per_array(fake_slurm, tmp_path, monkeypatch):
+    """`babs status` of 20,000 jobs in 20 arrays makes one squeue call per array."""
+    n_arrays, tasks_per_array = 20, 1000
+    _write_submit_template(tmp_path)
+    monkeypatch.setenv('FAKE_SLURM_PENDING_SECONDS', '0')
+    monkeypatch.setenv('FAKE_SLURM_RUN_SECONDS', '1000')
+    monkeypatch.setenv('FAKE_SLURM_MAX_ARRAY_SIZE', str(tasks_per_array + 1))
+
+    statuses = create_initial_statuses(
+        [{'sub_id': f'sub-{i:05d}'} for i in range(n_arrays * tasks_per_array)]
+    )
+    keys = list(statuses)
+    for i_array in range(n_arrays):
+        job_id = submit_array(str(tmp_path), 'slurm', tasks_per_array)
+        for task_id in range(1, tasks_per_array + 1):
+            key = keys[i_array * tasks_per_array + task_id - 1]
+            statuses[key].scheduler_state = SchedulerState.PENDING
+            statuses[key].job_id = job_id
+            statuses[key].task_id = task_id
+    job_status_path = tmp_path / 'code' / 'job_status.csv'
+    write_job_status_csv(str(job_status_path), statuses)
+
+    # Only the scheduler is a source of job status here:
+    babs_proj = BABS.__new__(BABS)
+    babs_proj.queue = 'slurm'
+    babs_proj.job_status_path_abs = str(job_status_path)
+    monkeypatch.setattr(babs_proj, '_get_results_branches', list)
+    monkeypatch.setattr(babs_proj, '_get_merged_results_from_analysis_dir', pd.DataFrame)
+    updated = babs_proj._update_results_status()
+
+    assert _calls(fake_slurm)['squeue'] == n_arrays
+    assert all(job.scheduler_state == SchedulerState.RUNNING for job in updated.values())
+    assert read_job_status_csv(str(job_status_path)) == updated
@@ -7,6 +7,7 @@ from babs.generate_bidsapp_runscript import (
     generate_bidsapp_runscript,
     generate_pipeline_runscript,
     get_input_unzipping_cmds,
+    get_output_zipping_cmds,
 )
 from babs.utils import (
     app_output_settings_from_config,
@@ -111,6 +112,114 @@ def test_get_input_unipping_cmds():
     assert len(qsirecon_anat_cmd) > len(qsirecon_cmd)
 
 
+def test_get_input_unzipping_cmds_parallel():
+    """Test that zipped input datasets can be extracted concurrently."""
+    sequential_cmd = get_input_unzipping_cmds(input_datasets_qsirecon_ingressed_anat_zipped)
+    assert 'wait' not in sequential_cmd
+
+    parallel_cmd = get_input_unzipping_cmds(
+        input_datasets_qsirecon_ingressed_anat_zipped, {'parallel_unzip': True}
+    )
+    assert parallel_cmd.count(') &') == 2
+    assert 'wait "${UNZIP_PID}"' in parallel_cmd
+
+    # Nothing to run concurrently with a single zipped input dataset:
+    single_cmd = get_input_unzipping_cmds(input_datasets_qsirecon, {'parallel_unzip': True})
+    assert single_cmd == get_input_unzipping_cmds(input_datasets_qsirecon)
+
+
+def test_get_input_unzipping_cmds_partial(tmp_path):
+    """Test extracting selected members of, or mounting, zipped input datasets."""
+    freesurfer, qsiprep = (
+        {**input_ds} for input_ds in input_datasets_qsirecon_ingressed_anat_zipped
+    )
+    qsiprep['extract_patterns'] = ['qsiprep/dataset_description.json', 'qsiprep/${subid}/anat/*']
+    freesurfer['mount_zip'] = True
+    unzip_cmd = get_input_unzipping_cmds([freesurfer, qsiprep], {'parallel_unzip': True})
+
+    assert (
+        '7z x "${ZIPNAME}" "qsiprep/dataset_description.json" "qsiprep/${subid}/anat/*"'
+        in unzip_cmd
+    )
+    assert 'fuse-zip -r "${FREESURFER_ZIP}"' in unzip_cmd
+    assert 'trap unmount_zipped_inputs EXIT' in unzip_cmd
+    # Only one zip file is left to extract, so there is nothing to run concurrently:
+    assert 'UNZIP_PIDS' not in unzip_cmd
+
+    script_fn = tmp_path / 'unzip.sh'
+    script_fn.write_text(
+        '#!/bin/bash\nset -e -u -x\nsubid=sub-01\n'
+        'FREESURFER_ZIP=freesurfer.zip\nQSIPREP_ZIP=qsiprep.zip\n' + unzip_cmd
+    )
+    passed, status = run_shellcheck(str(script_fn))
+    assert passed, status
+
+
+@pytest.mark.parametrize('fuse_zip', ['missing', 'fails'])
+def test_get_input_unzipping_cmds_mount_falls_back(tmp_path, fuse_zip):
+    """A zip file is extracted instead when fuse-zip is missing or cannot mount it."""
+    freesurfer = {**input_datasets_qsirecon_ingressed_anat_zipped[0], 'mount_zip': True}
+    unzip_cmd = get_input_unzipping_cmds([freesurfer])
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    # a fake 7z that records what it extracts:
+    (bin_dir / '7z').write_text('#!/bin/bash\necho "$PWD $*" >> "${HOME}/7z_calls"\n')
+    if fuse_zip == 'fails':
+        (bin_dir / 'fuse-zip').write_text(
+            '#!/bin/bash\necho "fuse: device not found" >&2\nexit 1\n'
+        )
+    for tool in bin_dir.iterdir():
+        tool.chmod(0o755)
+    (tmp_path / freesurfer['path_in_babs']).mkdir(parents=True)
+    script_fn = tmp_path / 'unzip.sh'
+    script_fn.write_text(
+        '#!/bin/bash\nset -e -u -x\nsubid=sub-01\nFREESURFER_ZIP=sub-01_freesurfer.zip\n'
+        + unzip_cmd
+    )
+    proc = subprocess.run(
+        ['bash', str(script_fn)],
+        cwd=tmp_path,
+        env={'PATH': f'{bin_dir}:/usr/bin:/bin', 'HOME': str(tmp_path)},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+    assert proc.returncode == 0, proc.stderr
+    extract_dir = tmp_path / freesurfer['path_in_babs']
+    assert (tmp_path / '7z_calls').read_text() == f'{extract_dir} x sub-01_freesurfer.zip\n'
+    assert not (extract_dir / '.zipmount_freesurfer').exists()
+
+
+def test_get_output_zipping_cmds_zip_options():
+    """Test that `zip_options` are translated into 7z switches."""
+    zip_foldernames = {'fmriprep': '24-1-1', 'freesurfer': '24-1-1'}
+
+    default_cmd = get_output_zipping_cmds(zip_foldernames, 'subject')
+    assert '7z a ../"${subid}_fmriprep-24-1-1.zip" "fmriprep"' in default_cmd
+
+    tuned_cmd = get_output_zipping_cmds(
+        zip_foldernames, 'session', {'compression_level': 1, 'num_threads': 4}
+    )
+    assert tuned_cmd.count('7z a -mx=1 -mmt=4 ../"${subid}_${sesid}_') == 2
+
+    store_cmd = get_output_zipping_cmds(zip_foldernames, 'subject', {'store_only': True})
+    assert store_cmd.count('7z a -mx=0 ../') == 2
+
+    push_cmd = get_output_zipping_cmds(zip_foldernames, 'subject', {'push_while_zipping': True})
+    assert push_cmd.count('git annex copy --to output-storage ../') == 2
+    assert 'wait "${PUSH_PID}"' in push_cmd
+    assert 'PUSH_PIDS' not in default_cmd
+
+    with pytest.raises(ValueError, match='contradict'):
+        get_output_zipping_cmds(
+            zip_foldernames, 'subject', {'store_only': True, 'compression_level': 5}
+        )
+    with pytest.raises(ValueError, match='Invalid key'):
+        get_output_zipping_cmds(zip_foldernames, 'subject', {'level': 5})
+
+
 @pytest.mark.parametrize(('input_datasets', 'config_file', 'processing_level'), testing_pairs)
 def test_generate_bidsapp_runscript(input_datasets, config_file, processing_level, tmp_path):
     """Test that the bidsapp runscript is generated correctly."""
@@ -128,6 +237,7 @@ def test_generate_bidsapp_runscript(input_datasets, config_file, processing_leve
         bids_app_args=config['bids_app_args'],
         singularity_args=config['singularity_args'],
         templateflow_home='/path/to/templateflow_home',
+        zip_options=config.get('zip_options'),
     )
 
     out_fn = tmp_path / f'{config_path.name}_{processing_level}.sh'
@@ -1,10 +1,13 @@
+import hashlib
+import os
+import re
 import subprocess
 from pathlib import Path
 
 import pytest
 from jinja2 import Environment, PackageLoader, StrictUndefined
 
-from babs.generate_submit_script import generate_submit_script
+from babs.generate_submit_script import generate_submit_script, get_concurrent_tasks
 from babs.utils import (
     read_yaml,
     var_safe_name,
@@ -110,6 +113,7 @@ def test_generate_submit_script(input_datasets, config_file, processing_level, t
         container_name=container_name,
         zip_foldernames=config['zip_foldernames'],
         analysis_path='/tmp/babs_project/analysis',
+        container_cache_space=config.get('container_cache_space'),
     )
 
     out_fn = tmp_path / f'participant_job_{config_path.name}_{processing_level}.sh'
@@ -224,6 +228,17 @@ def test_bids_inheritance_tiers_per_processing_level():
         assert '${DATALAD_INPUTS[@]+"${DATALAD_INPUTS[@]}"}' in script
 
 
+def test_job_phase_timings():
+    """Each phase of the job is timed and the record is written to logs/timings/ on exit."""
+    script = _render(input_datasets_prep, 'subject')
+    for phase in ('clone', 'sparse_checkout', 'get', 'container_run', 'push', 'lock_wait'):
+        assert f'start_phase {phase}\n' in script
+    assert 'local timings_dir="/tmp/babs_project/analysis/logs/timings"' in script
+    assert 'write_timings "${JOB_EXIT_CODE}"' in script
+    # the branch is still pushed under the lock, now with the lock wait timed separately:
+    assert script.index('flock 9') < script.index('git push outputstore "${BRANCH}"')
+
+
 def test_bids_inheritance_skips_zipped_inputs():
     """Zipped inputs get no inheritance grab; only the unzipped one is resolved."""
     script = _render(input_datasets_fmriprep_ingressed_anat, 'subject')
@@ -308,3 +323,159 @@ def test_find_single_zip_handles_regex_metachars_in_name(name, processing_level,
 
     assert result.returncode == 0, result.stderr
     assert zipname in result.stdout, f'zip not located:\nOUT:{result.stdout}\nERR:{result.stderr}'
+
+
+def test_container_image_staged_once_per_node(tmp_path):
+    """With `container_cache_space`, the image is copied to node-local space and verified."""
+    cache_dir = tmp_path / 'node_cache'
+    kwargs = {
+        'queue_system': 'slurm',
+        'cluster_resources_config': {'interpreting_shell': '/bin/bash'},
+        'script_preamble': '',
+        'job_scratch_directory': '/tmp/job',
+        'input_datasets': input_datasets_prep,
+        'processing_level': 'subject',
+        'container_name': 'fmriprep',
+        'zip_foldernames': {'fmriprep': '0'},
+        'analysis_path': '/tmp/babs_project/analysis',
+    }
+    assert 'stage_container_image' not in generate_submit_script(**kwargs)
+    script = generate_submit_script(**kwargs, container_cache_space=str(cache_dir))
+    assert 'stage_container_image "${CONTAINER_SHARED}"' in script
+    stage_fn = re.search(
+        r'^stage_container_image\(\) \{$.*?^\}$', script, re.MULTILINE | re.DOTALL
+    ).group()
+
+    # a fake annexed image, named after its annex key like in a real containers dataset
+    content = b'not really a container image'
+    key = f'SHA256E-s{len(content)}--{hashlib.sha256(content).hexdigest()}.sif'
+    (tmp_path / key).write_bytes(content)
+    (tmp_path / 'image').symlink_to(key)
+    # same size, but its key does not match its content
+    bad_key = f'SHA256E-s{len(content)}--{"0" * 64}.sif'
+    (tmp_path / bad_key).write_bytes(content)
+
+    def stage(image):
+        script = (
+            f'set -e\nCONTAINER_CACHE_DIR="{cache_dir}"\n{stage_fn}\n'
+            f'stage_container_image "{image}"\necho "${{CONTAINER_SOURCE}}"'
+        )
+        return subprocess.run(
+            ['bash', '-c', script],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+
+    first = stage(tmp_path / 'image')
+    assert first.returncode == 0, first.stderr
+    assert first.stdout.strip().endswith(f'node_cache/{key}')
+    assert (cache_dir / key).read_bytes() == content
+    # the second job on this node reuses the copy:
+    second = stage(tmp_path / 'image')
+    assert second.returncode == 0, second.stderr
+    assert 'Staging container image' not in second.stdout
+
+    bad = stage(tmp_path / bad_key)
+    assert bad.returncode != 0
+    assert 'does not match' in bad.stderr
+    assert not (cache_dir / bad_key).exists()
+
+
+def test_array_task_runs_all_of_its_subjects(tmp_path):
+    """An array task runs every manifest row with its task_id, also if one of them fails."""
+    script = generate_submit_script(
+        queue_system='slurm',
+        cluster_resources_config={'interpreting_shell': '/bin/bash'},
+        script_preamble='',
+        job_scratch_directory='/tmp/job',
+        input_datasets=input_datasets_prep,
+        processing_level='subject',
+        container_name='fmriprep',
+        zip_foldernames={'fmriprep': '0'},
+        analysis_path='/tmp/babs_project/analysis',
+    )
+    select_rows = re.search(r'^mapfile -t JOB_ROWS .*$', script, re.MULTILINE).group()
+    run_rows = script[script.index('# Each subject runs in its own background subshell') :]
+
+    manifest = tmp_path / 'job_submit.csv'
+    manifest.write_text('sub_id,job_id,task_id\nsub-01,7,1\nsub-02,7,1\nsub-03,7,2\n')
+    # a stand-in for the job of one subject; sub-01 fails
+    fake_run_job = 'run_job() { set -e; echo "ran $1"; [[ "$1" != sub-01* ]]; }'
+    result = subprocess.run(
+        ['bash', '-c', f'set -e\n{select_rows}\n{fake_run_job}\n{run_rows}'],
+        capture_output=True,
+        text=True,
+        check=False,
+        env={'SUBJECT_CSV': str(manifest), 'SLURM_ARRAY_TASK_ID': '1', 'PATH': os.environ['PATH']},
+    )
+    assert result.stdout.splitlines() == ['ran sub-01,7,1', 'ran sub-02,7,1']
+    assert result.returncode == 1
+    assert '1 of 2 subject(s)' in result.stderr
+
+
+@pytest.mark.parametrize(
+    ('cluster_resources', 'expected'),
+    [
+        ({'number_of_cpus': '8'}, (1, None)),
+        ({'concurrent_tasks': 4}, (4, None)),
+        ({'concurrent_tasks': 4, 'number_of_cpus': '8'}, (4, 2)),
+        ({'concurrent_tasks': 3, 'number_of_cpus': 32}, (3, 10)),
+    ],
+)
+def test_get_concurrent_tasks(cluster_resources, expected):
+    assert get_concurrent_tasks(cluster_resources) == expected
+
+
+def test_get_concurrent_tasks_invalid():
+    with pytest.raises(TypeError, match='must be an integer'):
+        get_concurrent_tasks({'concurrent_tasks': '4'})
+    with pytest.raises(ValueError, match='at least 1'):
+        get_concurrent_tasks({'concurrent_tasks': 0})
+    with pytest.raises(ValueError, match='cannot be larger than'):
+        get_concurrent_tasks({'concurrent_tasks': 8, 'number_of_cpus': '4'})
+
+
+def test_concurrent_tasks_fill_the_node(tmp_path):
+    """With `concurrent_tasks`, the subjects of a job run in a pool that splits the CPUs."""
+    script = generate_submit_script(
+        queue_system='slurm',
+        cluster_resources_config={
+            'interpreting_shell': '/bin/bash',
+            'number_of_cpus': '8',
+            'concurrent_tasks': 2,
+        },
+        script_preamble='',
+        job_scratch_directory='/tmp/job',
+        input_datasets=input_datasets_prep,
+        processing_level='subject',
+        container_name='fmriprep',
+        zip_foldernames={'fmriprep': '0'},
+        analysis_path='/tmp/babs_project/analysis',
+    )
+    assert '#SBATCH --cpus-per-task=8' in script
+    assert 'concurrent_tasks' not in script.split('\n\n')[0]
+    select_rows = re.search(r'^mapfile -t JOB_ROWS .*$', script, re.MULTILINE).group()
+    run_rows = script[script.index('# Each subject runs in its own background subshell') :]
+
+    manifest = tmp_path / 'job_submit.csv'
+    rows = [f'sub-0{i},7,1' for i in range(1, 6)]
+    manifest.write_text('sub_id,job_id,task_id\n' + '\n'.join(rows) + '\n')
+    # a stand-in for the job of one subject that records how many run at the same time
+    fake_run_job = (
+        'run_job() { set -e; touch "running_$1"; ls running_* | wc -l >> concurrency; '
+        'echo "$1 ${SLURM_CPUS_PER_TASK}" >> ran; sleep 0.3; rm "running_$1"; '
+        '[[ "$1" != sub-03* ]]; }'
+    )
+    result = subprocess.run(
+        ['bash', '-c', f'set -e\n{select_rows}\n{fake_run_job}\n{run_rows}'],
+        capture_output=True,
+        text=True,
+        check=False,
+        cwd=tmp_path,
+        env={'SUBJECT_CSV': str(manifest), 'SLURM_ARRAY_TASK_ID': '1', 'PATH': os.environ['PATH']},
+    )
+    assert result.returncode == 1
+    assert '1 of 5 subject(s)' in result.stderr
+    assert sorted((tmp_path / 'ran').read_text().splitlines()) == [f'{row} 4' for row in rows]
+    assert max(int(n) for n in (tmp_path / 'concurrency').read_text().split()) == 2
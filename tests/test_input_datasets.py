@@ -1,7 +1,18 @@
+import shutil
+import subprocess
+import warnings
+import zipfile
+
 import datalad.api as dlapi
+import pandas as pd
 import pytest
 
-from babs.input_dataset import InputDataset, OutputDataset
+from babs.input_dataset import (
+    InputDataset,
+    OutputDataset,
+    validate_nonzipped_input_contents,
+    validate_zipped_input_contents,
+)
 from babs.input_datasets import InputDatasets
 
 
@@ -17,6 +28,21 @@ def _bids(**overrides):
     return InputDataset(**kwargs)
 
 
+def _git_dataset(dataset_path, files):
+    """Commit `files` (path -> content) to a new git repository at `dataset_path`."""
+    dataset_path.mkdir(parents=True)
+    subprocess.run(['git', 'init', '-q', str(dataset_path)], check=True)
+    for path, content in files.items():
+        (dataset_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (dataset_path / path).write_text(content)
+    subprocess.run(['git', 'add', '.'], cwd=dataset_path, check=True)
+    subprocess.run(
+        ['git', '-c', 'user.name=a', '-c', 'user.email=a@b.c', 'commit', '-qm', 'add'],
+        cwd=dataset_path,
+        check=True,
+    )
+
+
 def test_common_paths_default_is_empty():
     """common_paths defaults to [] (BIDS inheritance is automatic, not via this field)."""
     # default: no common_paths supplied
@@ -29,6 +55,41 @@ def test_common_paths_default_is_empty():
     assert _bids(common_paths=[]).common_paths == []
 
 
+def test_zip_extraction_options():
+    """extract_patterns / mount_zip are only valid for zipped input datasets, one at a time."""
+    assert _bids().extract_patterns == []
+    assert _bids(is_zipped=True, mount_zip=True).mount_zip is True
+    with pytest.raises(ValueError, match='only supported for zipped'):
+        _bids(extract_patterns=['BIDS/${subid}/anat/*'])
+    with pytest.raises(ValueError, match='cannot be used together'):
+        _bids(is_zipped=True, extract_patterns=['BIDS/${subid}/anat/*'], mount_zip=True)
+
+
+def test_validate_input_contents_reports_first_invalid_dataset(tmp_path):
+    """The first invalid dataset (in order) is reported."""
+    _git_dataset(tmp_path / 'inputs' / 'data' / 'BIDS', {'sub-01/anat/sub-01_T1w.nii.gz': 'x'})
+    _git_dataset(tmp_path / 'inputs' / 'data' / 'empty', {'README': 'x'})
+    _git_dataset(tmp_path / 'inputs' / 'data' / 'also_empty', {'README': 'x'})
+    datasets = {
+        name: {
+            'origin_url': '/does/not/matter',
+            'path_in_babs': f'inputs/data/{name}',
+            'is_zipped': False,
+        }
+        for name in ['BIDS', 'empty', 'also_empty']
+    }
+    input_datasets = InputDatasets(processing_level='subject', datasets=datasets)
+    input_datasets.update_abs_paths(str(tmp_path))
+
+    with pytest.raises(FileNotFoundError, match='In input dataset empty,'):
+        input_datasets.validate_input_contents()
+
+    del datasets['empty'], datasets['also_empty']
+    input_datasets = InputDatasets(processing_level='subject', datasets=datasets)
+    input_datasets.update_abs_paths(str(tmp_path))
+    assert input_datasets.validate_input_contents() is None
+
+
 @pytest.mark.parametrize(
     ('session_type', 'processing_level'),
     [
@@ -307,3 +368,231 @@ def test_output_dataset(
 
     # check that the output dataset has the same inclusion dataframe
     assert output_dataset.generate_inclusion_dataframe().equals(inclusion_df)
+
+
+@pytest.mark.parametrize('is_zipped', [False, True])
+def test_get_input_sizes(tmp_path, is_zipped):
+    """Input sizes per subject/session are summed from the git tree of the dataset."""
+    files = (
+        {
+            'sub-01_ses-A_BIDS-1-0.zip': 'x' * 10,
+            'sub-01_ses-B_BIDS-1-0.zip': 'x' * 20,
+            'sub-02_ses-A_BIDS-1-0.zip': 'x' * 30,
+        }
+        if is_zipped
+        else {
+            'dataset_description.json': 'x' * 100,
+            'sub-01/ses-A/anat/sub-01_ses-A_T1w.nii.gz': 'x' * 4,
+            'sub-01/ses-A/func/sub-01_ses-A_bold.nii.gz': 'x' * 6,
+            'sub-01/ses-B/anat/sub-01_ses-B_T1w.nii.gz': 'x' * 20,
+            'sub-01/sub-01_sessions.tsv': 'x' * 1000,
+            'sub-02/ses-A/anat/sub-02_ses-A_T1w.nii.gz': 'x' * 30,
+        }
+    )
+    _git_dataset(tmp_path / 'inputs' / 'data' / 'BIDS', files)
+
+    session_ds = _bids(processing_level='session', is_zipped=is_zipped)
+    session_ds.set_babs_project_analysis_path(str(tmp_path))
+    sizes = session_ds.get_input_sizes().sort_values(['sub_id', 'ses_id'])
+    assert sizes.values.tolist() == [
+        ['sub-01', 'ses-A', 10],
+        ['sub-01', 'ses-B', 20],
+        ['sub-02', 'ses-A', 30],
+    ]
+
+    subject_ds = _bids(is_zipped=is_zipped)
+    subject_ds.set_babs_project_analysis_path(str(tmp_path))
+    sizes = subject_ds.get_input_sizes().sort_values('sub_id')
+    expected_sub01 = 30 if is_zipped else 1030
+    assert sizes.values.tolist() == [['sub-01', expected_sub01], ['sub-02', 30]]
+
+
+@pytest.mark.parametrize('is_zipped', [False, True])
+def test_generate_inclusion_dataframe_from_git_tree(tmp_path, is_zipped):
+    """Subjects (sessions) are read from the committed tree; no checkout is needed."""
+    files = (
+        [
+            'sub-01_ses-A_BIDS-1-0.zip',
+            'sub-01_ses-B_BIDS-1-0.zip',
+            'sub-02_ses-A_BIDS-1-0.zip',
+            'sub-03_other-1-0.zip',
+        ]
+        if is_zipped
+        else [
+            'dataset_description.json',
+            'sub-01/ses-A/anat/sub-01_ses-A_T1w.nii.gz',
+            'sub-01/ses-B/anat/sub-01_ses-B_T1w.nii.gz',
+            'sub-02/ses-A/anat/sub-02_ses-A_T1w.nii.gz',
+            'sub-03/anat/sub-03_T1w.nii.gz',
+            'sub-04.txt',
+        ]
+    )
+    dataset_path = tmp_path / 'inputs' / 'data' / 'BIDS'
+    _git_dataset(dataset_path, dict.fromkeys(files, 'x'))
+    # Only the git tree is read, not the checkout:
+    for path in dataset_path.glob('sub-*'):
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+
+    session_ds = _bids(processing_level='session', is_zipped=is_zipped)
+    session_ds.set_babs_project_analysis_path(str(tmp_path))
+    assert session_ds.generate_inclusion_dataframe().values.tolist() == [
+        ['sub-01', 'ses-A'],
+        ['sub-01', 'ses-B'],
+        ['sub-02', 'ses-A'],
+    ]
+
+    subject_ds = _bids(is_zipped=is_zipped)
+    subject_ds.set_babs_project_analysis_path(str(tmp_path))
+    # one row per zip file, i.e., per session of sub-01:
+    expected = (
+        [['sub-01'], ['sub-01'], ['sub-02']] if is_zipped else [['sub-01'], ['sub-02'], ['sub-03']]
+    )
+    assert subject_ds.generate_inclusion_dataframe().values.tolist() == expected
+
+
+def test_sessions_of_subject_subdatasets(tmp_path):
+    """The sessions of installed subject subdatasets are listed from their own trees."""
+    subdatasets_path = tmp_path / 'subdatasets'
+    _git_dataset(subdatasets_path / 'sub-01', {'ses-A/anat/T1w.nii.gz': 'x', 'ses-B/x': 'x'})
+    _git_dataset(subdatasets_path / 'sub-03', {'ses-A/anat/T1w.nii.gz': 'x'})
+    dataset_path = tmp_path / 'inputs' / 'data' / 'BIDS'
+    _git_dataset(dataset_path, {'sub-02/ses-A/anat/T1w.nii.gz': 'x'})
+    git = [
+        'git',
+        '-c',
+        'protocol.file.allow=always',
+        '-c',
+        'user.name=a',
+        '-c',
+        'user.email=a@b.c',
+    ]
+    for subject in ('sub-01', 'sub-03'):
+        subprocess.run(
+            [*git, 'submodule', 'add', '-q', str(subdatasets_path / subject), subject],
+            cwd=dataset_path,
+            check=True,
+        )
+    subprocess.run([*git, 'commit', '-qm', 'add subdatasets'], cwd=dataset_path, check=True)
+    # sub-03 is not installed:
+    subprocess.run([*git, 'submodule', 'deinit', '-q', 'sub-03'], cwd=dataset_path, check=True)
+
+    session_ds = _bids(processing_level='session')
+    session_ds.set_babs_project_analysis_path(str(tmp_path))
+    assert session_ds.generate_inclusion_dataframe().values.tolist() == [
+        ['sub-01', 'ses-A'],
+        ['sub-01', 'ses-B'],
+        ['sub-02', 'ses-A'],
+    ]
+    included_df = pd.DataFrame({'sub_id': ['sub-01', 'sub-02'], 'ses_id': ['ses-B', 'ses-A']})
+    validate_nonzipped_input_contents(str(dataset_path), 'BIDS', 'session', included_df)
+    with pytest.raises(
+        FileNotFoundError, match='no `ses-\\*` folder in subject folder\\(s\\) "sub-03"'
+    ):
+        validate_nonzipped_input_contents(str(dataset_path), 'BIDS', 'session')
+
+
+def test_validate_nonzipped_input_contents_reports_all_missing(tmp_path):
+    """All subjects (sessions) missing from the dataset are reported in one error."""
+    dataset_path = tmp_path / 'BIDS'
+    _git_dataset(
+        dataset_path,
+        {
+            'sub-01/ses-A/anat/sub-01_ses-A_T1w.nii.gz': 'x',
+            'sub-01/ses-B/anat/sub-01_ses-B_T1w.nii.gz': 'x',
+            'sub-02/anat/sub-02_T1w.nii.gz': 'x',
+        },
+    )
+    included_df = pd.DataFrame(
+        {
+            'sub_id': ['sub-01', 'sub-01', 'sub-01', 'sub-03', 'sub-04'],
+            'ses_id': ['ses-A', 'ses-B', 'ses-C', 'ses-A', 'ses-A'],
+        }
+    )
+    with pytest.raises(FileNotFoundError, match='There is no `sub-03`, `sub-04` folder'):
+        validate_nonzipped_input_contents(str(dataset_path), 'BIDS', 'subject', included_df)
+
+    with pytest.raises(FileNotFoundError, match='subject folder\\(s\\) "sub-02"!'):
+        validate_nonzipped_input_contents(str(dataset_path), 'BIDS', 'session')
+
+    with pytest.raises(FileNotFoundError, match='There is no `ses-C` folder in "sub-01"!'):
+        validate_nonzipped_input_contents(
+            str(dataset_path), 'BIDS', 'session', included_df.iloc[:3]
+        )
+
+    assert (
+        validate_nonzipped_input_contents(
+            str(dataset_path), 'BIDS', 'session', included_df.iloc[:2]
+        )
+        is None
+    )
+
+
+def test_generate_inclusion_dataframe_reports_dropouts(tmp_path, capsys):
+    """Subjects missing from any input dataset are dropped, and reported per dataset."""
+    _git_dataset(
+        tmp_path / 'inputs' / 'data' / 'BIDS',
+        {f'sub-0{i}/anat/sub-0{i}_T1w.nii.gz': 'x' for i in (1, 2, 3)},
+    )
+    _git_dataset(
+        tmp_path / 'inputs' / 'data' / 'fmriprep',
+        {f'sub-0{i}/anat/sub-0{i}_desc-preproc_T1w.nii.gz': 'x' for i in (1, 2)},
+    )
+    datasets = {
+        name: {
+            'origin_url': '/does/not/matter',
+            'path_in_babs': f'inputs/data/{name}',
+            'is_zipped': False,
+        }
+        for name in ['BIDS', 'fmriprep']
+    }
+    input_datasets = InputDatasets(processing_level='subject', datasets=datasets)
+    input_datasets.update_abs_paths(str(tmp_path))
+
+    inclu_df = input_datasets.generate_inclusion_dataframe()
+
+    assert inclu_df['sub_id'].tolist() == ['sub-01', 'sub-02']
+    assert list(input_datasets.inclusion_dropouts) == ['fmriprep']
+    assert input_datasets.inclusion_dropouts['fmriprep']['sub_id'].tolist() == ['sub-03']
+    assert 'Input dataset fmriprep lacks 1 subject(s)' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    ('check_zip_files', 'n_checked', 'n_without_folder'), [(1, 1, 0), (3, 3, 1), ('all', 4, 2)]
+)
+def test_validate_zipped_input_contents_checks_sample(
+    tmp_path, check_zip_files, n_checked, n_without_folder
+):
+    """`check_zip_files` of the zip files are checked for the folder of the dataset."""
+    for i_sub in range(1, 5):
+        # every other zip file lacks the `freesurfer/` folder:
+        root = 'freesurfer' if i_sub % 2 else 'FreeSurfer'
+        with zipfile.ZipFile(tmp_path / f'sub-0{i_sub}_freesurfer-7-3-2.zip', 'w') as zf:
+            zf.writestr(f'{root}/sub-0{i_sub}/mri/aseg.mgz', 'x')
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        validate_zipped_input_contents(
+            str(tmp_path), 'freesurfer', 'subject', check_zip_files=check_zip_files
+        )
+    if n_without_folder:
+        assert f'({n_without_folder} of {n_checked} checked)' in str(caught[0].message)
+    else:
+        assert not caught
+
+    included_df = pd.DataFrame({'sub_id': ['sub-03', 'sub-01']})
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        validate_zipped_input_contents(
+            str(tmp_path), 'freesurfer', 'subject', included_df, check_zip_files='all'
+        )
+
+    with pytest.raises(FileNotFoundError, match='No zip file found for inclusion-based query'):
+        validate_zipped_input_contents(
+            str(tmp_path), 'freesurfer', 'subject', pd.DataFrame({'sub_id': ['sub-05']})
+        )
+
+    with pytest.raises(ValueError, match='`check_zip_files` must be a positive integer'):
+        _bids(is_zipped=True, check_zip_files=0)
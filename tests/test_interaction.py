@@ -1,6 +1,7 @@
 """Tests for interaction behaviors."""
 
 import json
+from dataclasses import replace
 from functools import partial
 from pathlib import Path
 
@@ -70,7 +71,16 @@ def _mock_get(path, dataset, *, get_calls=None, events=None, response=_DEFAULT_M
     return response
 
 
-def _mock_submit_array(analysis_path, queue, total_jobs, *, submit_calls=None, events=None):
+def _mock_submit_array(
+    analysis_path,
+    queue,
+    total_jobs,
+    job_submit_path=None,
+    sbatch_args=None,
+    *,
+    submit_calls=None,
+    events=None,
+):
     """Mock scheduler submission with optional event/call recording."""
     if events is not None:
         events.append('submit')
@@ -79,6 +89,11 @@ def _mock_submit_array(analysis_path, queue, total_jobs, *, submit_calls=None, e
     return 123
 
 
+def _array_number(job_submit_path):
+    """The array number of a split submission's task manifest, `code/job_submit_<n>.csv`."""
+    return int(Path(job_submit_path).stem.rsplit('_', 1)[1])
+
+
 def test_babs_submit_blocks_non_cg_jobs(babs_project_subjectlevel, monkeypatch):
     babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
     running_df = pd.DataFrame(
@@ -184,7 +199,7 @@ def test_babs_submit_gets_container_before_scheduler_submit(
     get_calls = []
 
     monkeypatch.setattr(
-        'babs.interaction.dlapi.get',
+        'datalad.api.get',
         partial(_mock_get, get_calls=get_calls, events=events),
     )
     monkeypatch.setattr(
@@ -215,12 +230,12 @@ def test_babs_submit_skips_container_get_when_image_exists(babs_project_subjectl
     submit_calls = []
 
     monkeypatch.setattr(
-        'babs.interaction.dlapi.get',
+        'datalad.api.get',
         lambda path, dataset: get_calls.append((path, dataset)),
     )
     monkeypatch.setattr(
         'babs.interaction.submit_array',
-        lambda analysis_path, queue, total_jobs: submit_calls.append(total_jobs) or 123,
+        lambda analysis_path, queue, total_jobs, **_kwargs: submit_calls.append(total_jobs) or 123,
     )
 
     babs_proj.babs_submit(count=1)
@@ -236,13 +251,13 @@ def test_babs_submit_stops_when_container_get_fails(babs_project_subjectlevel, m
     monkeypatch.setattr(babs_proj, 'get_job_status_df', _minimal_status_df)
     babs_proj.container_images = ['containers/.datalad/environments/missing-container/image']
     monkeypatch.setattr(
-        'babs.interaction.dlapi.get',
+        'datalad.api.get',
         lambda path, dataset: [{'status': 'error', 'message': 'not available'}],
     )
     submit_calls = []
     monkeypatch.setattr(
         'babs.interaction.submit_array',
-        lambda analysis_path, queue, total_jobs: submit_calls.append(total_jobs),
+        lambda analysis_path, queue, total_jobs, **_kwargs: submit_calls.append(total_jobs),
     )
 
     with pytest.raises(RuntimeError, match='Unable to retrieve container image'):
@@ -274,7 +289,7 @@ def test_ensure_container_images_gets_absolute_path_and_dict_status(tmp_path, mo
     babs_proj.container_images = [str(image_path)]
     get_calls = []
     monkeypatch.setattr(
-        'babs.interaction.dlapi.get',
+        'datalad.api.get',
         partial(_mock_get, get_calls=get_calls, response={'status': 'ok'}),
     )
 
@@ -296,7 +311,7 @@ def test_ensure_container_images_accepts_none_status(tmp_path, monkeypatch):
     babs_proj.analysis_path = str(analysis_path)
     babs_proj.container_images = [image_relpath]
     monkeypatch.setattr(
-        'babs.interaction.dlapi.get',
+        'datalad.api.get',
         partial(_mock_get, response=None),
     )
 
@@ -315,7 +330,7 @@ def test_ensure_container_images_errors_if_get_does_not_create_image(tmp_path, m
     babs_proj = object.__new__(BABSInteraction)
     babs_proj.analysis_path = str(analysis_path)
     babs_proj.container_images = ['containers/.datalad/environments/not-created/image']
-    monkeypatch.setattr('babs.interaction.dlapi.get', lambda path, dataset: [{'status': 'ok'}])
+    monkeypatch.setattr('datalad.api.get', lambda path, dataset: [{'status': 'ok'}])
 
     with pytest.raises(FileNotFoundError, match='still not available after `datalad get`'):
         babs_proj.ensure_container_images_available()
@@ -388,6 +403,209 @@ def test_babs_submit_allows_running_skips_jobs(babs_project_subjectlevel, monkey
     assert '10' in captured.out
 
 
+def test_babs_submit_splits_into_arrays(babs_project_subjectlevel, monkeypatch):
+    """Submissions larger than MaxArraySize are split into arrays with their own manifests."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    monkeypatch.setattr(babs_proj, 'get_currently_running_jobs_df', pd.DataFrame)
+    monkeypatch.setattr(babs_proj, 'get_job_status_df', _status_df_for_submit)
+    monkeypatch.setattr(babs_proj, 'ensure_container_images_available', lambda: None)
+    # at most 2 tasks per array (indices 1 and 2):
+    monkeypatch.setattr('babs.interaction.get_max_array_size', lambda _queue: 3)
+
+    submit_calls = []
+
+    def _submit(analysis_path, queue, total_jobs, job_submit_path=None, sbatch_args=None):
+        submit_calls.append((total_jobs, job_submit_path))
+        return 200 + _array_number(job_submit_path)
+
+    monkeypatch.setattr('babs.interaction.submit_array', _submit)
+
+    babs_proj.babs_submit()
+
+    first_manifest = str(Path(babs_proj.analysis_path) / 'code' / 'job_submit_1.csv')
+    second_manifest = str(Path(babs_proj.analysis_path) / 'code' / 'job_submit_2.csv')
+    # The arrays are submitted concurrently, in no particular order:
+    assert sorted(submit_calls, key=lambda call: call[1]) == [
+        (2, first_manifest),
+        (1, second_manifest),
+    ]
+    assert pd.read_csv(first_manifest)['sub_id'].tolist() == ['sub-01', 'sub-02']
+    assert pd.read_csv(second_manifest)['sub_id'].tolist() == ['sub-03']
+
+    submitted_df = pd.read_csv(babs_proj.job_submit_path_abs)
+    assert submitted_df['job_id'].tolist() == [201, 201, 202]
+    assert submitted_df['task_id'].tolist() == [1, 2, 1]
+
+
+def test_babs_submit_records_arrays_before_failure(babs_project_subjectlevel, monkeypatch):
+    """If one array of a split submission fails, the others are still recorded."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    monkeypatch.setattr(babs_proj, 'get_currently_running_jobs_df', pd.DataFrame)
+    monkeypatch.setattr(babs_proj, 'get_job_status_df', _status_df_for_submit)
+    monkeypatch.setattr(babs_proj, 'ensure_container_images_available', lambda: None)
+    monkeypatch.setattr('babs.interaction.get_max_array_size', lambda _queue: 3)
+
+    def _submit(analysis_path, queue, total_jobs, job_submit_path=None, sbatch_args=None):
+        if _array_number(job_submit_path) == 1:
+            raise RuntimeError('Failed to submit array job: sbatch: error: QOSMaxSubmitJobPerUser')
+        return 202
+
+    monkeypatch.setattr('babs.interaction.submit_array', _submit)
+
+    with pytest.raises(RuntimeError, match='1 of 2 job array'):
+        babs_proj.babs_submit()
+
+    submitted_df = pd.read_csv(babs_proj.job_submit_path_abs)
+    assert submitted_df['sub_id'].tolist() == ['sub-03']
+    assert submitted_df['job_id'].tolist() == [202]
+
+
+def test_babs_submit_tasks_per_job(babs_project_subjectlevel, monkeypatch):
+    """Several subjects share one array task (task_id) with `tasks_per_job`."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    monkeypatch.setattr(babs_proj, 'get_currently_running_jobs_df', pd.DataFrame)
+    monkeypatch.setattr(babs_proj, 'get_job_status_df', _status_df_for_submit)
+    monkeypatch.setattr(babs_proj, 'ensure_container_images_available', lambda: None)
+    monkeypatch.setattr('babs.interaction.get_max_array_size', lambda _queue: 1001)
+
+    submit_calls = []
+
+    def _submit(analysis_path, queue, total_jobs, job_submit_path=None, sbatch_args=None):
+        submit_calls.append((total_jobs, job_submit_path))
+        return 300
+
+    monkeypatch.setattr('babs.interaction.submit_array', _submit)
+
+    with pytest.raises(ValueError, match='at least 1'):
+        babs_proj.babs_submit(tasks_per_job=0)
+
+    babs_proj.babs_submit(tasks_per_job=2)
+
+    assert submit_calls == [(2, None)]
+    submitted_df = pd.read_csv(babs_proj.job_submit_path_abs)
+    assert submitted_df['sub_id'].tolist() == ['sub-01', 'sub-02', 'sub-03']
+    assert submitted_df['job_id'].tolist() == [300, 300, 300]
+    assert submitted_df['task_id'].tolist() == [1, 1, 2]
+
+
+def test_babs_submit_retry_failed_escalate(babs_project_subjectlevel, monkeypatch):
+    """Failed jobs are retried in separate arrays by failure cause, with more resources."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    status_df = pd.DataFrame(
+        {
+            'sub_id': ['sub-01', 'sub-02', 'sub-03', 'sub-04'],
+            'submitted': [True, True, True, True],
+            'has_results': [False, False, True, False],
+            'is_failed': [True, True, False, True],
+            'job_id': [10, 10, 10, 10],
+            'task_id': [1, 2, 3, 4],
+        }
+    )
+    monkeypatch.setattr(babs_proj, 'get_currently_running_jobs_df', pd.DataFrame)
+    monkeypatch.setattr(babs_proj, '_update_results_status', dict)
+    monkeypatch.setattr(babs_proj, 'get_job_status_df', lambda: status_df)
+    monkeypatch.setattr(babs_proj, 'ensure_container_images_available', lambda: None)
+    monkeypatch.setattr('babs.interaction.get_max_array_size', lambda _queue: 1001)
+    monkeypatch.setattr(
+        'babs.interaction.run_sacct',
+        lambda queue, job_ids: (
+            '10_1|OUT_OF_MEMORY|16G|2:00:00\n10_2|TIMEOUT|16G|2:00:00\n10_4|FAILED|16G|2:00:00\n'
+        ),
+    )
+    monkeypatch.setattr(
+        'babs.interaction.update_submitted_job_ids', lambda results_df, submitted_df: results_df
+    )
+
+    submit_calls = []
+
+    def _submit(analysis_path, queue, total_jobs, job_submit_path=None, sbatch_args=None):
+        submit_calls.append((total_jobs, Path(job_submit_path).name, sbatch_args))
+        return 20 + _array_number(job_submit_path)
+
+    monkeypatch.setattr('babs.interaction.submit_array', _submit)
+
+    with pytest.raises(ValueError, match='only be used together with `retry_failed`'):
+        babs_proj.babs_submit(escalate=True)
+
+    babs_proj.babs_submit(retry_failed=True, escalate=True)
+
+    assert sorted(submit_calls, key=lambda call: call[1]) == [
+        (1, 'job_submit_1.csv', ['--mem=32768M']),
+        (1, 'job_submit_2.csv', ['--time=240']),
+        (1, 'job_submit_3.csv', []),
+    ]
+    submitted_df = pd.read_csv(babs_proj.job_submit_path_abs)
+    assert submitted_df['sub_id'].tolist() == ['sub-01', 'sub-02', 'sub-04']
+    assert submitted_df['job_id'].tolist() == [21, 22, 23]
+    assert submitted_df['task_id'].tolist() == [1, 1, 1]
+
+
+def test_babs_submit_resource_classes(babs_project_subjectlevel, monkeypatch):
+    """Jobs are submitted largest first, each resource class in its own array."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    monkeypatch.setattr(babs_proj, 'get_currently_running_jobs_df', pd.DataFrame)
+    monkeypatch.setattr(babs_proj, 'get_job_status_df', _status_df_for_submit)
+    monkeypatch.setattr(babs_proj, 'ensure_container_images_available', lambda: None)
+    monkeypatch.setattr('babs.interaction.get_max_array_size', lambda _queue: 1001)
+    monkeypatch.setattr(
+        babs_proj.input_datasets,
+        'get_input_sizes',
+        lambda: pd.DataFrame(
+            {'sub_id': ['sub-01', 'sub-02', 'sub-03'], 'input_size': [10, 3000, 20]}
+        ),
+    )
+
+    submit_calls = []
+
+    def _submit(analysis_path, queue, total_jobs, job_submit_path=None, sbatch_args=None):
+        submit_calls.append((_array_number(job_submit_path), total_jobs, sbatch_args))
+        return 30 + _array_number(job_submit_path)
+
+    monkeypatch.setattr('babs.interaction.submit_array', _submit)
+
+    babs_proj.babs_submit(
+        resource_classes=[
+            {'max_input_size': 100, 'hard_memory_limit': '8G'},
+            {'hard_memory_limit': '32G'},
+        ]
+    )
+
+    assert sorted(submit_calls) == [(1, 1, ['--mem=32G']), (2, 2, ['--mem=8G'])]
+    submitted_df = pd.read_csv(babs_proj.job_submit_path_abs)
+    assert submitted_df['sub_id'].tolist() == ['sub-02', 'sub-03', 'sub-01']
+    assert submitted_df['job_id'].tolist() == [31, 32, 32]
+    assert submitted_df['task_id'].tolist() == [1, 1, 2]
+
+
+def test_babs_submit_then_merge(babs_project_subjectlevel, monkeypatch):
+    """The merge job depends on every job array of the submission."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    monkeypatch.setattr(babs_proj, 'get_currently_running_jobs_df', pd.DataFrame)
+    monkeypatch.setattr(babs_proj, 'get_job_status_df', _status_df_for_submit)
+    monkeypatch.setattr(babs_proj, 'ensure_container_images_available', lambda: None)
+    monkeypatch.setattr('babs.interaction.get_max_array_size', lambda _queue: 3)
+
+    submitted_arrays = []
+
+    def _submit(analysis_path, queue, total_jobs, job_submit_path=None, sbatch_args=None):
+        submitted_arrays.append((_array_number(job_submit_path), total_jobs))
+        return 30 + _array_number(job_submit_path)
+
+    merge_calls = []
+
+    def _submit_merge(analysis_path, project_root, queue, job_ids):
+        merge_calls.append((project_root, job_ids))
+        return 99
+
+    monkeypatch.setattr('babs.interaction.submit_array', _submit)
+    monkeypatch.setattr('babs.interaction.submit_merge_job', _submit_merge)
+
+    babs_proj.babs_submit(then_merge=True)
+
+    assert sorted(submitted_arrays) == [(1, 2), (2, 1)]
+    assert merge_calls == [(babs_proj.project_root, [31, 32])]
+
+
 def test_get_currently_running_jobs_df_multiple_job_ids(babs_project_subjectlevel, monkeypatch):
     babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
     status_df = pd.DataFrame(
@@ -657,3 +875,44 @@ def test_status_wait_keyboard_interrupt(babs_project_subjectlevel, monkeypatch,
     assert exc_info.value.code == 130
     captured = capsys.readouterr()
     assert 'Interrupted' in captured.out
+
+
+def test_babs_run_keeps_jobs_in_flight(babs_project_subjectlevel, monkeypatch, capsys):
+    """Each round tops up the submissions to `max_in_flight` until all jobs have results."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    first = _make_statuses(submitted=[False, False, False], has_results=[False, False, False])
+    # sub-01 is running, sub-02 failed, sub-03 was not submitted yet:
+    second = _make_statuses(submitted=[True, True, False], has_results=[False, False, False])
+    second[('sub-01',)] = replace(second[('sub-01',)], scheduler_state=SchedulerState.RUNNING)
+    done = _make_statuses(submitted=[True, True, True], has_results=[True, True, True])
+    call_count = _patch_wait(monkeypatch, babs_proj, [first, second, done])
+
+    submitted = []
+    monkeypatch.setattr(
+        babs_proj,
+        'babs_submit',
+        lambda submit_df, skip_running_jobs: submitted.append(submit_df['sub_id'].tolist()),
+    )
+
+    babs_proj.babs_run(max_in_flight=2, interval=1)
+
+    assert call_count['n'] == 3
+    assert submitted == [['sub-01', 'sub-02'], ['sub-02']]
+    assert 'All jobs finished: 3 with results, 0 failed.' in capsys.readouterr().out
+
+
+def test_babs_run_gives_up_after_max_failures(babs_project_subjectlevel, monkeypatch):
+    """A job that failed `max_failures` times is not resubmitted, and babs run exits 1."""
+    babs_proj = BABSInteraction(project_root=babs_project_subjectlevel)
+    failed = _make_statuses(submitted=[True, True], has_results=[True, False])
+    _patch_wait(monkeypatch, babs_proj, [failed])
+    submitted = []
+    monkeypatch.setattr(
+        babs_proj,
+        'babs_submit',
+        lambda submit_df, skip_running_jobs: submitted.append(submit_df['sub_id'].tolist()),
+    )
+
+    with pytest.raises(SystemExit, match='1'):
+        babs_proj.babs_run(max_in_flight=5, interval=1, max_failures=1)
+    assert submitted == []
@@ -0,0 +1,148 @@
+"""Tests for the local scheduler backend, which runs the jobs on the current machine."""
+
+import time
+
+import pytest
+
+from babs import local_scheduler
+from babs.scheduler import (
+    get_scheduler_backend,
+    request_all_job_status,
+    run_sacct,
+    run_squeue,
+    submit_array,
+)
+from babs.status import failure_causes_from_sacct
+
+
+@pytest.fixture
+def local_scheduler_dir(tmp_path, monkeypatch):
+    state_dir = tmp_path / 'local_scheduler'
+    monkeypatch.setattr(local_scheduler, 'LOCAL_SCHEDULER_DIR', str(state_dir))
+    monkeypatch.setattr(local_scheduler, 'DEPENDENCY_POLL_INTERVAL', 0.1)
+    return state_dir
+
+
+def _wait_for(job_id, timeout=60):
+    deadline = time.time() + timeout
+    while not local_scheduler.job_ended(job_id):
+        if time.time() > deadline:
+            raise TimeoutError(f'Local job {job_id} did not end within {timeout} s')
+        time.sleep(0.1)
+
+
+@pytest.mark.parametrize(
+    ('spec', 'expected'),
+    [
+        (None, ([1], None)),
+        ('1', ([1], None)),
+        ('1-3', ([1, 2, 3], None)),
+        ('1-3%2', ([1, 2, 3], 2)),
+    ],
+)
+def test_parse_array_spec(spec, expected):
+    assert local_scheduler.parse_array_spec(spec) == expected
+
+
+def test_parse_array_spec_invalid():
+    with pytest.raises(ValueError, match='Unsupported `--array`'):
+        local_scheduler.parse_array_spec('1,3,5')
+
+
+def test_parse_sbatch_command(tmp_path):
+    """The submit template's sbatch command line is turned into a local job."""
+    script = tmp_path / 'participant_job.sh'
+    script.write_text('#!/bin/bash\n#SBATCH --cpus-per-task=3\necho hi\n')
+    job = local_scheduler.parse_sbatch_command(
+        [
+            'sbatch',
+            '--export=DSLOCKFILE=/lock',
+            '--mem=8G',
+            '--job-name',
+            'toy',
+            '-e',
+            '/logs/toy.e%A_%a',
+            '-o',
+            '/logs/toy.o%A_%a',
+            '--array=1-4%2',
+            str(script),
+            'ria+file:///in#id',
+            '/out',
+        ],
+        str(tmp_path),
+    )
+    assert job['command'] == [str(script), 'ria+file:///in#id', '/out']
+    assert job['env'] == {'DSLOCKFILE': '/lock'}
+    assert job['task_ids'] == [1, 2, 3, 4]
+    assert job['max_concurrent_tasks'] == 2
+    assert job['cpus_per_task'] == 3
+    assert job['mem'] == '8G'
+    assert job['name'] == 'toy'
+    assert job['error'] == '/logs/toy.e%A_%a'
+
+
+def test_local_job_array(local_scheduler_dir, tmp_path):
+    """Array tasks run with Slurm's environment variables and report like squeue/sacct."""
+    code = tmp_path / 'code'
+    code.mkdir()
+    (tmp_path / 'logs').mkdir()
+    script = code / 'participant_job.sh'
+    script.write_text(
+        '#!/bin/bash\n'
+        'sleep 1\n'
+        'echo "${SLURM_ARRAY_JOB_ID} ${SLURM_ARRAY_TASK_ID} $1 ${DSLOCKFILE}"\n'
+        '[ "${SLURM_ARRAY_TASK_ID}" != 2 ]\n'
+    )
+    script.chmod(0o700)
+    (code / 'submit_job_template.yaml').write_text(
+        f"cmd_template: 'sbatch --export=DSLOCKFILE={tmp_path}/lock --job-name toy"
+        f' -e {tmp_path}/logs/toy.e%A_%a -o {tmp_path}/logs/toy.o%A_%a'
+        f" --array=1-${{max_array}} {script} arg1'\n"
+        "job_name_template: 'toy'\n"
+    )
+
+    job_id = submit_array(str(tmp_path), 'local', 2)
+    running = request_all_job_status('local', job_id)
+    assert running['task_id'].tolist() == [1, 2]
+    assert set(running['state']) <= {'PD', 'R'}
+    assert (running['name'] == 'toy').all()
+
+    _wait_for(job_id)
+    assert run_squeue('local', job_id) == ''
+    assert (tmp_path / 'logs' / f'toy.o{job_id}_1').read_text() == (
+        f'{job_id} 1 arg1 {tmp_path}/lock\n'
+    )
+    assert run_sacct('local', [job_id]).splitlines() == [
+        f'{job_id}_1|COMPLETED||UNLIMITED',
+        f'{job_id}_2|FAILED||UNLIMITED',
+    ]
+    causes = failure_causes_from_sacct(run_sacct('local', [job_id]))
+    assert causes[(job_id, 2)]['cause'] == 'other'
+
+
+def test_local_job_dependency(local_scheduler_dir, tmp_path):
+    """A job with `--dependency=afterany` starts after the jobs it depends on have ended."""
+    backend = get_scheduler_backend('local')
+    first = backend.submit(
+        ['sbatch', '-o', str(tmp_path / 'first.log'), '--wrap', f'sleep 1; touch {tmp_path}/a'],
+        str(tmp_path),
+    )
+    second = backend.submit(
+        [
+            'sbatch',
+            f'--dependency=afterany:{first}',
+            '-o',
+            str(tmp_path / 'second.log'),
+            '--wrap',
+            f'test -e {tmp_path}/a',
+        ],
+        str(tmp_path),
+    )
+    assert second == first + 1
+    _wait_for(second)
+    assert run_sacct('local', [second]) == f'{second}_1|COMPLETED||UNLIMITED\n'
+
+
+def test_get_scheduler_backend_invalid():
+    with pytest.raises(ValueError, match='Invalid job scheduler system type'):
+        get_scheduler_backend('pbs')
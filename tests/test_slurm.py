@@ -11,10 +11,15 @@ import pandas as pd
 import pytest
 
 from babs.scheduler import (
+    SLURM_DEFAULT_MAX_ARRAY_SIZE,
     check_slurm_available,
+    escalated_sbatch_args,
+    get_max_array_size,
     request_all_job_status,
+    resource_class_sbatch_args,
     sbatch_get_job_id,
     squeue_to_pandas,
+    submit_merge_job,
 )
 
 
@@ -156,3 +161,66 @@ def test_request_all_job_status(slurm_available):
     # Test with unsupported queue type
     with pytest.raises(NotImplementedError, match='SGE is not supported'):
         request_all_job_status('sge')
+
+
+def test_get_max_array_size():
+    """MaxArraySize is read from `scontrol show config`, with Slurm's default as fallback."""
+    config = 'ClusterName = test\nMaxArraySize            = 4001\nMaxJobCount = 10000\n'
+    with mock.patch('babs.scheduler.subprocess.run') as mock_run:
+        mock_run.return_value = mock.Mock(returncode=0, stdout=config)
+        assert get_max_array_size('slurm') == 4001
+
+        mock_run.return_value = mock.Mock(returncode=1, stdout='')
+        assert get_max_array_size('slurm') == SLURM_DEFAULT_MAX_ARRAY_SIZE
+
+        mock_run.side_effect = FileNotFoundError('scontrol')
+        assert get_max_array_size('slurm') == SLURM_DEFAULT_MAX_ARRAY_SIZE
+
+    with pytest.raises(ValueError, match='Invalid job scheduler system type'):
+        get_max_array_size('sge')
+
+
+@pytest.mark.parametrize(
+    ('cause', 'req_mem', 'time_limit', 'expected'),
+    [
+        ('oom', '32G', '1-00:00:00', ['--mem=65536M']),
+        ('oom', '4000Mc', '1-00:00:00', ['--mem-per-cpu=8000M']),
+        ('timeout', '32G', '1-00:00:00', ['--time=2880']),
+        ('timeout', '32G', '30:00', ['--time=60']),
+        ('timeout', '32G', 'UNLIMITED', []),
+        ('oom', '', '', []),
+        ('other', '32G', '1-00:00:00', []),
+    ],
+)
+def test_escalated_sbatch_args(cause, req_mem, time_limit, expected):
+    """Jobs that ran out of memory (time) are retried with twice the memory (time)."""
+    assert escalated_sbatch_args(cause, req_mem, time_limit) == expected
+
+
+def test_resource_class_sbatch_args():
+    resource_class = {
+        'max_input_size': 1024,
+        'hard_memory_limit': '16G',
+        'number_of_cpus': '4',
+        'hard_runtime_limit': '04:00:00',
+    }
+    assert resource_class_sbatch_args(resource_class, 'slurm') == [
+        '--mem=16G',
+        '--cpus-per-task=4',
+        '--time=04:00:00',
+    ]
+
+
+def test_submit_merge_job(tmp_path):
+    """The merge job runs `babs merge` after all given job arrays have ended."""
+    (tmp_path / 'code').mkdir()
+    (tmp_path / 'code' / 'submit_job_template.yaml').write_text(
+        'cmd_template: sbatch\njob_name_template: toy\n'
+    )
+    with mock.patch('babs.scheduler.sbatch_get_job_id', return_value=42) as mock_sbatch:
+        assert submit_merge_job(str(tmp_path), '/proj', 'slurm', [31, 32]) == 42
+
+    cmd = mock_sbatch.call_args.args[0]
+    assert cmd[:4] == ['sbatch', '--dependency=afterany:31:32', '--job-name', 'toy_merge']
+    assert cmd[cmd.index('-o') + 1] == str(tmp_path / 'logs' / 'toy_merge.o%j')
+    assert cmd[-1].endswith('babs merge /proj')
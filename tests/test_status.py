@@ -1,16 +1,20 @@
 """Tests for babs.status — data model, CSV I/O, and update logic."""
 
+import json
 import os
 
 import pytest
 
-from babs.scheduler import report_job_status
+from babs.scheduler import report_job_status, report_job_timings
 from babs.status import (
     JobStatus,
     SchedulerState,
     create_initial_statuses,
+    failure_causes_from_sacct,
     job_status_counts,
+    job_timing_summary,
     read_job_status_csv,
+    read_job_timings,
     update_from_branches,
     update_from_scheduler,
     write_job_status_csv,
@@ -433,6 +437,41 @@ class TestUpdateFromScheduler:
             update_from_scheduler(statuses, raw)
 
 
+# -- failure_causes_from_sacct -------------------------------------------------
+
+
+class TestFailureCausesFromSacct:
+    RAW = (
+        '100_1|OUT_OF_MEMORY|32G|1-00:00:00\n'
+        '100_1.batch|OUT_OF_MEMORY||\n'
+        '100_1.extern|COMPLETED||\n'
+        '100_2|FAILED|32G|1-00:00:00\n'
+        '100_2.batch|OUT_OF_MEMORY||\n'
+        '100_3|TIMEOUT|32G|1-00:00:00\n'
+        '100_3.batch|CANCELLED||\n'
+        '100_4|CANCELLED by 1234|32G|1-00:00:00\n'
+        '101_[5-10]|PENDING|32G|1-00:00:00\n'
+    )
+
+    def test_causes(self):
+        causes = failure_causes_from_sacct(self.RAW)
+        assert {ids: cause['cause'] for ids, cause in causes.items()} == {
+            (100, 1): 'oom',
+            # OOM of a step counts even if the task itself is just FAILED:
+            (100, 2): 'oom',
+            (100, 3): 'timeout',
+            (100, 4): 'other',
+        }
+
+    def test_requested_resources_from_task_line(self):
+        causes = failure_causes_from_sacct(self.RAW)
+        assert causes[(100, 1)]['req_mem'] == '32G'
+        assert causes[(100, 1)]['time_limit'] == '1-00:00:00'
+
+    def test_empty(self):
+        assert failure_causes_from_sacct('') == {}
+
+
 # -- create_initial_statuses ---------------------------------------------------
 
 
@@ -629,3 +668,64 @@ class TestReportJobStatus:
         report_job_status(statuses, '/fake/analysis')
         out = capsys.readouterr().out
         assert 'All jobs are completed' in out
+
+
+# -- job timings ---------------------------------------------------------------
+
+
+class TestJobTimings:
+    def _write(self, timings_dir, branch, phases, exit_code=0, node='node01', scratch_kb=1024):
+        record = {
+            'branch': branch,
+            'node': node,
+            'exit_code': exit_code,
+            'scratch_kb': scratch_kb,
+            'phases': phases,
+        }
+        (timings_dir / f'{branch}.json').write_text(json.dumps(record))
+
+    def test_read_skips_unparsable_records(self, tmp_path):
+        self._write(tmp_path, 'job-1-1-sub-01', {'clone': 10})
+        (tmp_path / 'job-1-2-sub-02.json').write_text('{"branch": "job-1-2-sub-0')
+        (tmp_path / 'job-1-3-sub-03.json').write_text('{"branch": "job-1-3-sub-03"}')
+        records = read_job_timings(str(tmp_path))
+        assert [record['branch'] for record in records] == ['job-1-1-sub-01']
+
+    def test_read_missing_dir(self, tmp_path):
+        assert read_job_timings(str(tmp_path / 'timings')) == []
+
+    def test_summary(self, tmp_path):
+        for i, seconds in enumerate([10, 20, 30, 40, 50], start=1):
+            self._write(
+                tmp_path,
+                f'job-1-{i}-sub-0{i}',
+                {'container_run': 100 * seconds, 'clone': seconds},
+                node=f'node0{i % 2}',
+            )
+        # failed during the BIDS App: no zip/push phases
+        self._write(tmp_path, 'job-1-6-sub-06', {'clone': 60}, exit_code=1, scratch_kb=None)
+        summary = job_timing_summary(read_job_timings(str(tmp_path)))
+
+        assert summary['jobs'] == 6
+        assert summary['failed'] == 1
+        assert summary['nodes'] == 2
+        # phases follow the order they run in a job, then the total:
+        assert list(summary['phases']) == ['clone', 'container_run', 'total']
+        assert summary['phases']['clone']['count'] == 6
+        assert summary['phases']['clone']['p50'] == 35
+        assert summary['phases']['clone']['max'] == 60
+        assert summary['phases']['container_run']['count'] == 5
+        assert summary['phases']['total']['max'] == 5050
+        assert summary['scratch_kb']['count'] == 5
+
+    def test_report(self, tmp_path, capsys):
+        self._write(tmp_path, 'job-1-1-sub-01', {'clone': 12, 'container_run': 3600})
+        report_job_timings(job_timing_summary(read_job_timings(str(tmp_path))), str(tmp_path))
+        out = capsys.readouterr().out
+        assert '1 job(s) on 1 node(s) reported timings; 0 of them failed.' in out
+        assert 'container_run' in out
+        assert str(tmp_path) in out
+
+    def test_report_without_records(self, capsys):
+        report_job_timings(job_timing_summary([]), '/fake/analysis/logs/timings')
+        assert 'No timing records yet' in capsys.readouterr().out
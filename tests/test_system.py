@@ -37,3 +37,8 @@ def test_config_file_exists():
 
     # Check that expected system types are in the config
     assert 'slurm' in config
+
+
+def test_local_system_uses_slurm_options():
+    """The local scheduler runs the same sbatch command lines as Slurm."""
+    assert System('local').dict == System('slurm').dict
@@ -11,6 +11,7 @@ import yaml
 from babs.utils import (
     app_output_settings_from_config,
     combine_inclusion_dataframes,
+    get_file_sizes_from_git,
     get_git_show_ref_shasum,
     get_immediate_subdirectories,
     get_repo_hash,
@@ -18,11 +19,16 @@ from babs.utils import (
     get_results_branches_from_ria,
     get_username,
     identify_running_jobs,
+    intersect_inclusion_dataframes,
     parse_select_arg,
+    parse_size,
+    read_datalad_dataset_id,
     read_yaml,
     replace_placeholder_from_config,
     update_submitted_job_ids,
     validate_processing_level,
+    validate_resource_classes,
+    validate_zip_options,
 )
 
 
@@ -96,6 +102,29 @@ def test_app_output_settings_from_config():
         app_output_settings_from_config(multiple_folders_config)
 
 
+def test_validate_zip_options():
+    """Test validation and defaults of the `zip_options` section."""
+    assert validate_zip_options(None) == {
+        'compression_level': None,
+        'num_threads': None,
+        'store_only': False,
+        'parallel_unzip': False,
+        'push_while_zipping': False,
+    }
+    validated = validate_zip_options({'compression_level': 0, 'store_only': True})
+    assert validated['compression_level'] == 0
+    assert validated['store_only'] is True
+
+    with pytest.raises(TypeError, match='must be a mapping'):
+        validate_zip_options(['store_only'])
+    with pytest.raises(ValueError, match='between 0 and 9'):
+        validate_zip_options({'compression_level': 10})
+    with pytest.raises(ValueError, match='positive integer'):
+        validate_zip_options({'num_threads': 0})
+    with pytest.raises(TypeError, match='true or false'):
+        validate_zip_options({'parallel_unzip': 'yes'})
+
+
 def create_git_repo(tmp_path):
     """Helper function to create a git repository."""
     repo_path = tmp_path / 'git_repo'
@@ -311,6 +340,49 @@ def test_combine_inclusion_dataframes():
         combine_inclusion_dataframes([])
 
 
+def test_intersect_inclusion_dataframes():
+    """All DataFrames are intersected at once, with the keys each of them lacks."""
+    df1 = pd.DataFrame(
+        {'sub_id': ['sub-03', 'sub-01', 'sub-02', 'sub-01'], 'ses_id': ['A', 'A', 'A', 'B']}
+    )
+    df2 = pd.DataFrame(
+        {'sub_id': ['sub-01', 'sub-02', 'sub-04'], 'ses_id': ['A', 'A', 'A'], 'size': [1, 2, 3]}
+    )
+    df3 = pd.DataFrame({'sub_id': ['sub-02', 'sub-01', 'sub-01'], 'ses_id': ['A', 'A', 'B']})
+
+    combined_df, dropouts = intersect_inclusion_dataframes([df1, df2, df3])
+
+    # in the order of the first DataFrame:
+    assert combined_df.values.tolist() == [['sub-01', 'A', 1], ['sub-02', 'A', 2]]
+    assert [dropout.values.tolist() for dropout in dropouts] == [
+        [['sub-04', 'A']],
+        [['sub-03', 'A'], ['sub-01', 'B']],
+        [['sub-03', 'A'], ['sub-04', 'A']],
+    ]
+
+    with pytest.raises(ValueError, match='no columns in common'):
+        intersect_inclusion_dataframes([df1, pd.DataFrame({'subject': ['sub-01']})])
+
+
+def test_intersect_inclusion_dataframes_mixed_columns():
+    """DataFrames with different columns are matched on the columns each pair shares."""
+    df1 = pd.DataFrame({'sub_id': ['sub-01', 'sub-01', 'sub-02'], 'ses_id': ['A', 'B', 'A']})
+    df2 = pd.DataFrame({'sub_id': ['sub-01', 'sub-02', 'sub-03'], 'ses_id': ['B', 'B', 'A']})
+    df3 = pd.DataFrame({'sub_id': ['sub-01', 'sub-03']})
+
+    combined_df, dropouts = intersect_inclusion_dataframes([df1, df2, df3])
+
+    # (sub-02, A) and (sub-02, B) do not match on both `sub_id` and `ses_id`:
+    assert combined_df.values.tolist() == [['sub-01', 'B']]
+    assert combined_df.equals(df1.merge(df2).merge(df3))
+    assert [dropout.values.tolist() for dropout in dropouts] == [
+        [['sub-02', 'B'], ['sub-03', 'A']],
+        [['sub-01', 'A'], ['sub-02', 'A']],
+        [['sub-02']],
+    ]
+    assert combine_inclusion_dataframes([df1, df2, df3]).equals(combined_df)
+
+
 def test_running_jobs():
     # This is the list of the most recently submitted jobs
     last_submitted_jobs_df = pd.DataFrame(
@@ -574,7 +646,14 @@ def test_submitted_multiple_jobs():
         {'sub_id': ['sub-0001', 'sub-0002'], 'job_id': [1, 2], 'task_id': [1, 1]}
     )
 
-    with pytest.raises(ValueError, match='There should be only one job id'):
+    # a submission split into several arrays: each row keeps its own array's job id
+    updated_df = update_submitted_job_ids(results_df, submitted_df)
+    assert updated_df['submitted'].all()
+    assert updated_df['job_id'].tolist() == [1, 2]
+    assert updated_df['task_id'].tolist() == [1, 1]
+
+    submitted_df.loc[1, 'job_id'] = None
+    with pytest.raises(ValueError, match='must have a job id'):
         update_submitted_job_ids(results_df, submitted_df)
 
 
@@ -586,3 +665,82 @@ def test_submitted_missing_sub_id():
 
     with pytest.raises(ValueError, match='job_submit_df must have a sub_id column'):
         update_submitted_job_ids(results_df, submitted_df)
+
+
+def test_parse_size():
+    assert parse_size(123) == 123
+    assert parse_size('2G') == 2 * 1024**3
+    assert parse_size('1.5m') == int(1.5 * 1024**2)
+    assert parse_size('500MB') == 500 * 1024**2
+    with pytest.raises(ValueError, match='Invalid size'):
+        parse_size('lots')
+
+
+def test_get_file_sizes_from_git(tmp_path):
+    """Sizes of annexed files come from their key, without their content."""
+    subprocess.run(['git', 'init', '-q', str(tmp_path)], check=True)
+    (tmp_path / 'sub-01' / 'anat').mkdir(parents=True)
+    (tmp_path / 'sub-01' / 'anat' / 'sub-01_T1w.json').write_text('{"a": 1}')
+    key = 'SHA256E-s123456--' + 'a' * 64 + '.nii.gz'
+    (tmp_path / 'sub-01' / 'anat' / 'sub-01_T1w.nii.gz').symlink_to(
+        f'../../.git/annex/objects/Xx/Yy/{key}/{key}'
+    )
+    (tmp_path / 'sub-01' / 'anat' / 'sub-01_T2w.nii.gz').symlink_to(
+        f'../../.git/annex/objects/Xx/Yy/{key}/{key}'
+    )
+    subprocess.run(['git', 'add', '.'], cwd=tmp_path, check=True)
+    subprocess.run(
+        ['git', '-c', 'user.name=a', '-c', 'user.email=a@b.c', 'commit', '-qm', 'add'],
+        cwd=tmp_path,
+        check=True,
+    )
+
+    assert get_file_sizes_from_git(tmp_path) == {
+        'sub-01/anat/sub-01_T1w.json': 8,
+        'sub-01/anat/sub-01_T1w.nii.gz': 123456,
+        'sub-01/anat/sub-01_T2w.nii.gz': 123456,
+    }
+
+
+def test_validate_resource_classes():
+    validated = validate_resource_classes(
+        [
+            {'max_input_size': '1G', 'hard_memory_limit': '8G'},
+            {'max_input_size': '4G', 'hard_memory_limit': '16G', 'hard_runtime_limit': '8:00:00'},
+            {'hard_memory_limit': '32G'},
+        ]
+    )
+    assert [rc['max_input_size'] for rc in validated] == [1024**3, 4 * 1024**3, None]
+
+    with pytest.raises(TypeError, match='non-empty list'):
+        validate_resource_classes({'max_input_size': '1G'})
+    with pytest.raises(ValueError, match='Invalid key'):
+        validate_resource_classes([{'max_input_size': '1G', 'memory': '8G'}])
+    with pytest.raises(ValueError, match='only the last class'):
+        validate_resource_classes([{'hard_memory_limit': '8G'}, {'hard_memory_limit': '16G'}])
+    with pytest.raises(ValueError, match='increasing'):
+        validate_resource_classes([{'max_input_size': '4G'}, {'max_input_size': '1G'}])
+
+
+def test_read_datalad_dataset_id(tmp_path):
+    assert read_datalad_dataset_id(str(tmp_path)) is None
+
+    (tmp_path / '.datalad').mkdir()
+    config_path = tmp_path / '.datalad' / 'config'
+    config_path.write_text('[datalad "other"]\n\tid = not-this-one\n')
+    assert read_datalad_dataset_id(str(tmp_path)) is None
+
+    config_path.write_text(
+        '[datalad "other"]\n\tid = not-this-one\n'
+        '[datalad "dataset"]\n\tid = 238da2f2-2fc4-4b88-a2c5-aa6e754b5d0b\n'
+        '[datalad "ria"]\n\tid = not-this-one-either\n'
+    )
+    assert read_datalad_dataset_id(str(tmp_path)) == '238da2f2-2fc4-4b88-a2c5-aa6e754b5d0b'
+
+    # any git config syntax, e.g. quoted values, comments and case variants:
+    config_path.write_text(
+        '# the id of this dataset\n'
+        '[DataLad "dataset"]\n'
+        '\tID = "238da2f2-2fc4-4b88-a2c5-aa6e754b5d0b" ; generated by datalad\n'
+    )
+    assert read_datalad_dataset_id(str(tmp_path)) == '238da2f2-2fc4-4b88-a2c5-aa6e754b5d0b'
@@ -0,0 +1,223 @@
+"""Tests of listing the members of zip files without getting them."""
+
+import http.client
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import datalad.api as dlapi
+import pytest
+
+from babs import zip_members
+from babs.zip_members import get_zip_member_names_batch
+
+
+def _write_zip(path, members):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+
+
+@pytest.fixture
+def annexed_zip(tmp_path, monkeypatch):
+    """A zip file "annexed" as a symlink to its key, with an empty member cache."""
+    monkeypatch.setattr(zip_members, 'ZIP_MEMBERS_CACHE_DIR', str(tmp_path / 'cache'))
+    dataset_path = tmp_path / 'freesurfer'
+    key_path = dataset_path / '.git' / 'annex' / 'objects' / 'MD5E-s1000--0123abcd.zip'
+    key_path.parent.mkdir(parents=True)
+    # an incompressible member, so that its data is much larger than the central directory:
+    _write_zip(
+        key_path, {'freesurfer/sub-01/mri/aseg.mgz': os.urandom(2 * 1024 * 1024), 'x.txt': 'x'}
+    )
+    zip_path = dataset_path / 'sub-01_freesurfer-7-3-2.zip'
+    zip_path.symlink_to(os.path.relpath(key_path, dataset_path))
+    return dataset_path, zip_path, key_path
+
+
+def _annexed_zip(dataset_path, name, members):
+    key_path = dataset_path / '.git' / 'annex' / 'objects' / f'MD5E-s1000--{name}.zip'
+    key_path.parent.mkdir(parents=True, exist_ok=True)
+    _write_zip(key_path, members)
+    zip_path = dataset_path / f'{name}.zip'
+    zip_path.symlink_to(os.path.relpath(key_path, dataset_path))
+    return zip_path, key_path
+
+
+class _RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serve `self.server.content` with support for `Range: bytes=<start>-<end>`."""
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = self.headers['Range'].removeprefix('bytes=').split('-')
+        data = self.server.content[int(start) : int(end) + 1]
+        self.server.bytes_sent += len(data)
+        self.send_response(206)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ChunkedHandler(_RangeRequestHandler):
+    """Like `_RangeRequestHandler`, but without a `Content-Length` (a chunked response)."""
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+
+class _IgnoredRangeHandler(_RangeRequestHandler):
+    """Like `_RangeRequestHandler`, but answers range requests with the whole file."""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+        try:
+            self.wfile.write(self.server.content)
+        except OSError:  # the client closed the connection
+            pass
+
+
+def test_get_zip_member_names_batch_is_cached_by_annex_key(annexed_zip):
+    dataset_path, zip_path, key_path = annexed_zip
+    expected = ['freesurfer/sub-01/mri/aseg.mgz', 'x.txt']
+    assert get_zip_member_names_batch(str(dataset_path), [zip_path.name]) == [expected]
+
+    # Once the content is dropped, the member names come from the cache:
+    key_path.unlink()
+    assert get_zip_member_names_batch(str(dataset_path), [str(zip_path)]) == [expected]
+
+
+def test_get_zip_member_names_batch_with_range_requests(annexed_zip, monkeypatch):
+    """Without the content, only the end of the zip file is read from its URL."""
+    dataset_path, zip_path, key_path = annexed_zip
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeRequestHandler)
+    server.content = key_path.read_bytes()
+    server.bytes_sent = 0
+    key_path.unlink()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/{key_path.name}'
+    monkeypatch.setattr(zip_members, '_get_annex_urls', lambda *_args: [url])
+
+    def _fail_get(**_kwargs):
+        raise AssertionError('the zip file should not be got')
+
+    monkeypatch.setattr(dlapi, 'get', _fail_get)
+    try:
+        names = get_zip_member_names_batch(str(dataset_path), [zip_path.name])[0]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert names == ['freesurfer/sub-01/mri/aseg.mgz', 'x.txt']
+    assert server.bytes_sent <= zip_members.RANGE_READ_SIZE < len(server.content)
+
+
+@pytest.fixture
+def getting_dataset(tmp_path, monkeypatch):
+    """A dataset of dropped, annexed zip files; records the `datalad get`/`drop` calls."""
+    monkeypatch.setattr(zip_members, 'ZIP_MEMBERS_CACHE_DIR', str(tmp_path / 'cache'))
+    dataset_path = tmp_path / 'freesurfer'
+    contents = {}
+    for sub in ('sub-01', 'sub-02'):
+        zip_path, key_path = _annexed_zip(dataset_path, sub, {f'freesurfer/{sub}/x': 'x'})
+        contents[str(zip_path)] = (key_path, key_path.read_bytes())
+        key_path.unlink()
+    calls = []
+
+    def _get(path, dataset):
+        calls.append(('get', sorted(path)))
+        for zip_path in path:
+            key_path, content = contents[zip_path]
+            key_path.write_bytes(content)
+
+    def _drop(path, dataset):
+        calls.append(('drop', sorted(path)))
+        for zip_path in path:
+            contents[zip_path][0].unlink()
+
+    monkeypatch.setattr(dlapi, 'get', _get)
+    monkeypatch.setattr(dlapi, 'drop', _drop)
+    return dataset_path, sorted(contents), calls
+
+
+def test_get_zip_member_names_batch_gets_all_at_once(getting_dataset, monkeypatch):
+    """Zip files that can only be listed by getting them are got in one `datalad get`."""
+    dataset_path, zip_paths, calls = getting_dataset
+    monkeypatch.setattr(zip_members, '_get_annex_urls', lambda *_args: [])
+
+    names = get_zip_member_names_batch(str(dataset_path), zip_paths, max_workers=2)
+
+    assert names == [['freesurfer/sub-01/x'], ['freesurfer/sub-02/x']]
+    assert calls == [('get', zip_paths), ('drop', zip_paths)]
+
+
+@pytest.mark.parametrize('handler', [_ChunkedHandler, _IgnoredRangeHandler, None])
+def test_get_zip_member_names_batch_falls_back_to_get(getting_dataset, monkeypatch, handler):
+    """A URL without range requests, or an unreachable one, falls back to `datalad get`."""
+    dataset_path, zip_paths, calls = getting_dataset
+    server = None
+    if handler is None:
+        url = 'http://127.0.0.1:9/unreachable.zip'
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.content = os.urandom(4 * 1024 * 1024)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/sub-01.zip'
+    monkeypatch.setattr(zip_members, '_get_annex_urls', lambda *_args: [url])
+    # The body of a response to a range request is only read if it is a range:
+    read_responses = []
+    read = http.client.HTTPResponse.read
+
+    def _read(response, *args):
+        read_responses.append((response._method, response.status))
+        return read(response, *args)
+
+    monkeypatch.setattr(http.client.HTTPResponse, 'read', _read)
+    try:
+        names = get_zip_member_names_batch(str(dataset_path), zip_paths[:1])
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    assert names == [['freesurfer/sub-01/x']]
+    assert calls == [('get', zip_paths[:1]), ('drop', zip_paths[:1])]
+    assert ('GET', 200) not in read_responses
+
+
+def test_get_zip_member_names_batch_gets_unlocked_pointer_files(tmp_path, monkeypatch):
+    """An unlocked annexed zip file without its content is a pointer file, and is got."""
+    monkeypatch.setattr(zip_members, 'ZIP_MEMBERS_CACHE_DIR', str(tmp_path / 'cache'))
+    dataset_path = tmp_path / 'freesurfer'
+    dataset_path.mkdir()
+    zip_path = dataset_path / 'sub-01.zip'
+    zip_path.write_text('/annex/objects/MD5E-s1000--0123abcd.zip\n')
+    calls = []
+
+    def _get(path, dataset):
+        calls.append('get')
+        _write_zip(zip_path, {'freesurfer/sub-01/x': 'x'})
+
+    def _drop(path, dataset):
+        calls.append('drop')
+        zip_path.write_text('/annex/objects/MD5E-s1000--0123abcd.zip\n')
+
+    monkeypatch.setattr(dlapi, 'get', _get)
+    monkeypatch.setattr(dlapi, 'drop', _drop)
+
+    assert get_zip_member_names_batch(str(dataset_path), [zip_path.name]) == [
+        ['freesurfer/sub-01/x']
+    ]
+    assert calls == ['get', 'drop']